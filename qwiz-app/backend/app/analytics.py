@@ -1,6 +1,12 @@
+import asyncio
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Awaitable, Callable, Dict, Optional, Set
 
+from app.config import settings
+from app.event_sink import AnalyticsEventSink
+from app.repository import FirestoreRepository
+from app.question_cache import QuestionCache
+from app.state_store import InMemoryStateStore, SessionStateStore
 from app.schemas import (
     StudentJoinEvent,
     StudentLeaveEvent,
@@ -10,88 +16,158 @@ from app.schemas import (
 )
 
 
+class BroadcastCoalescer:
+    """
+    Per-session dirty-flag scheduler for session-wide update frames.
+    Update requests mark a kind (e.g. "analytics", "leaderboard") as dirty; at the end of
+    each tick every dirty kind is emitted once, so a burst of answers costs one frame per kind.
+    """
+
+    def __init__(
+        self,
+        emit: Callable[[str, str], Awaitable[None]],
+        base_tick_ms: float,
+        per_student_tick_ms: float = 0.0,
+        max_tick_ms: Optional[float] = None,
+    ):
+        self._emit = emit
+        self.base_tick_ms = base_tick_ms
+        self.per_student_tick_ms = per_student_tick_ms
+        self.max_tick_ms = max_tick_ms if max_tick_ms is not None else base_tick_ms
+        self._dirty: Dict[str, Set[str]] = {}  # session_id -> kinds waiting for the next tick
+        self._timers: Dict[str, asyncio.Task] = {}  # session_id -> pending tick task
+
+    def tick_seconds(self, class_size: int) -> float:
+        """Tick length for a session, growing with class size up to the configured maximum."""
+        tick_ms = self.base_tick_ms + self.per_student_tick_ms * class_size
+        return max(0.0, min(tick_ms, max(self.max_tick_ms, self.base_tick_ms))) / 1000
+
+    async def mark_dirty(self, session_id: str, kind: str, class_size: int = 0):
+        """Schedules a frame of the given kind for the session's next tick."""
+        delay = self.tick_seconds(class_size)
+        if delay <= 0:
+            # Coalescing disabled - emit straight away
+            await self._emit(session_id, kind)
+            return
+
+        self._dirty.setdefault(session_id, set()).add(kind)
+        if session_id not in self._timers:
+            self._timers[session_id] = asyncio.create_task(self._tick(session_id, delay))
+
+    async def _tick(self, session_id: str, delay: float):
+        """Waits one tick, then emits every kind that was marked dirty meanwhile."""
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            # flush() or discard() may already have replaced this timer with a newer one
+            if self._timers.get(session_id) is asyncio.current_task():
+                del self._timers[session_id]
+        await self._emit_dirty(session_id)
+
+    async def _emit_dirty(self, session_id: str):
+        for kind in sorted(self._dirty.pop(session_id, set())):
+            try:
+                await self._emit(session_id, kind)
+            except Exception as e:
+                print(f"Error emitting {kind} update for session {session_id}: {e}")
+
+    async def flush(self, session_id: str):
+        """Emits any pending frames for the session immediately and cancels its timer."""
+        timer = self._timers.pop(session_id, None)
+        if timer:
+            timer.cancel()
+        await self._emit_dirty(session_id)
+
+    def discard(self, session_id: str):
+        """Drops pending frames for the session without emitting them."""
+        timer = self._timers.pop(session_id, None)
+        if timer:
+            timer.cancel()
+        self._dirty.pop(session_id, None)
+
+
 class AnalyticsService:
     """Service for tracking and aggregating real-time session analytics."""
 
-    def __init__(self, db_client, session_manager):
+    def __init__(
+        self,
+        db_client,
+        session_manager,
+        event_sink: Optional[AnalyticsEventSink] = None,
+        repository: Optional[FirestoreRepository] = None,
+        question_cache: Optional[QuestionCache] = None,
+        state: Optional[SessionStateStore] = None,
+    ):
         self.db = db_client
         self.session_manager = session_manager
-        # In-memory tracking for real-time calculations
-        self.active_students: Dict[str, set] = {}  # session_id -> set of student_ids
-        self.session_stats: Dict[str, Dict] = {}  # session_id -> stats
-        self.student_scores: Dict[str, Dict[str, Dict]] = {}  # session_id -> student_id -> score_data
-        self.student_names: Dict[str, Dict[str, str]] = {}  # session_id -> student_id -> name
-        self.student_answers: Dict[str, Dict[str, list]] = {}  # session_id -> student_id -> list of answers
-
-    def set_student_name(self, session_id: str, student_id: str, name: str):
+        # All Firestore access goes through the repository so it never blocks the event loop
+        self.repository = repository or FirestoreRepository(db_client)
+        # Question documents are served from memory when grading answers
+        self.question_cache = question_cache or QuestionCache(self.repository)
+        # Analytics events are buffered and written to Firestore in batches
+        self.event_sink = event_sink or AnalyticsEventSink(
+            self.repository,
+            batch_size=settings.ANALYTICS_FLUSH_BATCH_SIZE,
+            flush_interval_ms=settings.ANALYTICS_FLUSH_INTERVAL_MS,
+            max_buffer=settings.ANALYTICS_BUFFER_MAX_EVENTS,
+        )
+        # Students, scores, answers and stats; a shared store lets several workers serve one session
+        self.state = state or InMemoryStateStore()
+        # Analytics and leaderboard frames are merged and sent at most once per tick
+        self.coalescer = BroadcastCoalescer(
+            self._emit_update,
+            base_tick_ms=settings.ANALYTICS_TICK_MS,
+            per_student_tick_ms=settings.ANALYTICS_TICK_PER_STUDENT_MS,
+            max_tick_ms=settings.ANALYTICS_TICK_MAX_MS,
+        )
+
+    async def set_student_name(self, session_id: str, student_id: str, name: str):
         """Set or update a student's display name."""
-        if session_id not in self.student_names:
-            self.student_names[session_id] = {}
-        self.student_names[session_id][student_id] = name
+        await self.state.set_student_name(session_id, student_id, name)
 
     async def track_student_join(self, session_id: str, student_id: str, student_name: str = None):
         """Track when a student joins a session."""
+        await self.record_student_join(session_id, student_id, student_name)
+
+        # Update and broadcast session analytics
+        await self._update_session_analytics(session_id)
+
+    async def record_student_join(self, session_id: str, student_id: str, student_name: str = None):
+        """Applies a join to session state and queues its event, without scheduling update frames."""
         event = StudentJoinEvent(student_id=student_id, session_id=session_id)
 
-        # Add to in-memory tracking
-        if session_id not in self.active_students:
-            self.active_students[session_id] = set()
-            self.student_scores[session_id] = {}
-            self.student_names[session_id] = {}
-            self.student_answers[session_id] = {}
-        self.active_students[session_id].add(student_id)
-
-        # Store student name if provided
-        if student_name:
-            self.student_names[session_id][student_id] = student_name
-
-        # Initialize student score tracking
-        if student_id not in self.student_scores[session_id]:
-            self.student_scores[session_id][student_id] = {
-                "score": 0,
-                "correct_answers": 0,
-                "total_answers": 0,
-                "total_response_time": 0,
-            }
-
-        # Initialize student answers tracking
-        if student_id not in self.student_answers[session_id]:
-            self.student_answers[session_id][student_id] = []
+        # Mark active; a returning student keeps their score and answers
+        await self.state.add_student(session_id, student_id, student_name)
 
         # Save event to Firestore
-        analytics_ref = self.db.collection("sessions").document(session_id).collection("analytics")
-        await self._save_event(analytics_ref, "student_join", event.model_dump())
+        await self._save_event(session_id, "student_join", event.model_dump())
+
+    async def track_student_leave(self, session_id: str, student_id: str):
+        """Track when a student leaves a session."""
+        await self.record_student_leave(session_id, student_id)
 
         # Update and broadcast session analytics
         await self._update_session_analytics(session_id)
 
-    async def track_student_leave(self, session_id: str, student_id: str):
-        """Track when a student leaves a session."""
+    async def record_student_leave(self, session_id: str, student_id: str):
+        """Applies a leave to session state and queues its event, without scheduling update frames."""
         event = StudentLeaveEvent(student_id=student_id, session_id=session_id)
 
-        # Remove from in-memory tracking
-        if session_id in self.active_students:
-            self.active_students[session_id].discard(student_id)
+        # Remove from the active set
+        await self.state.remove_active_student(session_id, student_id)
 
         # Save event to Firestore
-        analytics_ref = self.db.collection("sessions").document(session_id).collection("analytics")
-        await self._save_event(analytics_ref, "student_leave", event.model_dump())
-
-        # Update and broadcast session analytics
-        await self._update_session_analytics(session_id)
+        await self._save_event(session_id, "student_leave", event.model_dump())
 
     async def track_question_generated(self, session_id: str, question_id: str, method: str = "AI"):
         """Track when a question is generated."""
         event = QuestionGeneratedEvent(question_id=question_id, session_id=session_id, generation_method=method)
 
         # Save event to Firestore
-        analytics_ref = self.db.collection("sessions").document(session_id).collection("analytics")
-        await self._save_event(analytics_ref, "question_generated", event.model_dump())
+        await self._save_event(session_id, "question_generated", event.model_dump())
 
         # Update session stats
-        if session_id not in self.session_stats:
-            self.session_stats[session_id] = {"questions": 0, "answers": 0, "total_response_time": 0}
-        self.session_stats[session_id]["questions"] += 1
+        await self.state.increment_stats(session_id, questions=1)
 
         # Update and broadcast session analytics
         await self._update_session_analytics(session_id)
@@ -104,8 +180,33 @@ class AnalyticsService:
         selected_option: str,
         correct_answer: str,
         response_time_ms: Optional[int] = None,
+        question_text: Optional[str] = None,
     ):
-        """Track when a student submits an answer."""
+        """Track when a student submits an answer. Pass question_text if the caller already has the question."""
+        stats = await self.record_answer(
+            session_id, student_id, question_id, selected_option, correct_answer, response_time_ms, question_text
+        )
+
+        # Update session stats
+        await self.state.increment_stats(session_id, **stats)
+
+        # Update and broadcast session analytics, and schedule an updated leaderboard
+        await self.schedule_updates(session_id, leaderboard=True)
+
+    async def record_answer(
+        self,
+        session_id: str,
+        student_id: str,
+        question_id: str,
+        selected_option: str,
+        correct_answer: str,
+        response_time_ms: Optional[int] = None,
+        question_text: Optional[str] = None,
+    ) -> Dict[str, int]:
+        """
+        Scores an answer, stores it and queues its event. Returns the session stats increments,
+        so callers handling several answers can apply them in one update.
+        """
         is_correct = selected_option == correct_answer
 
         # Calculate points earned
@@ -125,76 +226,41 @@ class AnalyticsService:
             response_time_ms=response_time_ms,
         )
 
-        # Get question details from Firestore for answer tracking
-        try:
-            question_ref = (
-                self.db.collection("sessions").document(session_id).collection("questions").document(question_id)
-            )
-            question_doc = question_ref.get()
-            question_text = "Question not found"
-            if question_doc.exists:
-                question_data = question_doc.to_dict()
-                question_text = question_data.get("questionText", "Question not found")
-        except Exception as e:
-            print(f"Error fetching question details: {e}")
-            question_text = "Question not found"
-
-        # Store answer details for end-of-session results
-        if session_id in self.student_answers and student_id in self.student_answers[session_id]:
-            self.student_answers[session_id][student_id].append(
-                {
-                    "question_id": question_id,
-                    "question_text": question_text,
-                    "student_answer": selected_option,
-                    "correct_answer": correct_answer,
-                    "is_correct": is_correct,
-                    "points_earned": points_earned,
-                }
-            )
+        # Get question details for answer tracking (from the question cache, not Firestore)
+        if question_text is None:
+            try:
+                question_data = await self.question_cache.get(session_id, question_id)
+                question_text = "Question not found"
+                if question_data is not None:
+                    question_text = question_data.get("questionText", "Question not found")
+            except Exception as e:
+                print(f"Error fetching question details: {e}")
+                question_text = "Question not found"
+
+        # Store answer details for end-of-session results and update the student's score
+        await self.state.record_answer(
+            session_id,
+            student_id,
+            {
+                "question_id": question_id,
+                "question_text": question_text,
+                "student_answer": selected_option,
+                "correct_answer": correct_answer,
+                "is_correct": is_correct,
+                "points_earned": points_earned,
+            },
+            response_time_ms,
+        )
 
         # Save event to Firestore
-        analytics_ref = self.db.collection("sessions").document(session_id).collection("analytics")
-        await self._save_event(analytics_ref, "answer_submitted", event.model_dump())
-
-        # Update session stats
-        if session_id not in self.session_stats:
-            self.session_stats[session_id] = {
-                "questions": 0,
-                "answers": 0,
-                "total_response_time": 0,
-                "correct_answers": 0,
-            }
-
-        stats = self.session_stats[session_id]
-        stats["answers"] = stats.get("answers", 0) + 1
-        if is_correct:
-            stats["correct_answers"] = stats.get("correct_answers", 0) + 1
-        if response_time_ms:
-            stats["total_response_time"] = stats.get("total_response_time", 0) + response_time_ms
-
-        # Update individual student scores
-        if session_id in self.student_scores and student_id in self.student_scores[session_id]:
-            student_data = self.student_scores[session_id][student_id]
-            student_data["total_answers"] += 1
-            if is_correct:
-                student_data["correct_answers"] += 1
-                student_data["score"] += points_earned
-            if response_time_ms:
-                student_data["total_response_time"] += response_time_ms
+        await self._save_event(session_id, "answer_submitted", event.model_dump())
 
-        # Update and broadcast session analytics
-        await self._update_session_analytics(session_id)
-
-        # Also broadcast updated leaderboard after each answer
-        leaderboard = await self.get_leaderboard(session_id)
-        await self.session_manager.broadcast(
-            session_id, {"type": "leaderboard_update", "leaderboard": leaderboard}  # Already a dict
-        )
+        return {"answers": 1, "correct_answers": 1 if is_correct else 0, "total_response_time": response_time_ms or 0}
 
     async def get_session_analytics(self, session_id: str) -> SessionAnalytics:
         """Get current analytics summary for a session."""
-        active_count = len(self.active_students.get(session_id, set()))
-        stats = self.session_stats.get(session_id, {})
+        active_count = await self.state.active_student_count(session_id)
+        stats = await self.state.get_stats(session_id)
 
         # Calculate averages
         avg_response_time = None
@@ -214,17 +280,34 @@ class AnalyticsService:
             accuracy_percentage=accuracy,
         )
 
-    async def _update_session_analytics(self, session_id: str):
-        """Update and broadcast current session analytics."""
-        analytics = await self.get_session_analytics(session_id)
-
-        # Broadcast to all connected clients in the session
-        await self.session_manager.broadcast(
-            session_id, {"type": "analytics_update", "analytics": analytics.model_dump(mode="json")}
-        )
+    async def _class_size(self, session_id: str) -> int:
+        return await self.state.active_student_count(session_id)
 
-    async def _save_event(self, collection_ref, event_type: str, event_data: dict):
-        """Save an analytics event to Firestore."""
+    async def _update_session_analytics(self, session_id: str):
+        """Schedule a broadcast of current session analytics for the next tick."""
+        await self.schedule_updates(session_id)
+
+    async def schedule_updates(self, session_id: str, leaderboard: bool = False):
+        """Schedules analytics (and optionally leaderboard) frames for the session's next tick."""
+        class_size = await self._class_size(session_id)
+        await self.coalescer.mark_dirty(session_id, "analytics", class_size)
+        if leaderboard:
+            await self.coalescer.mark_dirty(session_id, "leaderboard", class_size)
+
+    async def _emit_update(self, session_id: str, kind: str):
+        """Build and broadcast one coalesced update frame to all connected clients in the session."""
+        if kind == "analytics":
+            analytics = await self.get_session_analytics(session_id)
+            message = {"type": "analytics_update", "analytics": analytics.model_dump(mode="json")}
+        elif kind == "leaderboard":
+            leaderboard = await self.get_leaderboard(session_id)
+            message = {"type": "leaderboard_update", "leaderboard": leaderboard}  # Already a dict
+        else:
+            return
+        await self.session_manager.broadcast(session_id, message)
+
+    async def _save_event(self, session_id: str, event_type: str, event_data: dict):
+        """Queue an analytics event for the next batched write to Firestore."""
         try:
             # Convert datetime objects to Firestore timestamps
             if "timestamp" in event_data and isinstance(event_data["timestamp"], datetime):
@@ -232,7 +315,7 @@ class AnalyticsService:
 
             # Add event type and save
             event_data["event_type"] = event_type
-            collection_ref.add(event_data)
+            await self.event_sink.add(session_id, event_data)
         except Exception as e:
             print(f"Error saving analytics event: {e}")
 
@@ -240,10 +323,12 @@ class AnalyticsService:
         """Get current session leaderboard with student names."""
         student_list = []
 
-        if session_id in self.student_scores:
-            student_names = self.student_names.get(session_id, {})
+        ranked = await self.state.ranked_students(session_id, limit)
+        if ranked:
+            student_names = await self.state.student_names(session_id)
 
-            for student_id, data in self.student_scores[session_id].items():
+            # Top students come straight from the ranked structure - no per-call sort
+            for student_id, data in ranked:
                 avg_response_time = None
                 if data["total_answers"] > 0 and data["total_response_time"] > 0:
                     avg_response_time = data["total_response_time"] / data["total_answers"]
@@ -261,39 +346,37 @@ class AnalyticsService:
                     }
                 )
 
-        # Sort by score (highest first)
-        student_list.sort(key=lambda x: x["score"], reverse=True)
+        return {"session_id": session_id, "students": student_list}
 
-        return {"session_id": session_id, "students": student_list[:limit]}
-
-    def get_student_session_results(self, session_id: str, student_id: str) -> dict:
-        """Get detailed session results for a specific student."""
+    async def get_student_session_results(
+        self,
+        session_id: str,
+        student_id: str,
+        final_rank: Optional[int] = None,
+        total_students: Optional[int] = None,
+        student_names: Optional[Dict[str, str]] = None,
+    ) -> dict:
+        """
+        Get detailed session results for a specific student.
+        Callers walking the leaderboard in order can pass the rank, class size and names they already know.
+        """
         # Get student's score and stats
-        student_score_data = {}
-        if session_id in self.student_scores and student_id in self.student_scores[session_id]:
-            student_score_data = self.student_scores[session_id][student_id]
+        student_score_data = await self.state.get_student_score(session_id, student_id) or {}
 
         # Get student name
-        student_name = "Unknown Student"
-        if session_id in self.student_names and student_id in self.student_names[session_id]:
-            student_name = self.student_names[session_id][student_id]
-
-        # Calculate rank
-        final_rank = 0
-        total_students = 0
-        if session_id in self.student_scores:
-            # Sort students by score
-            sorted_students = sorted(self.student_scores[session_id].items(), key=lambda x: x[1]["score"], reverse=True)
-            total_students = len(sorted_students)
-            for idx, (sid, _) in enumerate(sorted_students, 1):
-                if sid == student_id:
-                    final_rank = idx
-                    break
+        if student_names is None:
+            student_names = await self.state.student_names(session_id)
+        student_name = student_names.get(student_id, "Unknown Student")
+
+        # Look up rank in O(log N) from the ranked leaderboard
+        if total_students is None:
+            total_students = await self.state.student_count(session_id)
+        if final_rank is None:
+            final_rank = await self.state.student_rank(session_id, student_id)
+        final_rank = final_rank or 0
 
         # Get question results
-        question_results = []
-        if session_id in self.student_answers and student_id in self.student_answers[session_id]:
-            question_results = self.student_answers[session_id][student_id]
+        question_results = await self.state.get_student_answers(session_id, student_id)
 
         return {
             "student_id": student_id,
@@ -306,22 +389,21 @@ class AnalyticsService:
             "question_results": question_results,
         }
 
-    def get_lecturer_session_summary(self, session_id: str) -> dict:
+    async def get_lecturer_session_summary(self, session_id: str) -> dict:
         """Compile comprehensive session summary for lecturer."""
-        # Get all student IDs
-        student_ids = list(self.student_scores.get(session_id, {}).keys())
-        student_names = self.student_names.get(session_id, {})
+        # Get all students with their scores, already in rank order
+        ranked = await self.state.ranked_students(session_id)
+        student_names = await self.state.student_names(session_id)
 
         # Calculate overall statistics
-        total_students = len(student_ids)
+        total_students = len(ranked)
         total_correct = 0
         total_answers = 0
         total_response_time = 0
 
-        # Compile student summaries (sorted by score)
+        # Compile student summaries (in rank order)
         student_summaries = []
-        for student_id in student_ids:
-            student_data = self.student_scores[session_id][student_id]
+        for student_id, student_data in ranked:
             student_name = student_names.get(student_id, f"Student {student_id[-4:]}")
 
             avg_response_time = None
@@ -348,17 +430,15 @@ class AnalyticsService:
             total_answers += student_data["total_answers"]
             total_response_time += student_data["total_response_time"]
 
-        # Sort students by score (highest first)
-        student_summaries.sort(key=lambda x: x["score"], reverse=True)
-
         # Add rank to each student
         for idx, student in enumerate(student_summaries, 1):
             student["rank"] = idx
 
         # Compile question breakdown
         question_stats = {}
-        if session_id in self.student_answers:
-            for student_id, answers in self.student_answers[session_id].items():
+        all_answers = await self.state.all_student_answers(session_id)
+        if all_answers:
+            for student_id, answers in all_answers.items():
                 for answer in answers:
                     q_id = answer["question_id"]
                     if q_id not in question_stats:
@@ -425,47 +505,46 @@ class AnalyticsService:
         }
 
     async def end_session(self, session_id: str) -> dict:
-        """End session and send results to all students and lecturer summary to lecturers."""
+        """End session and send each student their own results and lecturer summary to lecturers."""
         print(f"🏁 Ending session {session_id}")
 
-        # Get list of all students in this session
-        student_ids = list(self.student_scores.get(session_id, {}).keys())
-
-        # Compile all student results
-        all_student_results = {}
-        for student_id in student_ids:
-            student_results = self.get_student_session_results(session_id, student_id)
-            all_student_results[student_id] = student_results
-            print(
-                f"📊 Compiled results for student {student_id}: Rank #{student_results['final_rank']} with score {student_results['final_score']}"
-            )
+        # Get list of all students in this session, in rank order
+        student_ids = [student_id for student_id, _ in await self.state.ranked_students(session_id)]
+        student_names = await self.state.student_names(session_id)
 
         # Compile lecturer session summary (BEFORE clearing data)
-        lecturer_summary = self.get_lecturer_session_summary(session_id)
+        lecturer_summary = await self.get_lecturer_session_summary(session_id)
         print(
             f"📈 Compiled session summary for lecturer: {lecturer_summary['total_students']} students, {lecturer_summary['total_questions']} questions, {lecturer_summary['overall_accuracy']}% accuracy"
         )
 
-        # Broadcast session end with all results to students (frontend will filter for their student_id)
-        await self.session_manager.broadcast(session_id, {"type": "session_ended", "all_results": all_student_results})
+        # Deliver any pending analytics/leaderboard frames before the final results
+        await self.coalescer.flush(session_id)
+
+        # Send each student only their own results; ranks come from a single pass over the leaderboard
+        # Only sends to sockets held here are counted as delivered; relayed ones are unconfirmed
+        delivered = relayed = 0
+        for rank, student_id in enumerate(student_ids, 1):
+            student_results = await self.get_student_session_results(
+                session_id, student_id, final_rank=rank, total_students=len(student_ids), student_names=student_names
+            )
+            sent = await self.session_manager.send_to_student(
+                session_id, student_id, {"type": "session_ended", "results": student_results}
+            )
+            if sent:
+                delivered += 1
+            elif sent is None:
+                relayed += 1
+        print(f"📊 Sent results to {delivered}/{len(student_ids)} students ({relayed} relayed to other workers)")
 
         # Send session summary to lecturer only
         await self.session_manager.broadcast_to_lecturers(
             session_id, {"type": "session_summary", "summary": lecturer_summary}
         )
 
-        # Clear session data from memory (MVP - no historical storage)
+        # Clear live session state (MVP - no historical storage)
         total_students = len(student_ids)
-        if session_id in self.active_students:
-            del self.active_students[session_id]
-        if session_id in self.session_stats:
-            del self.session_stats[session_id]
-        if session_id in self.student_scores:
-            del self.student_scores[session_id]
-        if session_id in self.student_names:
-            del self.student_names[session_id]
-        if session_id in self.student_answers:
-            del self.student_answers[session_id]
+        await self.state.clear_session(session_id)
 
         print(f"✅ Session {session_id} ended. Results sent to {total_students} students.")
 
@@ -2,25 +2,56 @@ import json
 import uuid
 import random
 import string
+from contextlib import aclosing
 from datetime import datetime, timezone
 
-from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
-
-# Note: The import below assumes that db and session_manager are accessible this way.
-from app.dependencies import db, session_manager, analytics_service
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, WebSocket, WebSocketDisconnect
+
+from app.config import settings
+
+# Note: All Firestore access goes through the repository so handlers never block the event loop.
+from app.dependencies import (
+    repository,
+    session_manager,
+    analytics_service,
+    gemini_client,
+    gemini_breaker,
+    gemini_limiter,
+    llm_cache,
+    question_cache,
+    session_cache,
+    state_store,
+)
 from app.schemas import SessionCreate, StudentAnswer, LecturerQuestionSelection
-from app.services import generate_three_questions_with_llm
+from app.generation_queue import QuestionGenerationQueue
+from app.local_questions import generate_cloze_questions
+from app.sharding import SESSION_CODE_RE
+from app.similarity import ChunkSimilarityIndex
+from app.transcripts import TranscriptStore
+from app.session_actor import AnswerSubmitted, SessionActors, StudentJoined, StudentLeft, TranscriptChunk
+from app.rate_limit import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, llm_request_scope
+from app.services import generate_three_questions_with_llm, parallel_questions_with_llm, stream_questions_with_llm
 
 
 router = APIRouter()
 
-# Store a temporary transcript per session
-temp_transcripts = {}
-last_transcript_time = {}
-session_start_times = {}
+# Rolling transcript per session, used as bounded context for question generation
+transcript_store = TranscriptStore(
+    max_segments=settings.TRANSCRIPT_WINDOW_MAX_SEGMENTS,
+    max_chars=settings.TRANSCRIPT_WINDOW_MAX_CHARS,
+    idle_seconds=settings.SESSION_IDLE_EVICT_SECONDS,
+)
+
+# Session start times and question options awaiting selection live in the shared state store
 
-# Store question options temporarily (chunk_id -> list of questions)
-question_options_cache = {}
+# Recent chunks per session, so near-duplicate chunks (silence, repeated slides) skip generation
+chunk_index = ChunkSimilarityIndex(
+    threshold=settings.DUPLICATE_CHUNK_THRESHOLD,
+    window=settings.DUPLICATE_CHUNK_WINDOW,
+    idle_seconds=settings.SESSION_IDLE_EVICT_SECONDS,
+)
 
 # Default constants
 MIN_TRANSCRIPT_LENGTH = 20  # Reduced for testing with 30-second intervals
@@ -31,31 +62,190 @@ def generate_short_session_code() -> str:
     return "".join(random.choices(string.ascii_uppercase + string.digits, k=6))
 
 
+def _truncate_chunk(transcript_chunk: str) -> str:
+    return transcript_chunk[:200] + "..." if len(transcript_chunk) > 200 else transcript_chunk
+
+
+async def _question_option_batches(session_id: str, transcript_chunk: str):
+    """
+    Yields lists of newly available question options. In "stream" and "parallel" generation
+    modes each question arrives on its own as soon as it is ready; in "batch" mode all 3 arrive together.
+    The prompt holds the chunk plus as much earlier transcript as fits the token budget.
+    While the Gemini circuit breaker is open, or if Gemini produced nothing, local cloze questions are used.
+    """
+    if gemini_breaker.is_open:
+        print("Gemini circuit breaker is open, generating questions locally")
+        questions = generate_cloze_questions(transcript_chunk)
+        if questions:
+            yield questions
+        return
+
+    produced = False
+    chunk, context = transcript_store.build_prompt_transcript(
+        session_id, transcript_chunk, settings.PROMPT_TRANSCRIPT_TOKEN_BUDGET
+    )
+    mode = settings.GEMINI_GENERATION_MODE
+    if mode in ("stream", "parallel"):
+        if mode == "stream":
+            questions = stream_questions_with_llm(chunk, gemini_client, cache=llm_cache, context=context)
+        else:
+            questions = parallel_questions_with_llm(
+                chunk,
+                gemini_client,
+                cache=llm_cache,
+                hedge_percentile=settings.GEMINI_HEDGE_PERCENTILE,
+                min_hedge_delay_ms=settings.GEMINI_HEDGE_MIN_DELAY_MS,
+                max_attempts=settings.GEMINI_MAX_ATTEMPTS_PER_QUESTION,
+                context=context,
+            )
+        async with aclosing(questions) as stream:
+            async for question in stream:
+                produced = True
+                yield [question]
+    else:
+        questions = await generate_three_questions_with_llm(chunk, gemini_client, cache=llm_cache, context=context)
+        if questions:
+            produced = True
+            yield questions
+
+    if not produced:
+        print("Gemini returned no questions, falling back to local generation")
+        questions = generate_cloze_questions(transcript_chunk)
+        if questions:
+            yield questions
+
+
+async def _release_question_to_students(
+    session_id: str, session_data: dict, selected_question, chunk_id: str, transcript_chunk: str
+):
+    """Passive mode: save the question and broadcast it to students straight away."""
+    # Save the selected question to Firestore, caching it first so answers can be graded from memory
+    question_id = str(uuid.uuid4())
+    question_doc = {
+        "id": question_id,
+        "questionText": selected_question.questionText,
+        "options": selected_question.options,
+        "correctAnswer": selected_question.correctAnswer,
+        "explanation": selected_question.explanation,
+        "generatedBy": selected_question.generatedBy,
+        "timestamp": datetime.now(timezone.utc),
+        "chunkId": chunk_id,
+        "transcriptChunk": _truncate_chunk(transcript_chunk),
+    }
+    question_cache.put(session_id, question_id, question_doc)
+    await repository.save_question(session_id, question_id, question_doc)
+
+    # Broadcast question directly to all students
+    await session_manager.broadcast(
+        session_id,
+        {
+            "type": "new_question",
+            "question": {
+                "id": question_id,
+                "question_text": selected_question.questionText,
+                "options": selected_question.options,
+                "answer_time_seconds": session_data.get("answerTimeSeconds", 30),
+            },
+            "auto_released": True,
+        },
+    )
+
+    print(f"Auto-released question to students for session {session_id}")
+
+
+async def _send_question_options(
+    session_id: str, chunk_id: str, question_options: list, transcript_chunk: str, replace: bool = False
+) -> bool:
+    """
+    Active mode: cache the options generated so far and send them to the lecturer for selection.
+    With `replace` the cached set is only updated if the lecturer has not selected from it yet;
+    returns False (and sends nothing) if they have.
+    """
+    stored = await state_store.put_question_options(
+        chunk_id,
+        session_id,
+        {
+            "session_id": session_id,
+            "questions": question_options,
+            "transcript_chunk": transcript_chunk,
+        },
+        only_if_present=replace,
+    )
+    if not stored:
+        return False
+
+    await session_manager.broadcast(
+        session_id,
+        {
+            "type": "question_options",
+            "chunk_id": chunk_id,
+            "questions": [
+                {
+                    "index": i,
+                    "question_text": q.questionText,
+                    "options": q.options,
+                    "correct_answer": q.correctAnswer,
+                }
+                for i, q in enumerate(question_options)
+            ],
+            "transcript_chunk": _truncate_chunk(transcript_chunk),
+        },
+    )
+
+    print(f"Sent {len(question_options)} question options to lecturer for session {session_id}")
+    return True
+
+
 async def generate_question_options_for_lecturer(session_id: str, transcript_chunk: str):
     """
     Generate question options from transcript chunk. Behavior depends on session's question release mode:
-    - Active mode: Send 3 options to lecturer for selection
-    - Passive mode: Auto-select first question and release immediately
+    - Active mode: Send options to lecturer for selection as each one becomes available
+    - Passive mode: Auto-select the first question and release it as soon as it is ready
     """
-    try:
-        if len(transcript_chunk.strip()) < MIN_TRANSCRIPT_LENGTH:
-            print(f"Transcript chunk too short ({len(transcript_chunk)} chars), skipping question generation")
-            return
+    if len(transcript_chunk.strip()) < MIN_TRANSCRIPT_LENGTH:
+        print(f"Transcript chunk too short ({len(transcript_chunk)} chars), skipping question generation")
+        return
 
+    is_duplicate, similarity = await chunk_index.check_and_add(session_id, transcript_chunk)
+    if is_duplicate:
+        print(f"Transcript chunk is a near-duplicate of a recent chunk (similarity {similarity:.2f}), skipping")
+        return
+
+    question_options = []
+    try:
         # Get session configuration to check release mode
-        session_ref = db.collection("sessions").document(session_id)
-        session_doc = session_ref.get()
+        session_data = await session_cache.get(session_id)
 
-        if not session_doc.exists:
+        if session_data is None:
             print(f"Session {session_id} not found")
             return
 
-        session_data = session_doc.to_dict()
         question_release_mode = session_data.get("questionReleaseMode", "active")
+        chunk_id = str(uuid.uuid4())
 
         print(f"Generating question options from transcript chunk (mode: {question_release_mode})...")
-        question_options = await generate_three_questions_with_llm(transcript_chunk)
-        print(f"Question generation result: {len(question_options) if question_options else 0} questions generated")
+        # A lecturer waiting to pick a question is served ahead of passive background generation
+        priority = PRIORITY_INTERACTIVE if question_release_mode == "active" else PRIORITY_BACKGROUND
+        with llm_request_scope(session_id, priority):
+            async with aclosing(_question_option_batches(session_id, transcript_chunk)) as batches:
+                async for batch in batches:
+                    if question_release_mode == "passive":
+                        # Only the first question is needed - release it and stop generating
+                        question_options.append(batch[0])
+                        await _release_question_to_students(
+                            session_id, session_data, batch[0], chunk_id, transcript_chunk
+                        )
+                        break
+
+                    # The same chunk_id is re-sent with the growing list, so the lecturer sees options early
+                    replace = bool(question_options)
+                    question_options.extend(batch)
+                    if not await _send_question_options(
+                        session_id, chunk_id, list(question_options), transcript_chunk, replace=replace
+                    ):
+                        # The lecturer already selected one of the earlier options
+                        break
+        print(f"Question generation result: {len(question_options)} questions generated")
     except Exception as e:
         print(f"Error in generate_question_options_for_lecturer: {e}")
         import traceback
@@ -63,100 +253,88 @@ async def generate_question_options_for_lecturer(session_id: str, transcript_chu
         traceback.print_exc()
         return
 
-    if question_options and len(question_options) > 0:
-        chunk_id = str(uuid.uuid4())
+    if not question_options:
+        await session_manager.broadcast(
+            session_id, {"type": "error", "message": "Failed to generate question options from transcript chunk."}
+        )
 
-        if question_release_mode == "passive":
-            # Passive mode: Auto-select first question and release immediately
-            selected_question = question_options[0]
 
-            # Save the selected question to Firestore
-            question_id = str(uuid.uuid4())
-            question_ref = db.collection("sessions").document(session_id).collection("questions").document(question_id)
-            question_ref.set(
-                {
-                    "id": question_id,
-                    "questionText": selected_question.questionText,
-                    "options": selected_question.options,
-                    "correctAnswer": selected_question.correctAnswer,
-                    "explanation": selected_question.explanation,
-                    "generatedBy": "AI",
-                    "timestamp": datetime.now(timezone.utc),
-                    "chunkId": chunk_id,
-                    "transcriptChunk": (
-                        transcript_chunk[:200] + "..." if len(transcript_chunk) > 200 else transcript_chunk
-                    ),
-                }
-            )
+# Question generation runs on background workers so the lecturer socket keeps reading
+generation_queue = QuestionGenerationQueue(
+    generate_question_options_for_lecturer,
+    workers=settings.GENERATION_WORKERS,
+    per_session_limit=settings.GENERATION_PER_SESSION_LIMIT,
+    stale_policy=settings.GENERATION_STALE_CHUNK_POLICY,
+)
 
-            # Broadcast question directly to all students
-            await session_manager.broadcast(
-                session_id,
-                {
-                    "type": "new_question",
-                    "question": {
-                        "id": question_id,
-                        "question_text": selected_question.questionText,
-                        "options": selected_question.options,
-                        "answer_time_seconds": session_data.get("answerTimeSeconds", 30),
-                    },
-                    "auto_released": True,
-                },
-            )
 
-            print(f"Auto-released question to students for session {session_id}")
+def _queue_transcript_chunks(session_id: str, chunks: list):
+    """Keeps chunks in the rolling transcript, then queues generation of question options for each."""
+    for transcript_chunk in chunks:
+        transcript_store.append(session_id, transcript_chunk)
+        generation_queue.submit(session_id, transcript_chunk)
 
-        else:
-            # Active mode: Store questions in cache and send 3 questions to lecturer for selection
-            question_options_cache[chunk_id] = {
-                "session_id": session_id,
-                "questions": question_options,
-                "transcript_chunk": transcript_chunk,
-            }
-
-            await session_manager.broadcast(
-                session_id,
-                {
-                    "type": "question_options",
-                    "chunk_id": chunk_id,
-                    "questions": [
-                        {
-                            "index": i,
-                            "question_text": q.questionText,
-                            "options": q.options,
-                            "correct_answer": q.correctAnswer,
-                        }
-                        for i, q in enumerate(question_options)
-                    ],
-                    "transcript_chunk": (
-                        transcript_chunk[:200] + "..." if len(transcript_chunk) > 200 else transcript_chunk
-                    ),
-                },
-            )
 
-            print(f"Sent {len(question_options)} question options to lecturer for session {session_id}")
-    else:
-        await session_manager.broadcast(
-            session_id, {"type": "error", "message": "Failed to generate question options from transcript chunk."}
-        )
+# One actor per live session applies joins, leaves, answers, transcript chunks and the session end in order
+session_actors = SessionActors(
+    analytics_service,
+    session_manager,
+    on_transcript=_queue_transcript_chunks,
+    max_pending=settings.SESSION_ACTOR_QUEUE_SIZE,
+    max_batch=settings.SESSION_ACTOR_MAX_BATCH,
+)
+
+
+async def _end_session(session_id: str) -> dict:
+    """
+    Ends a session, whether the lecturer ends it over the WebSocket or through the REST endpoint,
+    and releases everything this process (and the worker holding its listener) keeps for it.
+    """
+    # Update session status
+    ended = {"status": "ended", "endedAt": datetime.now(timezone.utc)}
+    await repository.update_session(session_id, ended)
+    session_cache.update(session_id, ended)
+
+    # End session (after any events still queued for it) and get results
+    results = await session_actors.end(session_id)
+
+    # Clean up session data
+    generation_queue.cancel_session(session_id)
+    chunk_index.discard(session_id)
+    transcript_store.discard(session_id)
+    question_cache.discard_session(session_id)
+    await state_store.clear_session(session_id)
+
+    # Remove Firestore listeners
+    await session_manager.end_listener(session_id)
+    return results
 
 
 @router.post("/start-session", status_code=201)
-async def start_session(session_data: SessionCreate):
+async def start_session(session_data: SessionCreate, x_session_code: Optional[str] = Header(default=None)):
     """
     Creates a new session with lecturer configuration.
+    Behind the shard router (ACCEPT_ROUTER_SESSION_CODES) the code is chosen by the router
+    (X-Session-Code), so the session is created on the worker that owns it; a taken code is
+    answered with 409 and the router retries. Otherwise the header is ignored.
     """
-    # Generate a short session code instead of using UUID
-    session_code = generate_short_session_code()
+    if x_session_code is not None and settings.ACCEPT_ROUTER_SESSION_CODES:
+        if not SESSION_CODE_RE.match(x_session_code):
+            raise HTTPException(status_code=400, detail="Invalid session code")
+        if await repository.session_exists(x_session_code):
+            raise HTTPException(status_code=409, detail="Session code already in use")
+        session_code = x_session_code
+        max_attempts = 0
+    else:
+        # Generate a short session code instead of using UUID
+        session_code = generate_short_session_code()
+        print(f"Checking uniqueness for session code: {session_code}")
+        max_attempts = 10
 
     # Ensure the session code is unique (check Firestore)
-    print(f"Checking uniqueness for session code: {session_code}")
-    max_attempts = 10
     for attempt in range(max_attempts):
-        session_ref_check = db.collection("sessions").document(session_code)
         try:
-            doc = session_ref_check.get()
-            if not doc.exists:
+            if not await repository.session_exists(session_code):
                 print(f"Session code {session_code} is unique")
                 break
         except Exception as e:
@@ -173,26 +351,23 @@ async def start_session(session_data: SessionCreate):
 
     try:
         # Save the session to Firestore with lecturer configuration
-        session_ref = db.collection("sessions").document(session_code)
-        session_ref.set(
-            {
-                "createdAt": session_start_time,
-                "lecturerName": session_data.lecturer_name,
-                "courseName": session_data.course_name,
-                "answerTimeSeconds": session_data.answer_time_seconds,
-                "transcriptionIntervalSeconds": session_data.transcription_interval_minutes * 60,
-                "questionReleaseMode": session_data.question_release_mode,
-                "status": "active",
-                "lecturerTranscript": "",
-            }
-        )
+        session_doc = {
+            "createdAt": session_start_time,
+            "lecturerName": session_data.lecturer_name,
+            "courseName": session_data.course_name,
+            "answerTimeSeconds": session_data.answer_time_seconds,
+            "transcriptionIntervalSeconds": session_data.transcription_interval_minutes * 60,
+            "questionReleaseMode": session_data.question_release_mode,
+            "status": "active",
+            "lecturerTranscript": "",
+        }
+        await repository.create_session(session_code, session_doc)
 
-        # Initialize temporary transcript and last timestamp
-        temp_transcripts[session_id] = ""
-        last_transcript_time[session_id] = session_start_time
+        # Cache the configuration (later writes go through session_cache.update)
+        session_cache.put(session_id, session_doc)
 
         # Store session start time for duration calculation
-        session_start_times[session_id] = session_start_time
+        await state_store.set_session_start(session_id, session_start_time)
 
         # Start the real-time listener for this session's questions
         session_manager.start_listener(session_id)
@@ -218,14 +393,13 @@ async def select_question(selection_data: LecturerQuestionSelection):
     """
     try:
         # Validate session exists
-        session_ref = db.collection("sessions").document(selection_data.session_id)
-        session_doc = session_ref.get()
+        session_data = await session_cache.get(selection_data.session_id)
 
-        if not session_doc.exists:
+        if session_data is None:
             raise HTTPException(status_code=404, detail="Session not found")
 
         # Retrieve the question options from cache
-        chunk_data = question_options_cache.get(selection_data.chunk_id)
+        chunk_data = await state_store.get_question_options(selection_data.chunk_id, selection_data.session_id)
         if not chunk_data:
             raise HTTPException(status_code=404, detail="Question options not found for this chunk")
 
@@ -235,40 +409,32 @@ async def select_question(selection_data: LecturerQuestionSelection):
             raise HTTPException(status_code=400, detail="Invalid question index")
 
         selected_question = questions[selection_data.selected_question_index]
-        session_data = session_doc.to_dict()
 
         print(
             f"Lecturer selected question {selection_data.selected_question_index} for chunk {selection_data.chunk_id}"
         )
 
-        # Save the selected question to Firestore
+        # Save the selected question to Firestore, caching it first so answers can be graded from memory
         question_id = str(uuid.uuid4())
-        question_ref = (
-            db.collection("sessions").document(selection_data.session_id).collection("questions").document(question_id)
-        )
-        question_ref.set(
-            {
-                "id": question_id,
-                "questionText": selected_question.questionText,
-                "options": selected_question.options,
-                "correctAnswer": selected_question.correctAnswer,
-                "explanation": selected_question.explanation,
-                "generatedBy": "AI",
-                "timestamp": datetime.now(timezone.utc),
-                "chunkId": selection_data.chunk_id,
-                "transcriptChunk": (
-                    chunk_data["transcript_chunk"][:200] + "..."
-                    if len(chunk_data["transcript_chunk"]) > 200
-                    else chunk_data["transcript_chunk"]
-                ),
-            }
-        )
+        question_doc = {
+            "id": question_id,
+            "questionText": selected_question.questionText,
+            "options": selected_question.options,
+            "correctAnswer": selected_question.correctAnswer,
+            "explanation": selected_question.explanation,
+            "generatedBy": selected_question.generatedBy,
+            "timestamp": datetime.now(timezone.utc),
+            "chunkId": selection_data.chunk_id,
+            "transcriptChunk": _truncate_chunk(chunk_data["transcript_chunk"]),
+        }
+        question_cache.put(selection_data.session_id, question_id, question_doc)
+        await repository.save_question(selection_data.session_id, question_id, question_doc)
 
         print(f"✅ Question saved to Firestore with ID: {question_id}")
         print(f"🎓 Firestore listener will broadcast to students automatically")
 
         # Clean up the cache
-        del question_options_cache[selection_data.chunk_id]
+        await state_store.pop_question_options(selection_data.chunk_id, selection_data.session_id)
 
         # Broadcast confirmation to lecturer
         await session_manager.broadcast(
@@ -303,16 +469,17 @@ async def websocket_endpoint(websocket: WebSocket, client_type: str, session_id:
     """
     Handles WebSocket connections for lecturers and students.
     """
-    # Check if the session exists in Firestore
-    session_ref = db.collection("sessions").document(session_id)
-    session_doc = session_ref.get()
-
-    if not session_doc.exists:
+    # Check if the session exists (cached, including unknown codes)
+    if not await session_cache.exists(session_id):
         await websocket.close(code=1008, reason="Session not found")
         return
 
     # Add the new connection to the session manager
     await session_manager.connect(session_id, websocket, client_type)
+    if session_manager.backplane is None and not session_manager.has_listener(session_id):
+        # This worker holds all of the session's sockets, so it owns the question listener
+        # (also after a reconnect, or after the session moved here from another worker)
+        session_manager.start_listener(session_id)
 
     # Temporary ID until we get the student's name
     temp_student_id = f"temp_{id(websocket)}"
@@ -337,26 +504,29 @@ async def websocket_endpoint(websocket: WebSocket, client_type: str, session_id:
                     print(f"Transcript chunk received at {timestamp}: {transcript_chunk}")
 
                     # Send acknowledgment to frontend
-                    await websocket.send_json(
-                        {"type": "transcript_received", "chunk_length": len(transcript_chunk), "timestamp": timestamp}
+                    await session_manager.send_personal_message(
+                        websocket,
+                        {"type": "transcript_received", "chunk_length": len(transcript_chunk), "timestamp": timestamp},
                     )
 
-                    # Generate 3 question options for lecturer selection
-                    await generate_question_options_for_lecturer(session_id, transcript_chunk)
+                    # The session actor adds the chunk to the rolling transcript and queues generation of
+                    # 3 question options; results are pushed via the session manager
+                    await session_actors.send(session_id, TranscriptChunk(transcript_chunk))
 
                 elif message_type == "end_session":
                     # Handle session end request from lecturer
                     print(f"🏁 Lecturer requested to end session {session_id}")
-                    result = await analytics_service.end_session(session_id)
+                    result = await _end_session(session_id)
                     print(f"✅ Session ended successfully: {result}")
 
                     # Send confirmation to lecturer
-                    await websocket.send_json(
+                    await session_manager.send_personal_message(
+                        websocket,
                         {
                             "type": "session_end_confirmed",
                             "session_id": session_id,
                             "total_students": result.get("total_students", 0),
-                        }
+                        },
                     )
 
             elif client_type == "student":
@@ -368,85 +538,100 @@ async def websocket_endpoint(websocket: WebSocket, client_type: str, session_id:
                     student_id = student_name
                     print(f"📝 Student connected with name: {student_name}")
 
-                    # Set student name in analytics service
-                    analytics_service.set_student_name(session_id, student_id, student_name)
+                    # Index the socket by student so results can be sent to them directly
+                    session_manager.register_student(session_id, student_id, websocket)
 
-                    # Track student join (this will reuse existing score if they reconnect)
-                    await analytics_service.track_student_join(session_id, student_id, student_name)
-                    print(f"🎓 Student {student_name} joined session {session_id} - broadcasting to lecturer")
-                    await session_manager.broadcast(
-                        session_id, {"type": "student_joined", "student_id": student_id, "student_name": student_name}
-                    )
-                    print(f"✅ Broadcast sent for student {student_name}")
+                    # Track student join (this will reuse existing score if they reconnect); the session
+                    # actor records the name and broadcasts student_joined to the lecturer
+                    await session_actors.send(session_id, StudentJoined(student_id, student_name))
+                    print(f"🎓 Student {student_name} joined session {session_id}")
 
                 elif message_type == "answer_submission":
                     # Handle student answer submission
                     try:
                         answer_data = StudentAnswer(**message.get("data", {}))
 
-                        # Get the correct answer from Firestore
-                        question_ref = (
-                            db.collection("sessions")
-                            .document(session_id)
-                            .collection("questions")
-                            .document(answer_data.question_id)
-                        )
-                        question_doc = question_ref.get()
+                        # Get the correct answer (from the question cache; Firestore only on a miss)
+                        question_data = await question_cache.get(session_id, answer_data.question_id)
 
-                        if question_doc.exists:
-                            question_data = question_doc.to_dict()
+                        if question_data is not None:
                             correct_answer = question_data.get("correctAnswer")
                             explanation = question_data.get("explanation", "")
 
-                            # Track the answer submission
-                            await analytics_service.track_answer_submitted(
-                                session_id=session_id,
-                                student_id=student_id,
-                                question_id=answer_data.question_id,
-                                selected_option=answer_data.selected_option,
-                                correct_answer=correct_answer,
-                                response_time_ms=answer_data.response_time_ms,
+                            # Track the answer submission (scored by the session actor)
+                            await session_actors.send(
+                                session_id,
+                                AnswerSubmitted(
+                                    student_id=student_id,
+                                    question_id=answer_data.question_id,
+                                    selected_option=answer_data.selected_option,
+                                    correct_answer=correct_answer,
+                                    response_time_ms=answer_data.response_time_ms,
+                                    question_text=question_data.get("questionText", "Question not found"),
+                                ),
                             )
 
                             # Send confirmation back to student with explanation
                             is_correct = answer_data.selected_option == correct_answer
-                            await websocket.send_json(
+                            await session_manager.send_personal_message(
+                                websocket,
                                 {
                                     "type": "answer_result",
                                     "question_id": answer_data.question_id,
                                     "is_correct": is_correct,
                                     "correct_answer": correct_answer,
                                     "explanation": explanation,
-                                }
+                                },
                             )
                         else:
-                            await websocket.send_json({"type": "error", "message": "Question not found"})
+                            await session_manager.send_personal_message(
+                                websocket, {"type": "error", "message": "Question not found"}
+                            )
                     except Exception as e:
                         print(f"Error handling answer submission: {e}")
-                        await websocket.send_json({"type": "error", "message": "Invalid answer format"})
+                        await session_manager.send_personal_message(
+                            websocket, {"type": "error", "message": "Invalid answer format"}
+                        )
 
     except WebSocketDisconnect:
         # A client has disconnected, remove them from the session
         session_manager.disconnect(session_id, websocket)
 
-        # Track student leaving if it's a student connection
+        # Track student leaving if it's a student connection (the actor tells the lecturer)
         if client_type == "student":
-            await analytics_service.track_student_leave(session_id, student_id)
-
-            # Broadcast to lecturer that a student left
-            await session_manager.broadcast(session_id, {"type": "student_left", "student_id": student_id})
+            await session_actors.send(session_id, StudentLeft(student_id))
 
     except Exception as e:
         print(f"An error occurred in the WebSocket loop: {e}")
         # Clean up on unexpected error
         session_manager.disconnect(session_id, websocket)
 
-        # Track student leaving if it's a student connection
+        # Track student leaving if it's a student connection (the actor tells the lecturer)
         if client_type == "student":
-            await analytics_service.track_student_leave(session_id, student_id)
+            await session_actors.send(session_id, StudentLeft(student_id))
 
-            # Broadcast to lecturer that a student left
-            await session_manager.broadcast(session_id, {"type": "student_left", "student_id": student_id})
+
+@router.get("/metrics")
+async def worker_metrics():
+    """
+    Counters of this worker's connections, listeners, caches, queues and Gemini limits.
+    Behind the shard router each worker reports only its own sessions.
+    """
+    return {
+        "connections": session_manager.metrics(),
+        "session_actors": session_actors.metrics(),
+        "state_store": state_store.metrics(),
+        "session_cache": session_cache.metrics(),
+        "question_cache": question_cache.metrics(),
+        "transcripts": transcript_store.metrics(),
+        "duplicate_chunks": chunk_index.metrics(),
+        "generation_queue": generation_queue.metrics(),
+        "llm_cache": llm_cache.metrics(),
+        "gemini_limiter": gemini_limiter.metrics(),
+        "gemini_breaker": gemini_breaker.metrics(),
+        "analytics_events": analytics_service.event_sink.metrics(),
+        "firestore": repository.metrics(),
+    }
 
 
 @router.get("/sessions/{session_id}/analytics")
@@ -456,10 +641,7 @@ async def get_session_analytics(session_id: str):
     """
     try:
         # Check if session exists
-        session_ref = db.collection("sessions").document(session_id)
-        session_doc = session_ref.get()
-
-        if not session_doc.exists:
+        if not await session_cache.exists(session_id):
             raise HTTPException(status_code=404, detail="Session not found")
 
         # Get current analytics
@@ -478,13 +660,11 @@ async def get_session_config(session_id: str):
     """
     try:
         # Check if session exists
-        session_ref = db.collection("sessions").document(session_id)
-        session_doc = session_ref.get()
+        session_data = await session_cache.get(session_id)
 
-        if not session_doc.exists:
+        if session_data is None:
             raise HTTPException(status_code=404, detail="Session not found")
 
-        session_data = session_doc.to_dict()
         return {
             "sessionId": session_id,
             "transcriptionIntervalSeconds": session_data.get("transcriptionIntervalSeconds", 300),
@@ -506,10 +686,7 @@ async def get_session_leaderboard(session_id: str):
     """
     try:
         # Check if session exists
-        session_ref = db.collection("sessions").document(session_id)
-        session_doc = session_ref.get()
-
-        if not session_doc.exists:
+        if not await session_cache.exists(session_id):
             raise HTTPException(status_code=404, detail="Session not found")
 
         # Get leaderboard
@@ -528,33 +705,11 @@ async def end_session(session_id: str):
     """
     try:
         # Check if session exists
-        session_ref = db.collection("sessions").document(session_id)
-        session_doc = session_ref.get()
-
-        if not session_doc.exists:
+        if not await session_cache.exists(session_id):
             raise HTTPException(status_code=404, detail="Session not found")
 
-        # Update session status
-        session_ref.update({"status": "ended", "endedAt": datetime.now(timezone.utc)})
-
-        # Get session start time
-        start_time = session_start_times.get(session_id, datetime.now(timezone.utc))
-
-        # End session and get results
-        results = await analytics_service.end_session(session_id, start_time)
-
-        # Clean up session data
-        if session_id in temp_transcripts:
-            del temp_transcripts[session_id]
-        if session_id in last_transcript_time:
-            del last_transcript_time[session_id]
-        if session_id in session_start_times:
-            del session_start_times[session_id]
-
-        # Remove Firestore listener
-        session_manager.remove_listener(session_id)
-
-        return {"results": results.model_dump()}
+        results = await _end_session(session_id)
+        return {"results": results}
 
     except Exception as e:
         print(f"Error ending session: {e}")
@@ -0,0 +1,235 @@
+import asyncio
+import json
+import uuid
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Only needed for the Redis backplane
+    redis_asyncio = None
+
+# Cross-worker broadcast: "none" keeps fan-out in this process; "redis" relays it through Redis pub/sub
+BACKPLANE_BACKENDS = ("none", "redis")
+
+# Who a relayed frame is for on the receiving worker
+TARGET_ALL = "all"
+TARGET_LECTURERS = "lecturers"
+TARGET_STUDENT = "student"
+# Control message: the session ended, so the worker holding its question listener detaches it
+TARGET_LISTENER = "listener"
+
+# handler(session_id, target, student_id, frame_text)
+RelayHandler = Callable[[str, str, Optional[str], str], Awaitable[None]]
+
+
+class Backplane(ABC):
+    """
+    Pub/sub relay that lets a broadcast reach sockets held by other workers.
+    Each worker subscribes to the channels of sessions it holds sockets or the question listener for.
+    A broadcast is fanned out locally and published once; every other subscribed worker fans it out
+    to its own sockets. Frames travel pre-serialized behind a one-line JSON header, so no worker
+    re-encodes them.
+    """
+
+    def __init__(self, prefix: str = "qwiz"):
+        self.prefix = prefix
+        self.worker_id = uuid.uuid4().hex
+        self.handler: Optional[RelayHandler] = None
+        self._wanted: Set[str] = set()  # Sessions with local sockets or a local question listener
+        self._subscribed: Set[str] = set()  # Sessions whose channel is actually subscribed
+        self._lock: Optional[asyncio.Lock] = None
+        # Metrics
+        self.published = 0
+        self.received = 0
+        self.own_skipped = 0
+        self.handler_errors = 0
+
+    def start(self, handler: RelayHandler):
+        self.handler = handler
+
+    def channel(self, session_id: str) -> str:
+        return f"{self.prefix}:session:{session_id}"
+
+    def _session_of(self, channel: str) -> str:
+        return channel[len(self.prefix) + len(":session:") :]
+
+    async def subscribe(self, session_id: str):
+        """Starts receiving frames published for the session by other workers."""
+        self._wanted.add(session_id)
+        await self._sync(session_id)
+
+    def subscribe_soon(self, session_id: str):
+        """Like subscribe, for synchronous code: the channel is subscribed in the background."""
+        self._wanted.add(session_id)
+        if session_id not in self._subscribed:
+            asyncio.get_running_loop().create_task(self._sync(session_id))
+
+    def unsubscribe(self, session_id: str):
+        """
+        Stops receiving the session's frames. Safe to call from synchronous code: the wanted set
+        changes now and the channel is released in the background, so a quick reconnect keeps it.
+        """
+        self._wanted.discard(session_id)
+        if session_id in self._subscribed:
+            asyncio.get_running_loop().create_task(self._sync(session_id))
+
+    async def _sync(self, session_id: str):
+        """Brings the channel subscription in line with whether the session is still wanted here."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            wanted = session_id in self._wanted
+            if wanted and session_id not in self._subscribed:
+                await self._subscribe_channel(self.channel(session_id))
+                self._subscribed.add(session_id)
+            elif not wanted and session_id in self._subscribed:
+                await self._unsubscribe_channel(self.channel(session_id))
+                self._subscribed.discard(session_id)
+
+    async def publish(self, session_id: str, frame_text: str, target: str = TARGET_ALL, student_id: str = None):
+        """Publishes an already-serialized frame for other workers' sockets in the session."""
+        header = json.dumps({"origin": self.worker_id, "target": target, "student_id": student_id})
+        self.published += 1
+        await self._publish(self.channel(session_id), f"{header}\n{frame_text}")
+
+    async def _deliver(self, channel: str, data: str):
+        """Called by the transport for each message on a subscribed channel."""
+        header, _, frame_text = data.partition("\n")
+        envelope = json.loads(header)
+        if envelope["origin"] == self.worker_id:
+            # Already fanned out locally when it was published
+            self.own_skipped += 1
+            return
+        self.received += 1
+        session_id = self._session_of(channel)
+        if self.handler is None or session_id not in self._wanted:
+            return
+        try:
+            await self.handler(session_id, envelope["target"], envelope.get("student_id"), frame_text)
+        except Exception as e:
+            self.handler_errors += 1
+            print(f"Error relaying frame for session {session_id}: {e}")
+
+    @abstractmethod
+    async def _subscribe_channel(self, channel: str): ...
+
+    @abstractmethod
+    async def _unsubscribe_channel(self, channel: str): ...
+
+    @abstractmethod
+    async def _publish(self, channel: str, data: str): ...
+
+    async def close(self):
+        self._wanted.clear()
+        self._subscribed.clear()
+
+    def metrics(self) -> dict:
+        return {
+            "sessions": len(self._subscribed),
+            "published": self.published,
+            "received": self.received,
+            "own_skipped": self.own_skipped,
+            "handler_errors": self.handler_errors,
+        }
+
+
+class InMemoryBroker:
+    """In-process stand-in for a pub/sub server: delivers each message to every subscriber, in order."""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set["InMemoryBackplane"]] = {}
+
+    def subscribe(self, channel: str, backplane: "InMemoryBackplane"):
+        self._subscribers.setdefault(channel, set()).add(backplane)
+
+    def unsubscribe(self, channel: str, backplane: "InMemoryBackplane"):
+        subscribers = self._subscribers.get(channel)
+        if subscribers is not None:
+            subscribers.discard(backplane)
+            if not subscribers:
+                del self._subscribers[channel]
+
+    async def publish(self, channel: str, data: str) -> int:
+        subscribers = list(self._subscribers.get(channel, ()))
+        for backplane in subscribers:
+            await backplane._deliver(channel, data)
+        return len(subscribers)
+
+
+class InMemoryBackplane(Backplane):
+    """Backplane over an InMemoryBroker; workers sharing one broker behave like workers sharing Redis."""
+
+    def __init__(self, broker: InMemoryBroker, prefix: str = "qwiz"):
+        super().__init__(prefix)
+        self.broker = broker
+
+    async def _subscribe_channel(self, channel: str):
+        self.broker.subscribe(channel, self)
+
+    async def _unsubscribe_channel(self, channel: str):
+        self.broker.unsubscribe(channel, self)
+
+    async def _publish(self, channel: str, data: str):
+        await self.broker.publish(channel, data)
+
+    async def close(self):
+        for session_id in list(self._subscribed):
+            self.broker.unsubscribe(self.channel(session_id), self)
+        await super().close()
+
+
+class RedisBackplane(Backplane):
+    """Backplane over Redis pub/sub: one subscriber connection per worker, read by a single task."""
+
+    def __init__(self, client=None, url: str = "redis://localhost:6379/0", prefix: str = "qwiz"):
+        super().__init__(prefix)
+        if client is None:
+            if redis_asyncio is None:
+                raise RuntimeError("The redis package is required for the redis backplane")
+            client = redis_asyncio.from_url(url, decode_responses=True)
+        self.redis = client
+        self.pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self._reader: Optional[asyncio.Task] = None
+
+    async def _subscribe_channel(self, channel: str):
+        await self.pubsub.subscribe(channel)
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.get_running_loop().create_task(self._read())
+
+    async def _unsubscribe_channel(self, channel: str):
+        await self.pubsub.unsubscribe(channel)
+
+    async def _publish(self, channel: str, data: str):
+        await self.redis.publish(channel, data)
+
+    async def _read(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Backplane subscriber error: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if message is not None and message["type"] == "message":
+                await self._deliver(message["channel"], message["data"])
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+            self._reader = None
+        await self.pubsub.aclose()
+        await self.redis.aclose()
+        await super().close()
+
+
+def create_backplane(backend: str, url: str = "redis://localhost:6379/0") -> Optional[Backplane]:
+    """Builds the configured backplane, or None when broadcasts stay within this process."""
+    if backend == "none":
+        return None
+    if backend == "redis":
+        return RedisBackplane(url=url)
+    raise ValueError(f"Backplane backend must be one of {BACKPLANE_BACKENDS}")
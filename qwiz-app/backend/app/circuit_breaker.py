@@ -0,0 +1,110 @@
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency while its circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Trips when too many recent calls failed or were too slow, so callers fail fast instead of
+    waiting out a full timeout on every request. After `open_seconds` a limited number of
+    probe calls are let through (half-open); a successful probe closes the circuit again,
+    a failed one re-opens it.
+    """
+
+    def __init__(
+        self,
+        failure_rate_threshold: float = 0.5,
+        slow_call_ms: float = 10_000,
+        window: int = 20,
+        min_calls: int = 5,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1,
+    ):
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_ms = slow_call_ms
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._outcomes = deque(maxlen=window)  # True for a failed or slow call
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        # Metrics
+        self.times_opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes_in_flight = 0
+        return self._state
+
+    @property
+    def is_open(self) -> bool:
+        """True while calls would be rejected; a half-open circuit with no free probe slot counts as open."""
+        state = self.state
+        return state == OPEN or (state == HALF_OPEN and self._probes_in_flight >= self.half_open_probes)
+
+    def allow_request(self) -> bool:
+        """Reserves permission for one call; half-open circuits only admit `half_open_probes` at a time."""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self._probes_in_flight < self.half_open_probes:
+            self._probes_in_flight += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self, latency_ms: float):
+        if latency_ms >= self.slow_call_ms:
+            self.record_failure()
+            return
+        if self._state == HALF_OPEN:
+            self._close()
+            return
+        self._outcomes.append(False)
+
+    def record_failure(self):
+        if self._state == HALF_OPEN:
+            self._open()
+            return
+        self._outcomes.append(True)
+        if self._state == CLOSED and len(self._outcomes) >= self.min_calls:
+            if sum(self._outcomes) / len(self._outcomes) >= self.failure_rate_threshold:
+                self._open()
+
+    def record_cancelled(self):
+        """Releases a probe slot for a call that was abandoned before it produced an outcome."""
+        if self._state == HALF_OPEN and self._probes_in_flight:
+            self._probes_in_flight -= 1
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probes_in_flight = 0
+        self.times_opened += 1
+        print(f"Circuit breaker opened; retrying in {self.open_seconds}s")
+
+    def _close(self):
+        self._state = CLOSED
+        self._outcomes.clear()
+        self._probes_in_flight = 0
+        print("Circuit breaker closed")
+
+    def metrics(self) -> dict:
+        return {
+            "state": self.state,
+            "recent_calls": len(self._outcomes),
+            "recent_failures": sum(self._outcomes),
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
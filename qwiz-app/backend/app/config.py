@@ -15,6 +15,87 @@ class Settings(BaseSettings):
     container_gcloud_path: str = ""
     google_application_credentials: str = ""
 
+    # Gemini API client
+    GEMINI_MODEL: str = "gemini-2.5-flash-preview-05-20"
+    GEMINI_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    GEMINI_READ_TIMEOUT_SECONDS: float = 30.0
+    GEMINI_MAX_CONNECTIONS: int = 20  # Pooled keep-alive connections shared by all sessions
+    GEMINI_MAX_CONCURRENCY: int = 10  # Concurrent Gemini requests per process
+    GEMINI_REQUESTS_PER_MINUTE: int = 300  # Process-wide request rate shared fairly by all sessions
+    GEMINI_RATE_LIMIT_BURST: int = 10  # Requests that may be sent back-to-back before rate limiting applies
+    GEMINI_RATE_LIMIT_MAX_WAIT_SECONDS: float = 30.0  # Give up on a request that waited this long for a slot
+    GEMINI_BREAKER_FAILURE_RATE: float = 0.5  # Open the circuit when this share of recent calls failed or were slow
+    GEMINI_BREAKER_SLOW_CALL_MS: int = 10_000  # Calls slower than this count as failures
+    GEMINI_BREAKER_WINDOW: int = 20  # Recent calls considered
+    GEMINI_BREAKER_MIN_CALLS: int = 5  # Calls needed in the window before the circuit can open
+    GEMINI_BREAKER_OPEN_SECONDS: float = 30.0  # How long to serve local questions before probing Gemini again
+    # "stream": one streamed request, each question released as soon as it is complete
+    # "parallel": one request per question sent concurrently, with hedging of slow requests
+    # "batch": one request, all questions delivered together
+    GEMINI_GENERATION_MODE: str = "stream"
+    GEMINI_HEDGE_PERCENTILE: float = 0.9  # Parallel mode: hedge a request slower than this latency percentile
+    GEMINI_HEDGE_MIN_DELAY_MS: int = 1500  # Parallel mode: never hedge sooner than this
+    GEMINI_MAX_ATTEMPTS_PER_QUESTION: int = 2  # Parallel mode: requests (incl. hedges/retries) per question
+
+    # LLM response cache
+    LLM_CACHE_MAX_ENTRIES: int = 1024  # In-memory LRU entries (one per transcript chunk)
+    LLM_CACHE_DIR: str = ""  # Directory for the on-disk tier; empty disables it
+
+    # Transcript context
+    TRANSCRIPT_WINDOW_MAX_SEGMENTS: int = 500  # Chunks kept per session in the rolling transcript
+    TRANSCRIPT_WINDOW_MAX_CHARS: int = 200_000  # Characters kept per session (~50k tokens)
+    PROMPT_TRANSCRIPT_TOKEN_BUDGET: int = 4000  # Estimated tokens of transcript (chunk + earlier context) per prompt
+    SESSION_IDLE_EVICT_SECONDS: int = 7200  # Drop transcript windows and chunk indexes of sessions idle this long
+
+    # Session document cache
+    SESSION_CACHE_TTL_SECONDS: int = 300  # Re-read a cached session after this long (picks up writes made elsewhere)
+    SESSION_CACHE_NEGATIVE_TTL_SECONDS: int = 30  # Remember unknown session codes for this long
+
+    # Live session state (students, scores, answers, question options)
+    # "memory": held in this process (single worker); "redis": shared by all workers through a Redis-protocol server
+    STATE_STORE_BACKEND: str = "memory"
+    REDIS_URL: str = "redis://localhost:6379/0"
+    # "none": broadcasts reach this process's sockets only; "redis": relayed to every worker through Redis pub/sub
+    BROADCAST_BACKPLANE: str = "none"
+    # Set on workers started by app.router: honour the session code the router picks (X-Session-Code)
+    ACCEPT_ROUTER_SESSION_CODES: bool = False
+
+    # Question options awaiting lecturer selection
+    QUESTION_OPTIONS_TTL_SECONDS: int = 1800  # Unselected options are dropped after this long
+    QUESTION_OPTIONS_MAX_ENTRIES: int = 5000  # Option sets kept across all sessions (in-memory state store only)
+    QUESTION_OPTIONS_MAX_PER_SESSION: int = 20  # Option sets kept per session; the oldest goes first
+
+    # Background question generation
+    GENERATION_WORKERS: int = 8  # Global cap on concurrent generation jobs
+    GENERATION_PER_SESSION_LIMIT: int = 1  # Concurrent generation jobs per session
+    GENERATION_STALE_CHUNK_POLICY: str = "latest"  # "latest" drops a waiting chunk, "merge" appends to it
+    DUPLICATE_CHUNK_THRESHOLD: float = 0.8  # Skip generation for chunks at least this similar (0-1) to a recent one
+    DUPLICATE_CHUNK_WINDOW: int = 10  # Recent chunks per session compared against
+
+    # Firestore access
+    FIRESTORE_MAX_WORKERS: int = 16  # Threads available for blocking Firestore calls
+    # "per_session": one watch per session; "shared": one collection-group watch for all sessions (needs a
+    # collection-group index exemption on questions.timestamp; every instance receives every new question)
+    FIRESTORE_LISTENER_MODE: str = "per_session"
+    LISTENER_HEALTH_CHECK_SECONDS: int = 30  # How often the shared watch is checked (per-session watches on failure)
+    LISTENER_BRIDGE_MAX_BATCH: int = 100  # Listener changes handed to the event loop per wakeup
+    LISTENER_BRIDGE_MAX_PENDING: int = 10000  # Listener threads wait (then drop) once this many are queued
+
+    # Per-session actors (joins, leaves, answers, transcript chunks, session end)
+    SESSION_ACTOR_QUEUE_SIZE: int = 1000  # Handlers wait once this many events are queued for one session
+    SESSION_ACTOR_MAX_BATCH: int = 256  # Events applied per drain cycle
+
+    # Real-time fan-out tuning
+    WS_SEND_QUEUE_SIZE: int = 256  # Max pending outbound messages per socket before it is dropped as stalled
+    ANALYTICS_TICK_MS: int = 250  # Minimum interval between analytics/leaderboard frames per session
+    ANALYTICS_TICK_PER_STUDENT_MS: float = 1.0  # Extra tick delay per active student, so large classes get fewer frames
+    ANALYTICS_TICK_MAX_MS: int = 1000  # Upper bound on the adaptive tick
+
+    # Analytics event write-behind
+    ANALYTICS_FLUSH_BATCH_SIZE: int = 200  # Events per Firestore batched write (max 500)
+    ANALYTICS_FLUSH_INTERVAL_MS: int = 1000  # Flush at least this often while events are buffered
+    ANALYTICS_BUFFER_MAX_EVENTS: int = 10000  # Producers wait once this many events are pending
+
     class Config:
         env_file = os.path.join(BASE_DIR, ".env")
         env_file_encoding = "utf-8"
@@ -0,0 +1,92 @@
+import asyncio
+import json
+from typing import Optional, Union
+
+from fastapi import WebSocket
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to the stdlib encoder
+    orjson = None
+
+
+def encode_json(message: dict) -> str:
+    """Serializes a message to a compact JSON text frame, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+class EncodedMessage:
+    """
+    A message serialized once up front so the same text frame can be written
+    to every recipient of a broadcast without re-encoding it per socket.
+    """
+
+    __slots__ = ("text",)
+
+    def __init__(self, message: dict):
+        self.text = encode_json(message)
+
+    @classmethod
+    def ensure(cls, message: Union[dict, "EncodedMessage"]) -> "EncodedMessage":
+        """Returns the message as-is if already encoded, otherwise encodes it."""
+        return message if isinstance(message, cls) else cls(message)
+
+    @classmethod
+    def from_text(cls, text: str) -> "EncodedMessage":
+        """Wraps text that is already a serialized message (e.g. relayed from another worker)."""
+        encoded = cls.__new__(cls)
+        encoded.text = text
+        return encoded
+
+
+class ConnectionWriter:
+    """
+    Owns the bounded outbound queue and writer task for a single WebSocket.
+    Broadcasts only enqueue, so a slow client never delays delivery to the others.
+    """
+
+    def __init__(self, websocket: WebSocket, max_queue_size: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def start(self):
+        """Starts the writer task on the running event loop."""
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    def enqueue(self, message: EncodedMessage) -> bool:
+        """
+        Queues a message for delivery without waiting.
+        Returns False if the connection is closed or its queue is full (stalled client).
+        """
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _run(self):
+        """Drains the queue, sending each pre-encoded frame to the socket in order."""
+        while True:
+            message = await self.queue.get()
+            try:
+                await self.websocket.send_text(message.text)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"WebSocket writer stopped: {e}")
+                self.closed = True
+                return
+
+    def stop(self):
+        """Stops the writer task and discards any undelivered messages."""
+        self.closed = True
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        self.task = None
@@ -2,10 +2,71 @@
 from app.config import settings
 from app.services import SessionManager
 from app.analytics import AnalyticsService
+from app.repository import FirestoreRepository
+from app.question_cache import QuestionCache
+from app.session_cache import SessionCache
+from app.state_store import create_state_store
+from app.backplane import create_backplane
+from app.llm import GeminiClient
+from app.llm_cache import LLMResponseCache
+from app.rate_limit import FairRateLimiter
+from app.circuit_breaker import CircuitBreaker
 from google.cloud import firestore
 
 print("🔥 Using real Firestore")
 db = firestore.Client(project=settings.GOOGLE_CLOUD_PROJECT)
 
-session_manager = SessionManager(db_client=db)
-analytics_service = AnalyticsService(db_client=db, session_manager=session_manager)
+repository = FirestoreRepository(db_client=db, max_workers=settings.FIRESTORE_MAX_WORKERS)
+
+state_store = create_state_store(
+    settings.STATE_STORE_BACKEND,
+    url=settings.REDIS_URL,
+    question_options_ttl_seconds=settings.QUESTION_OPTIONS_TTL_SECONDS,
+    question_options_max_entries=settings.QUESTION_OPTIONS_MAX_ENTRIES,
+    question_options_max_per_session=settings.QUESTION_OPTIONS_MAX_PER_SESSION,
+)
+question_cache = QuestionCache(repository)
+session_cache = SessionCache(
+    repository,
+    ttl_seconds=settings.SESSION_CACHE_TTL_SECONDS,
+    negative_ttl_seconds=settings.SESSION_CACHE_NEGATIVE_TTL_SECONDS,
+)
+
+session_manager = SessionManager(
+    db_client=db,
+    repository=repository,
+    question_cache=question_cache,
+    session_cache=session_cache,
+    backplane=create_backplane(settings.BROADCAST_BACKPLANE, url=settings.REDIS_URL),
+)
+analytics_service = AnalyticsService(
+    db_client=db,
+    session_manager=session_manager,
+    repository=repository,
+    question_cache=question_cache,
+    state=state_store,
+)
+
+gemini_limiter = FairRateLimiter(
+    rate_per_second=settings.GEMINI_REQUESTS_PER_MINUTE / 60,
+    burst=settings.GEMINI_RATE_LIMIT_BURST,
+    max_wait=settings.GEMINI_RATE_LIMIT_MAX_WAIT_SECONDS,
+)
+gemini_breaker = CircuitBreaker(
+    failure_rate_threshold=settings.GEMINI_BREAKER_FAILURE_RATE,
+    slow_call_ms=settings.GEMINI_BREAKER_SLOW_CALL_MS,
+    window=settings.GEMINI_BREAKER_WINDOW,
+    min_calls=settings.GEMINI_BREAKER_MIN_CALLS,
+    open_seconds=settings.GEMINI_BREAKER_OPEN_SECONDS,
+)
+gemini_client = GeminiClient(
+    api_key=settings.GEMINI_API_KEY,
+    model=settings.GEMINI_MODEL,
+    max_connections=settings.GEMINI_MAX_CONNECTIONS,
+    max_concurrency=settings.GEMINI_MAX_CONCURRENCY,
+    connect_timeout=settings.GEMINI_CONNECT_TIMEOUT_SECONDS,
+    read_timeout=settings.GEMINI_READ_TIMEOUT_SECONDS,
+    limiter=gemini_limiter,
+    breaker=gemini_breaker,
+)
+llm_cache = LLMResponseCache(max_entries=settings.LLM_CACHE_MAX_ENTRIES, disk_dir=settings.LLM_CACHE_DIR or None)
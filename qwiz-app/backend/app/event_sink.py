@@ -0,0 +1,123 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+# Firestore rejects batches with more than 500 writes
+FIRESTORE_MAX_BATCH_WRITES = 500
+
+
+class AnalyticsEventSink:
+    """
+    Write-behind buffer for analytics events.
+    Events are queued in memory and written to Firestore as batched writes by a background
+    task, either when enough have accumulated or when the flush interval elapses. The buffer
+    is bounded: producers wait (backpressure) while it is full, and close() flushes everything.
+    """
+
+    def __init__(self, repository, batch_size: int = 200, flush_interval_ms: int = 1000, max_buffer: int = 10000):
+        self.repository = repository
+        self.batch_size = max(1, min(batch_size, FIRESTORE_MAX_BATCH_WRITES))
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_buffer = max(max_buffer, self.batch_size)
+        self.max_wait = 5 * self.flush_interval  # Longest a producer waits for buffer space
+        self._buffer: List[Tuple[str, dict]] = []  # (session_id, event_data)
+        self._wake = asyncio.Event()
+        self._space = asyncio.Condition()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        # Metrics
+        self.events_written = 0
+        self.events_dropped = 0
+        self.batches_committed = 0
+        self.failed_commits = 0
+        self.backpressure_waits = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def add(self, session_id: str, event_data: dict):
+        """Queues an event for the next batch, waiting if the buffer is full."""
+        if self._closing:
+            # Shutting down - write straight through rather than lose the event
+            await self.repository.write_analytics_events([(session_id, event_data)])
+            return
+
+        self._ensure_started()
+        if len(self._buffer) >= self.max_buffer:
+            self.backpressure_waits += 1
+            self._wake.set()
+            try:
+                async with self._space:
+                    await asyncio.wait_for(
+                        self._space.wait_for(lambda: len(self._buffer) < self.max_buffer),
+                        timeout=self.max_wait,
+                    )
+            except asyncio.TimeoutError:
+                # Firestore is not keeping up - shed the event rather than stall the caller indefinitely
+                self.events_dropped += 1
+                return
+
+        self._buffer.append((session_id, event_data))
+        if len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    async def _run(self):
+        """Flushes on size threshold (wake event) or after the flush interval."""
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Writes all buffered events as one or more Firestore batches."""
+        async with self._flush_lock:
+            while self._buffer:
+                events = self._buffer[: self.batch_size]
+                del self._buffer[: len(events)]
+                try:
+                    await self.repository.write_analytics_events(events)
+                    self.events_written += len(events)
+                    self.batches_committed += 1
+                except Exception as e:
+                    self.failed_commits += 1
+                    print(f"Error committing analytics batch of {len(events)} events: {e}")
+                    # Put the events back for the next flush if there is room, otherwise drop them
+                    room = self.max_buffer - len(self._buffer)
+                    self._buffer[:0] = events[:room]
+                    self.events_dropped += max(0, len(events) - room)
+                    break
+                finally:
+                    async with self._space:
+                        self._space.notify_all()
+
+    async def close(self):
+        """Stops the background task and flushes whatever is still buffered."""
+        self._closing = True
+        if self._task is not None:
+            self._wake.set()
+            try:
+                await self._task
+            except Exception as e:
+                print(f"Analytics sink task ended with error: {e}")
+            self._task = None
+        await self.flush()
+        if self._buffer:
+            print(f"⚠️ {len(self._buffer)} analytics events could not be written on shutdown")
+
+    def metrics(self) -> dict:
+        return {
+            "pending": self.pending,
+            "events_written": self.events_written,
+            "events_dropped": self.events_dropped,
+            "batches_committed": self.batches_committed,
+            "failed_commits": self.failed_commits,
+            "backpressure_waits": self.backpressure_waits,
+        }
@@ -0,0 +1,142 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+# What to do with a chunk that is still waiting when a newer one arrives for the same session
+STALE_CHUNK_POLICIES = ("latest", "merge")
+
+
+class QuestionGenerationQueue:
+    """
+    Background job queue for question generation.
+    Transcript chunks are accepted immediately and processed by a fixed pool of workers
+    (the global concurrency limit), with at most `per_session_limit` jobs running per session.
+    Only one chunk waits per session: a newer chunk replaces the waiting one ("latest") or is
+    appended to it ("merge"), so a slow LLM never builds up a backlog of stale chunks.
+    Each job runs as its own task, so cancelling a session (when it ends) stops its running
+    jobs as well as the waiting chunk, without taking down the worker.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str, str], Awaitable[None]],
+        workers: int = 4,
+        per_session_limit: int = 1,
+        stale_policy: str = "latest",
+        max_merged_chars: int = 8000,
+    ):
+        if stale_policy not in STALE_CHUNK_POLICIES:
+            raise ValueError(f"stale_policy must be one of {STALE_CHUNK_POLICIES}")
+        self.handler = handler
+        self.workers = workers
+        self.per_session_limit = per_session_limit
+        self.stale_policy = stale_policy
+        self.max_merged_chars = max_merged_chars
+        self._pending: Dict[str, str] = {}  # session_id -> chunk waiting to run
+        self._running: Dict[str, Set[asyncio.Task]] = {}  # session_id -> running jobs
+        self._scheduled: Set[str] = set()  # sessions currently sitting in _ready
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._worker_tasks: List[asyncio.Task] = []
+        # Metrics
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.dropped_stale = 0
+        self.merged = 0
+
+    def _ensure_started(self):
+        self._worker_tasks = [task for task in self._worker_tasks if not task.done()]
+        while len(self._worker_tasks) < self.workers:
+            self._worker_tasks.append(asyncio.create_task(self._worker()))
+
+    def submit(self, session_id: str, transcript_chunk: str):
+        """Accepts a chunk for background generation without waiting for it."""
+        self._ensure_started()
+        self.submitted += 1
+
+        waiting = self._pending.get(session_id)
+        if waiting is None:
+            self._pending[session_id] = transcript_chunk
+        elif self.stale_policy == "merge":
+            merged = f"{waiting} {transcript_chunk}"
+            self._pending[session_id] = merged[-self.max_merged_chars :]
+            self.merged += 1
+        else:
+            self._pending[session_id] = transcript_chunk
+            self.dropped_stale += 1
+
+        self._schedule(session_id)
+
+    def _schedule(self, session_id: str):
+        """Puts a session on the ready queue if it has work and is under its concurrency limit."""
+        if (
+            session_id in self._pending
+            and session_id not in self._scheduled
+            and len(self._running.get(session_id, ())) < self.per_session_limit
+        ):
+            self._scheduled.add(session_id)
+            self._ready.put_nowait(session_id)
+
+    async def _worker(self):
+        while True:
+            session_id = await self._ready.get()
+            self._scheduled.discard(session_id)
+            transcript_chunk = self._pending.pop(session_id, None)
+            if transcript_chunk is None:
+                # Cancelled while waiting
+                continue
+
+            job = asyncio.ensure_future(self.handler(session_id, transcript_chunk))
+            self._running.setdefault(session_id, set()).add(job)
+            try:
+                try:
+                    await asyncio.wait([job])
+                except asyncio.CancelledError:
+                    # The worker itself is stopping
+                    job.cancel()
+                    raise
+                if job.cancelled():
+                    self.cancelled += 1
+                elif job.exception() is not None:
+                    self.failed += 1
+                    print(f"Question generation job failed for session {session_id}: {job.exception()}")
+                else:
+                    self.completed += 1
+            finally:
+                running = self._running[session_id]
+                running.discard(job)
+                if not running:
+                    del self._running[session_id]
+                self._schedule(session_id)
+
+    def cancel_session(self, session_id: str):
+        """Drops the chunk waiting for a session and cancels its running jobs (e.g. when it ends)."""
+        self._pending.pop(session_id, None)
+        for job in self._running.get(session_id, ()):
+            job.cancel()
+
+    def pending_for(self, session_id: str) -> Optional[str]:
+        return self._pending.get(session_id)
+
+    async def close(self):
+        """Stops the workers; waiting chunks are discarded."""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._pending.clear()
+        self._scheduled.clear()
+        self._ready = asyncio.Queue()
+
+    def metrics(self) -> dict:
+        return {
+            "workers": self.workers,
+            "waiting": len(self._pending),
+            "running": sum(len(jobs) for jobs in self._running.values()),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "dropped_stale": self.dropped_stale,
+            "merged": self.merged,
+        }
@@ -0,0 +1,69 @@
+from itertools import islice
+from typing import Dict, Iterator, List, Tuple
+
+from sortedcontainers import SortedList
+
+
+class RankedLeaderboard:
+    """
+    Incrementally maintained ranking of students in a session.
+    Entries are kept sorted by (score descending, join order), giving O(log N) score
+    updates and rank lookups and O(k) top-k reads without re-sorting the class.
+    """
+
+    def __init__(self):
+        self._ranked = SortedList()  # (-score, join_seq, student_id)
+        self._keys: Dict[str, Tuple[int, int, str]] = {}  # student_id -> current key in _ranked
+        self._next_seq = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, student_id: str) -> bool:
+        return student_id in self._keys
+
+    def __iter__(self) -> Iterator[str]:
+        """Yields student IDs from highest to lowest rank."""
+        return (student_id for _, _, student_id in self._ranked)
+
+    def add(self, student_id: str, score: int = 0):
+        """Adds a student if not already ranked. Ties are broken by who was added first."""
+        if student_id in self._keys:
+            return
+        key = (-score, self._next_seq, student_id)
+        self._next_seq += 1
+        self._keys[student_id] = key
+        self._ranked.add(key)
+
+    def update(self, student_id: str, score: int):
+        """Sets a student's score, adding them if needed."""
+        key = self._keys.get(student_id)
+        if key is None:
+            self.add(student_id, score)
+            return
+        if -key[0] == score:
+            return
+        self._ranked.remove(key)
+        new_key = (-score, key[1], student_id)
+        self._keys[student_id] = new_key
+        self._ranked.add(new_key)
+
+    def remove(self, student_id: str):
+        key = self._keys.pop(student_id, None)
+        if key is not None:
+            self._ranked.remove(key)
+
+    def score(self, student_id: str) -> int:
+        key = self._keys.get(student_id)
+        return -key[0] if key else 0
+
+    def rank(self, student_id: str) -> int:
+        """1-based rank of a student, or 0 if they are not on the leaderboard."""
+        key = self._keys.get(student_id)
+        if key is None:
+            return 0
+        return self._ranked.index(key) + 1
+
+    def top(self, k: int) -> List[str]:
+        """Student IDs of the top k students, highest first."""
+        return [student_id for _, _, student_id in islice(self._ranked, k)]
@@ -0,0 +1,88 @@
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Set
+
+# How question listeners are attached: one shared collection-group watch, or one watch per session
+LISTENER_MODES = ("shared", "per_session")
+
+
+class SharedQuestionListener:
+    """
+    One Firestore watch for the questions of every session served by this process.
+    A collection-group query over all `questions` subcollections, limited to documents written
+    since the watch started, replaces a watch stream (and callback thread) per session. Each change
+    is routed in-process to its session, taken from the document path sessions/{id}/questions/{qid};
+    changes for sessions that are not registered here are ignored. The query is not limited to this
+    process's sessions, so every instance receives every new question and the watch's result set grows
+    for the life of the process; it suits a single instance or a small deployment. `healthy()` turns
+    False once the watch stream has stopped (e.g. the index exemption is missing), so the owner can
+    fall back to per-session watches.
+    """
+
+    def __init__(self, repository, on_changes: Callable[[str, List], None]):
+        self.repository = repository
+        self.on_changes = on_changes
+        self._sessions: Set[str] = set()
+        self._lock = threading.Lock()  # registrations change on the loop, the callback runs on a listener thread
+        self._watch = None
+        self.started_at: Optional[datetime] = None
+        # Metrics
+        self.snapshots = 0
+        self.changes_routed = 0
+        self.changes_ignored = 0
+
+    def register(self, session_id: str):
+        with self._lock:
+            self._sessions.add(session_id)
+        if self._watch is None:
+            self.started_at = datetime.now(timezone.utc)
+            print(f"Starting shared Firestore question listener (questions since {self.started_at.isoformat()})")
+            self._watch = self.repository.watch_questions_since(self.started_at, self._on_snapshot)
+
+    def unregister(self, session_id: str):
+        with self._lock:
+            self._sessions.discard(session_id)
+
+    def is_registered(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._sessions
+
+    def sessions(self) -> List[str]:
+        with self._lock:
+            return sorted(self._sessions)
+
+    def healthy(self) -> bool:
+        # Firestore's Watch reports is_active False once its stream has ended with an error
+        return self._watch is None or bool(getattr(self._watch, "is_active", True))
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        self.snapshots += 1
+        by_session: Dict[str, List] = {}
+        with self._lock:
+            sessions = set(self._sessions)
+        for change in changes:
+            session_id = change.document.reference.parent.parent.id
+            if session_id in sessions:
+                by_session.setdefault(session_id, []).append(change)
+                self.changes_routed += 1
+            else:
+                self.changes_ignored += 1
+        for session_id, session_changes in by_session.items():
+            self.on_changes(session_id, session_changes)
+
+    def close(self):
+        if self._watch is not None:
+            try:
+                self._watch.unsubscribe()
+            except Exception as e:
+                print(f"Error closing shared question listener: {e}")
+            self._watch = None
+
+    def metrics(self) -> dict:
+        return {
+            "streams": 1 if self._watch is not None else 0,
+            "sessions": len(self._sessions),
+            "snapshots": self.snapshots,
+            "changes_routed": self.changes_routed,
+            "changes_ignored": self.changes_ignored,
+        }
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, List, Optional
+
+import httpx
+
+from app.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.rate_limit import FairRateLimiter
+
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta/models"
+
+
+class GeminiClient:
+    """
+    Shared async client for the Gemini API.
+    One pooled keep-alive HTTP client is reused by every session, requests have connect/read
+    timeouts so a hung call cannot stall a lecture, and a semaphore caps concurrent calls.
+    An optional rate limiter spaces requests out across sessions before they are sent,
+    and is paused when Gemini answers 429 so waiting requests back off together.
+    An optional circuit breaker records each call's outcome and latency; while it is open,
+    requests fail immediately with CircuitOpenError instead of waiting out the timeout.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        max_connections: int = 20,
+        max_concurrency: int = 10,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        limiter: Optional[FairRateLimiter] = None,
+        throttle_backoff_seconds: float = 5.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.api_key = api_key
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.limiter = limiter
+        self.throttle_backoff_seconds = throttle_backoff_seconds
+        self.breaker = breaker
+        self._client: Optional[httpx.AsyncClient] = None
+        # Metrics
+        self.in_flight = 0
+        self.requests_sent = 0
+        self.request_errors = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The pooled HTTP client, created on first use so it binds to the running event loop."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(limits=self._limits, timeout=self._timeout)
+        return self._client
+
+    def url(self, method: str = "generateContent") -> str:
+        return f"{GEMINI_API_BASE}/{self.model}:{method}"
+
+    @asynccontextmanager
+    async def _request_slot(self) -> AsyncIterator[Callable[[], None]]:
+        """
+        Wraps one request: circuit breaker check, rate limit, then a concurrency slot.
+        Yields a callback the request calls once the response is good; an exception is recorded
+        as a failure, and a request abandoned before either (e.g. cancelled) frees its probe slot.
+        """
+        if self.breaker is not None and not self.breaker.allow_request():
+            raise CircuitOpenError("Gemini circuit breaker is open")
+
+        recorded = False
+        try:
+            if self.limiter is not None:
+                await self.limiter.acquire()
+            async with self._semaphore:
+                self.in_flight += 1
+                self.requests_sent += 1
+                started = time.perf_counter()
+
+                def succeeded():
+                    nonlocal recorded
+                    if self.breaker is not None and not recorded:
+                        self.breaker.record_success((time.perf_counter() - started) * 1000)
+                    recorded = True
+
+                try:
+                    yield succeeded
+                except Exception:
+                    self.request_errors += 1
+                    if self.breaker is not None and not recorded:
+                        self.breaker.record_failure()
+                    recorded = True
+                    raise
+                finally:
+                    self.in_flight -= 1
+        finally:
+            if self.breaker is not None and not recorded:
+                self.breaker.record_cancelled()
+
+    def _check_response(self, response: httpx.Response):
+        if response.status_code == 429 and self.limiter is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            self.limiter.pause(float(retry_after) if retry_after.isdigit() else self.throttle_backoff_seconds)
+        response.raise_for_status()
+
+    async def generate_content(self, payload: dict) -> dict:
+        """POSTs a generateContent request and returns the decoded JSON response."""
+        async with self._request_slot() as succeeded:
+            response = await self.client.post(
+                self.url(),
+                params={"key": self.api_key},
+                json=payload,
+                headers={"Content-Type": "application/json"},
+            )
+            self._check_response(response)
+            result = response.json()
+            succeeded()
+            return result
+
+    async def stream_generate_content(self, payload: dict) -> AsyncIterator[str]:
+        """
+        Calls streamGenerateContent (server-sent events) and yields response text fragments
+        as they arrive. The concurrency slot is held until the stream is exhausted or closed.
+        For the circuit breaker, the call counts as successful once the first fragment arrives.
+        """
+        async with self._request_slot() as succeeded:
+            async with self.client.stream(
+                "POST",
+                self.url("streamGenerateContent"),
+                params={"key": self.api_key, "alt": "sse"},
+                json=payload,
+                headers={"Content-Type": "application/json"},
+            ) as response:
+                self._check_response(response)
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    event = json.loads(line[len("data:") :])
+                    for candidate in event.get("candidates", [])[:1]:
+                        for part in candidate.get("content", {}).get("parts", []):
+                            if part.get("text"):
+                                succeeded()
+                                yield part["text"]
+            succeeded()
+
+    async def close(self):
+        """Closes pooled connections; the client is recreated if used again."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class StreamingArrayParser:
+    """
+    Incremental JSON parser for responses shaped like {"questions": [{...}, {...}]}.
+    Text is fed in arbitrary fragments; each element object of the array is decoded and
+    returned as soon as its closing brace arrives, without waiting for the rest of the document.
+    """
+
+    def __init__(self):
+        self._stack: List[str] = []  # open containers, e.g. ["{", "["]
+        self._in_string = False
+        self._escaped = False
+        self._item: List[str] = []  # text of the array element currently being read
+        self._item_open = False
+
+    def feed(self, text: str) -> List[dict]:
+        """Consumes a fragment and returns any array elements it completed."""
+        completed = []
+        for char in text:
+            if self._item_open:
+                self._item.append(char)
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if char == "{" and self._stack == ["{", "["]:
+                    # Start of an element of the top-level array
+                    self._item = [char]
+                    self._item_open = True
+                self._stack.append(char)
+            elif char in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if char == "}" and self._item_open and self._stack == ["{", "["]:
+                    self._item_open = False
+                    try:
+                        completed.append(json.loads("".join(self._item)))
+                    except json.JSONDecodeError as e:
+                        print(f"Skipping malformed streamed item: {e}")
+                    self._item = []
+        return completed
+
+
+class LatencyTracker:
+    """Rolling window of recent request latencies, used to decide when to hedge a slow request."""
+
+    def __init__(self, window: int = 200, min_samples: int = 10):
+        self._samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, latency_ms: float):
+        self._samples.append(latency_ms)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Latency at percentile p (0-1), or None until enough samples have been seen."""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(p * len(ordered)))
+        return ordered[index]
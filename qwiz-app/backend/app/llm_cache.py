@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import json
+import re
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+from app.schemas import FirestoreQuestion
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_transcript(transcript: str) -> str:
+    """Case- and whitespace-insensitive form of a transcript chunk, used for cache keys."""
+    return _WHITESPACE.sub(" ", transcript).strip().lower()
+
+
+def cache_key(transcript: str, model: str, prompt_version: str, count: int = 3) -> str:
+    """
+    Content address for a generation request: hash of normalized transcript, prompt version, model
+    and question count. The default count of 3 is left out so existing keys stay valid.
+    """
+    material = f"{prompt_version}\x00{model}\x00{normalize_transcript(transcript)}"
+    if count != 3:
+        material += f"\x00{count}"
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Two-tier cache of generated questions.
+    An in-memory LRU serves repeat chunks without any I/O; an optional on-disk tier keeps
+    results across restarts (e.g. the same lecture delivered to another stream).
+    Each hit returns fresh FirestoreQuestion objects with new IDs.
+    """
+
+    def __init__(self, max_entries: int = 1024, disk_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+        self._memory: "OrderedDict[str, List[dict]]" = OrderedDict()
+        # Metrics
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.json"
+
+    def _remember(self, key: str, questions: List[dict]):
+        self._memory[key] = questions
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    @staticmethod
+    def _materialize(questions: List[dict]) -> List[FirestoreQuestion]:
+        return [FirestoreQuestion(**data) for data in questions]
+
+    async def get(self, key: str) -> Optional[List[FirestoreQuestion]]:
+        """Returns cached questions for a key, or None on a miss."""
+        questions = self._memory.get(key)
+        if questions is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return self._materialize(questions)
+
+        if self.disk_dir:
+            questions = await asyncio.to_thread(self._read_disk, key)
+            if questions is not None:
+                self._remember(key, questions)
+                self.disk_hits += 1
+                return self._materialize(questions)
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, questions: List[FirestoreQuestion]):
+        """Stores generated questions under a key (IDs are not stored)."""
+        if not questions:
+            return
+        data = [question.model_dump(exclude={"id"}) for question in questions]
+        self._remember(key, data)
+        if self.disk_dir:
+            await asyncio.to_thread(self._write_disk, key, data)
+
+    def _read_disk(self, key: str) -> Optional[List[dict]]:
+        try:
+            return json.loads(self._path(key).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Error reading LLM cache entry {key}: {e}")
+            return None
+
+    def _write_disk(self, key: str, data: List[dict]):
+        try:
+            # Write to a temp file and rename so readers never see a partial entry
+            tmp_path = self._path(key).with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(data), encoding="utf-8")
+            tmp_path.replace(self._path(key))
+        except OSError as e:
+            print(f"Error writing LLM cache entry {key}: {e}")
+
+    def metrics(self) -> dict:
+        return {
+            "entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
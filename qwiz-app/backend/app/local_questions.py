@@ -0,0 +1,86 @@
+import random
+import re
+import zlib
+from collections import Counter
+from typing import List, Optional
+
+from app.schemas import FirestoreQuestion
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_WORD = re.compile(r"[A-Za-z][A-Za-z'-]*[A-Za-z]|\d+(?:\.\d+)?")
+
+STOPWORDS = frozenset(
+    """a about above after again against all also am an and any are as at be because been before being below
+    between both but by can could did do does doing down during each few for from further had has have having
+    he her here hers him his how i if in into is it its itself just let like many me more most much must my no
+    nor not now of off on once only or other our out over own really same she should so some something such
+    than that the their them then there these they thing things this those through to too under until up us
+    very was way we well were what when where which while who whom why will with would yeah you your okay
+    actually basically going gonna kind right sort today""".split()
+)
+
+BLANK = "_____"
+
+
+def _keywords(sentence: str) -> List[str]:
+    return [word for word in _WORD.findall(sentence) if word.lower() not in STOPWORDS and len(word) >= 4]
+
+
+def generate_cloze_questions(transcript: str, count: int = 3) -> List[FirestoreQuestion]:
+    """
+    CPU-only fallback used while the LLM is unavailable: turns key sentences of the transcript into
+    fill-in-the-blank questions. The blanked term is the sentence's most lecture-specific keyword
+    (most frequent across the chunk, then longest); distractors are other keywords from the chunk.
+    Deterministic for a given transcript and fast enough to run inline on the event loop.
+    """
+    sentences = [s.strip() for s in _SENTENCE_END.split(transcript) if 6 <= len(s.split()) <= 40]
+    frequencies = Counter(word.lower() for sentence in sentences for word in _keywords(sentence))
+    vocabulary = sorted({word for sentence in sentences for word in _keywords(sentence)}, key=str.lower)
+
+    candidates = []
+    for sentence in sentences:
+        keywords = _keywords(sentence)
+        if not keywords:
+            continue
+        answer = max(keywords, key=lambda word: (frequencies[word.lower()], len(word)))
+        score = frequencies[answer.lower()] + len(keywords) / 10
+        candidates.append((score, sentence, answer))
+
+    questions = []
+    used_answers = set()
+    for _, sentence, answer in sorted(candidates, key=lambda candidate: -candidate[0]):
+        if answer.lower() in used_answers:
+            continue
+        question = _cloze_question(sentence, answer, vocabulary)
+        if question is None:
+            continue
+        used_answers.add(answer.lower())
+        questions.append(question)
+        if len(questions) == count:
+            break
+    return questions
+
+
+def _cloze_question(sentence: str, answer: str, vocabulary: List[str]) -> Optional[FirestoreQuestion]:
+    rng = random.Random(zlib.crc32(sentence.encode("utf-8")))
+    # Prefer distractors of the same kind (numbers for numbers, words for words) and similar length
+    is_number = answer[0].isdigit()
+    pool = [
+        word
+        for word in vocabulary
+        if word.lower() != answer.lower() and word[0].isdigit() == is_number and word.lower() not in sentence.lower()
+    ]
+    if len(pool) < 3:
+        return None
+    pool.sort(key=lambda word: (abs(len(word) - len(answer)), rng.random()))
+    options = pool[:3] + [answer]
+    rng.shuffle(options)
+
+    blanked = re.sub(rf"\b{re.escape(answer)}\b", BLANK, sentence, count=1)
+    return FirestoreQuestion(
+        questionText=f'Fill in the blank: "{blanked}"',
+        options=options,
+        correctAnswer=answer,
+        explanation=f'The lecture said: "{sentence}"',
+        generatedBy="local",
+    )
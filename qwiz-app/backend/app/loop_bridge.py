@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, List, Optional
+
+
+class LoopBridge:
+    """
+    Thread-safe hand-off from foreign threads (e.g. Firestore listener callbacks) to the asyncio loop.
+    Producers append to a bounded buffer and wake the loop with call_soon_threadsafe, at most once per
+    burst; a single consumer task on the loop drains the buffer and passes items to `handler` in
+    arrival order, in batches of up to `max_batch`. When the buffer is full a producer waits up to
+    `put_timeout` seconds for space (backpressure on the listener thread), then drops the item.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], Awaitable[None]],
+        max_batch: int = 100,
+        max_pending: int = 10000,
+        put_timeout: float = 1.0,
+    ):
+        self.handler = handler
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.put_timeout = put_timeout
+        self._items = deque()  # (enqueued_at, item)
+        self._lock = threading.Lock()
+        self._space = threading.Condition(self._lock)
+        self._wakeup_pending = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._consumer: Optional[asyncio.Task] = None
+        # Metrics
+        self.submitted = 0
+        self.delivered = 0
+        self.batches = 0
+        self.dropped = 0
+        self.producer_waits = 0
+        self.handler_errors = 0
+        self.max_depth = 0
+        self.max_latency_ms = 0.0
+
+    def bind(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Attaches the bridge to the loop that will consume items; call from that loop."""
+        loop = loop or asyncio.get_running_loop()
+        if self._loop is loop and self._consumer is not None and not self._consumer.done():
+            return
+        self._loop = loop
+        self._ready = asyncio.Event()
+        self._consumer = loop.create_task(self._consume())
+        if self._items:
+            self._ready.set()
+
+    def submit(self, item: Any) -> bool:
+        """Queues an item from any thread; returns False if it was dropped because the buffer stayed full."""
+        with self._space:
+            if len(self._items) >= self.max_pending:
+                self.producer_waits += 1
+                if not self._space.wait_for(lambda: len(self._items) < self.max_pending, self.put_timeout):
+                    self.dropped += 1
+                    return False
+            self._items.append((time.monotonic(), item))
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, len(self._items))
+            wake = not self._wakeup_pending and self._loop is not None
+            if wake:
+                self._wakeup_pending = True
+
+        if wake:
+            try:
+                self._loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                # The loop is closed (shutting down); nothing will consume the item
+                with self._space:
+                    self._wakeup_pending = False
+                return False
+        return True
+
+    def _wake(self):
+        self._ready.set()
+
+    def _take_batch(self) -> List[tuple]:
+        with self._space:
+            batch = [self._items.popleft() for _ in range(min(self.max_batch, len(self._items)))]
+            if not self._items:
+                self._wakeup_pending = False
+            self._space.notify_all()
+        return batch
+
+    async def _consume(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    break
+                now = time.monotonic()
+                self.max_latency_ms = max(self.max_latency_ms, (now - batch[0][0]) * 1000)
+                self.batches += 1
+                try:
+                    await self.handler([item for _, item in batch])
+                    self.delivered += len(batch)
+                except Exception as e:
+                    self.handler_errors += 1
+                    print(f"Error handling bridged batch of {len(batch)} items: {e}")
+
+    async def close(self):
+        """Delivers anything already queued, then stops the consumer."""
+        if self._consumer is None:
+            return
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                break
+            await self.handler([item for _, item in batch])
+            self.delivered += len(batch)
+        self._consumer.cancel()
+        await asyncio.gather(self._consumer, return_exceptions=True)
+        self._consumer = None
+        self._loop = None
+
+    def depth(self) -> int:
+        with self._space:
+            return len(self._items)
+
+    def metrics(self) -> dict:
+        return {
+            "depth": self.depth(),
+            "max_depth": self.max_depth,
+            "submitted": self.submitted,
+            "delivered": self.delivered,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "producer_waits": self.producer_waits,
+            "handler_errors": self.handler_errors,
+            "max_latency_ms": self.max_latency_ms,
+        }
@@ -31,6 +31,21 @@ def _startup_event():
     app.include_router(sessions.router)
 
 
+@app.on_event("shutdown")
+async def _shutdown_event():
+    """Flushes buffered analytics events and releases shared clients when the instance stops."""
+    from app.api.sessions import generation_queue, session_actors
+    from app.dependencies import analytics_service, gemini_client, repository, session_manager, state_store
+
+    await session_manager.close_listeners()
+    await session_actors.close()
+    await generation_queue.close()
+    await analytics_service.event_sink.close()
+    await gemini_client.close()
+    await state_store.close()
+    repository.shutdown()
+
+
 @app.get("/")
 async def root():
     return {"status": "The Qwiz App backend is running"}
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+from typing import Dict, Optional, Tuple
+
+from app.ttl_store import SessionTTLStore
+
+
+class QuestionCache:
+    """
+    Per-session cache of question documents, so grading answers needs no Firestore reads.
+    It is filled when this process saves a question and when the snapshot listener sees one;
+    anything else falls through to the repository once, with concurrent misses for the same
+    question sharing a single read. Listener callbacks run on Firestore threads, so the store is locked.
+    """
+
+    def __init__(self, repository, ttl_seconds: float = 6 * 3600, max_entries: int = 20000, max_per_session: int = 500):
+        self.repository = repository
+        self._store = SessionTTLStore(ttl_seconds=ttl_seconds, max_entries=max_entries, max_per_session=max_per_session)
+        self._lock = threading.Lock()
+        self._loading: Dict[Tuple[str, str], asyncio.Future] = {}
+        # Metrics
+        self.reads = 0
+
+    def put(self, session_id: str, question_id: str, question_data: dict):
+        with self._lock:
+            self._store.put((session_id, question_id), session_id, question_data)
+
+    async def get(self, session_id: str, question_id: str) -> Optional[dict]:
+        """Returns the question document data, reading Firestore only on a cache miss."""
+        key = (session_id, question_id)
+        with self._lock:
+            question_data = self._store.get(key)
+        if question_data is not None:
+            return question_data
+
+        loading = self._loading.get(key)
+        if loading is not None:
+            return await asyncio.shield(loading)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            self.reads += 1
+            question_data = await self.repository.get_question(session_id, question_id)
+            if question_data is not None:
+                self.put(session_id, question_id, question_data)
+            future.set_result(question_data)
+            return question_data
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited future does not log "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self._loading[key]
+
+    def discard_session(self, session_id: str):
+        with self._lock:
+            self._store.discard_session(session_id)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            metrics = self._store.metrics()
+        metrics["firestore_reads"] = self.reads
+        return metrics
@@ -0,0 +1,165 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+# Priority classes: lower is served first
+PRIORITY_INTERACTIVE = 0  # Active mode - a lecturer is waiting to pick a question
+PRIORITY_BACKGROUND = 1  # Passive mode - questions are auto-released in the background
+
+# (session_id, priority, weight) of the LLM work running in the current task
+_request_scope: ContextVar[Tuple[Optional[str], int, float]] = ContextVar(
+    "llm_request_scope", default=(None, PRIORITY_BACKGROUND, 1.0)
+)
+
+
+@contextmanager
+def llm_request_scope(session_id: str, priority: int = PRIORITY_BACKGROUND, weight: float = 1.0):
+    """
+    Tags LLM requests made inside the block (including tasks it spawns) with a session, priority and
+    fair-share weight, so the rate limiter can schedule them without every call site passing them through.
+    """
+    if weight <= 0:
+        raise ValueError("weight must be positive")
+    token = _request_scope.set((session_id, priority, weight))
+    try:
+        yield
+    finally:
+        _request_scope.reset(token)
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request waited longer than the limiter's max_wait for a slot."""
+
+
+class FairRateLimiter:
+    """
+    Process-wide token bucket for LLM requests, with weighted fair queuing across sessions.
+    Requests that cannot go immediately wait in a heap ordered by priority class, then by a
+    per-session virtual finish time, so one busy session cannot starve the others and
+    interactive requests are served before background ones. Each request advances its session's
+    finish time by cost / weight, so among backlogged sessions of one priority class a session of
+    weight 2 is granted twice as many requests as one of weight 1 (the default).
+    """
+
+    def __init__(self, rate_per_second: float, burst: int = 10, max_wait: Optional[float] = 30.0):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.max_wait = max_wait
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._heap: List[tuple] = []  # (priority, finish_tag, seq, cost, future)
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}  # session_id -> finish tag of its last queued request
+        self._dispatcher: Optional[asyncio.Task] = None
+        # Metrics
+        self.granted = 0
+        self.queued = 0
+        self.timeouts = 0
+        self.waited = 0
+        self.throttled = 0
+        self.max_queue_depth = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    async def acquire(
+        self,
+        session_id: Optional[str] = None,
+        priority: Optional[int] = None,
+        cost: float = 1.0,
+        weight: Optional[float] = None,
+    ):
+        """
+        Waits for permission to send a request. Session, priority and weight default to the current
+        llm_request_scope. Raises RateLimitExceeded after max_wait seconds.
+        """
+        scope_session, scope_priority, scope_weight = _request_scope.get()
+        session_id = session_id if session_id is not None else scope_session or "_unscoped"
+        priority = priority if priority is not None else scope_priority
+        weight = weight if weight is not None else scope_weight
+
+        self._refill()
+        if not self._heap and self._tokens >= cost and time.monotonic() >= self._paused_until:
+            self._tokens -= cost
+            self.granted += 1
+            return
+
+        finish_tag = max(self._virtual_time, self._last_finish.get(session_id, 0.0)) + cost / weight
+        self._last_finish[session_id] = finish_tag
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, finish_tag, next(self._seq), cost, future))
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, len(self._heap))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        started = time.monotonic()
+        try:
+            # wait_for cancels the future on timeout, and the dispatcher skips cancelled entries
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise RateLimitExceeded(f"No LLM request slot within {self.max_wait}s")
+        wait_ms = (time.monotonic() - started) * 1000
+        self.waited += 1
+        self.total_wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+    async def _dispatch(self):
+        """Grants queued requests in (priority, finish tag) order as tokens become available."""
+        while self._heap:
+            priority, finish_tag, _, cost, future = self._heap[0]
+            if future.done():
+                heapq.heappop(self._heap)
+                continue
+
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            self._refill()
+            if self._tokens < cost:
+                await asyncio.sleep((cost - self._tokens) / self.rate_per_second)
+                continue
+
+            heapq.heappop(self._heap)
+            self._tokens -= cost
+            self._virtual_time = finish_tag
+            self.granted += 1
+            future.set_result(None)
+
+        # Nothing is waiting, so no session is behind; start fair-share accounting afresh
+        self._last_finish.clear()
+
+    def pause(self, seconds: float):
+        """Stops granting requests for a while, e.g. after the API answered 429 Too Many Requests."""
+        self.throttled += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    def queue_depth(self) -> int:
+        return sum(1 for entry in self._heap if not entry[4].done())
+
+    def metrics(self) -> dict:
+        return {
+            "rate_per_second": self.rate_per_second,
+            "queue_depth": self.queue_depth(),
+            "max_queue_depth": self.max_queue_depth,
+            "granted": self.granted,
+            "queued": self.queued,
+            "timeouts": self.timeouts,
+            "throttled": self.throttled,
+            "avg_wait_ms": self.total_wait_ms / self.waited if self.waited else 0.0,
+            "max_wait_ms": self.max_wait_ms,
+        }
@@ -0,0 +1,136 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Iterable, Optional, Tuple
+
+
+class FirestoreRepository:
+    """
+    Data-access layer for sessions, questions and analytics events.
+    The Firestore client is blocking, so every call runs on a bounded thread pool and the
+    event loop only awaits the result. Queue wait, call time and concurrency are tracked.
+    """
+
+    def __init__(self, db_client, max_workers: int = 16):
+        self.db = db_client
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="firestore")
+        # Metrics
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_queue_wait_ms = 0.0
+        self.total_call_ms = 0.0
+
+    async def _run(self, fn: Callable, *args):
+        """Runs a blocking Firestore call on the pool and records how long it queued and ran."""
+        loop = asyncio.get_running_loop()
+        submitted = time.perf_counter()
+
+        def call():
+            started = time.perf_counter()
+            self.total_queue_wait_ms += (started - submitted) * 1000
+            try:
+                return fn(*args)
+            finally:
+                self.total_call_ms += (time.perf_counter() - started) * 1000
+
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await loop.run_in_executor(self._executor, call)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    # Document references
+
+    def session_ref(self, session_id: str):
+        return self.db.collection("sessions").document(session_id)
+
+    def questions_ref(self, session_id: str):
+        return self.session_ref(session_id).collection("questions")
+
+    def analytics_ref(self, session_id: str):
+        return self.session_ref(session_id).collection("analytics")
+
+    # Sessions
+
+    def get_session_sync(self, session_id: str) -> Optional[dict]:
+        """Blocking read for callers already off the event loop (e.g. listener threads)."""
+        doc = self.session_ref(session_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    async def get_session(self, session_id: str) -> Optional[dict]:
+        """Returns the session document data, or None if it does not exist."""
+        return await self._run(self.get_session_sync, session_id)
+
+    async def session_exists(self, session_id: str) -> bool:
+        return await self._run(lambda: self.session_ref(session_id).get().exists)
+
+    async def create_session(self, session_id: str, data: dict):
+        await self._run(self.session_ref(session_id).set, data)
+
+    async def update_session(self, session_id: str, data: dict):
+        await self._run(self.session_ref(session_id).update, data)
+
+    # Questions
+
+    async def get_question(self, session_id: str, question_id: str) -> Optional[dict]:
+        """Returns the question document data, or None if it does not exist."""
+
+        def get():
+            doc = self.questions_ref(session_id).document(question_id).get()
+            return doc.to_dict() if doc.exists else None
+
+        return await self._run(get)
+
+    async def save_question(self, session_id: str, question_id: str, data: dict):
+        await self._run(self.questions_ref(session_id).document(question_id).set, data)
+
+    def watch_questions(self, session_id: str, callback: Callable):
+        """Attaches a snapshot listener to a session's questions; returns the watch handle."""
+        return self.questions_ref(session_id).on_snapshot(callback)
+
+    def watch_questions_since(self, since: datetime, callback: Callable):
+        """
+        Attaches one snapshot listener to the questions of all sessions written since `since`
+        (a collection-group query; needs a collection-group index on questions.timestamp).
+        """
+        from google.cloud.firestore_v1.base_query import FieldFilter
+
+        query = self.db.collection_group("questions").where(filter=FieldFilter("timestamp", ">=", since))
+        return query.on_snapshot(callback)
+
+    # Analytics
+
+    async def write_analytics_events(self, events: Iterable[Tuple[str, dict]]):
+        """Writes (session_id, event_data) pairs as a single Firestore batch."""
+
+        def commit():
+            batch = self.db.batch()
+            for session_id, event_data in events:
+                batch.set(self.analytics_ref(session_id).document(), event_data)
+            batch.commit()
+
+        await self._run(commit)
+
+    def metrics(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "calls": self.calls,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "avg_queue_wait_ms": self.total_queue_wait_ms / self.calls if self.calls else 0.0,
+            "avg_call_ms": self.total_call_ms / self.calls if self.calls else 0.0,
+        }
+
+    def shutdown(self):
+        """Waits for in-flight calls and stops the thread pool."""
+        self._executor.shutdown(wait=True)
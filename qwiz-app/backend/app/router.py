@@ -0,0 +1,354 @@
+"""
+Front router for the sharded deployment: one backend worker process per core, each owning
+whole sessions, so session state stays in-process and nothing is shared between workers.
+
+    python -m app.router --workers 4 --port 8080
+
+starts four `app.main:app` workers on ports 8081-8084 and routes every request and WebSocket
+for a session code to the worker that owns it (see ShardDirectory). Workers are started with
+ACCEPT_ROUTER_SESSION_CODES=true so they take the session code the router picks; they should
+only listen on addresses that clients cannot reach directly. `GET /metrics` on the router returns
+every worker's metrics keyed by worker URL; `GET /router/metrics` returns the router's own.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from typing import List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from app.sharding import ShardDirectory, new_session_code
+
+# Hop-by-hop headers are not forwarded; content headers are recomputed for the decoded body
+_SKIP_REQUEST_HEADERS = {"host", "connection", "keep-alive", "transfer-encoding", "upgrade", "content-length"}
+_SKIP_RESPONSE_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-encoding", "content-length"}
+_SKIP_WEBSOCKET_HEADERS = _SKIP_REQUEST_HEADERS | {
+    "sec-websocket-key",
+    "sec-websocket-version",
+    "sec-websocket-extensions",
+    "sec-websocket-protocol",
+}
+
+
+def session_key(path: str, body: bytes = b"") -> Optional[str]:
+    """The session code a request belongs to, or None for requests any worker can serve."""
+    parts = [part for part in path.split("/") if part]
+    if len(parts) == 3 and parts[0] == "ws":
+        return parts[2]  # /ws/{client_type}/{session_id}
+    if len(parts) >= 2 and parts[0] == "sessions":
+        return parts[1]  # /sessions/{session_id}/...
+    if parts == ["select-question"] and body:
+        try:
+            return json.loads(body).get("session_id")
+        except (ValueError, AttributeError):
+            return None
+    return None
+
+
+async def _connect_websocket(url: str, headers: dict):
+    """Opens the upstream WebSocket with whichever client API the installed websockets provides."""
+    try:
+        from websockets.asyncio.client import connect  # websockets >= 13
+    except ImportError:
+        from websockets.client import connect  # Older releases pulled in by uvicorn[standard]
+
+        return await connect(url, extra_headers=headers, max_size=None)
+    return await connect(url, additional_headers=headers, max_size=None)
+
+
+class ShardRouter:
+    """
+    ASGI app that proxies HTTP and WebSocket traffic to the worker owning each session.
+    /start-session picks a fresh code, sends the request to the code's owner with an
+    X-Session-Code header and retries with another code if it is taken. A health check
+    adds and removes workers from the ring as they come and go.
+    """
+
+    def __init__(
+        self,
+        workers: List[str],
+        directory: Optional[ShardDirectory] = None,
+        client: Optional[httpx.AsyncClient] = None,
+        health_interval: float = 2.0,
+        failures_before_removal: int = 2,
+        start_session_attempts: int = 10,
+    ):
+        self.workers = list(workers)
+        self.directory = directory or ShardDirectory(self.workers)
+        self.client = client or httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=5.0))
+        self.health_interval = health_interval
+        self.failures_before_removal = failures_before_removal
+        self.start_session_attempts = start_session_attempts
+        self._failures = {worker: 0 for worker in self.workers}
+        self._health_task: Optional[asyncio.Task] = None
+        self._next_worker = 0
+        # Metrics
+        self.http_requests = 0
+        self.websockets_proxied = 0
+        self.upstream_errors = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._proxy_http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await self._proxy_websocket(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self._health_task = asyncio.create_task(self._health_loop())
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._health_task is not None:
+                    self._health_task.cancel()
+                    await asyncio.gather(self._health_task, return_exceptions=True)
+                await self.client.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # Membership
+
+    async def check_workers(self):
+        """Adds workers that answer the health check to the ring and removes ones that keep failing."""
+        for worker in self.workers:
+            try:
+                response = await self.client.get(f"{worker}/", timeout=2.0)
+                healthy = response.status_code == 200
+            except httpx.HTTPError:
+                healthy = False
+
+            if healthy:
+                self._failures[worker] = 0
+                if worker not in self.directory.ring:
+                    print(f"Worker {worker} joined the ring")
+                    self.directory.add_worker(worker)
+            else:
+                self._failures[worker] += 1
+                if self._failures[worker] >= self.failures_before_removal and worker in self.directory.ring:
+                    moved = self.directory.remove_worker(worker)
+                    print(f"Worker {worker} left the ring; {len(moved)} live sessions move to other workers")
+        self.directory.expire_pins()
+
+    async def _health_loop(self):
+        while True:
+            try:
+                await self.check_workers()
+            except Exception as e:
+                print(f"Error checking workers: {e}")
+            await asyncio.sleep(self.health_interval)
+
+    def _any_worker(self) -> Optional[str]:
+        workers = self.directory.ring.nodes
+        if not workers:
+            return None
+        self._next_worker = (self._next_worker + 1) % len(workers)
+        return workers[self._next_worker]
+
+    # HTTP
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                return body
+
+    @staticmethod
+    def _forward_headers(scope, skip) -> dict:
+        headers = {}
+        for name, value in scope["headers"]:
+            name = name.decode("latin-1").lower()
+            if name not in skip:
+                headers[name] = value.decode("latin-1")
+        return headers
+
+    @staticmethod
+    async def _respond(send, status: int, body: bytes, headers=()):
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _forward(self, worker: str, scope, body: bytes, extra_headers: dict = None) -> httpx.Response:
+        url = worker + scope["path"]
+        if scope.get("query_string"):
+            url += "?" + scope["query_string"].decode("latin-1")
+        headers = self._forward_headers(scope, _SKIP_REQUEST_HEADERS)
+        headers.update(extra_headers or {})
+        return await self.client.request(scope["method"], url, content=body, headers=headers)
+
+    async def _proxy_http(self, scope, receive, send):
+        self.http_requests += 1
+        body = await self._read_body(receive)
+
+        if scope["path"] in ("/router/metrics", "/metrics") and scope["method"] == "GET":
+            metrics = self.metrics() if scope["path"] == "/router/metrics" else await self.worker_metrics()
+            payload = json.dumps(metrics).encode()
+            await self._respond(send, 200, payload, [("content-type", "application/json")])
+            return
+
+        try:
+            if scope["path"] == "/start-session" and scope["method"] == "POST":
+                response = await self._start_session(scope, body)
+            else:
+                session_id = session_key(scope["path"], body)
+                worker = self.directory.worker_for(session_id) if session_id else self._any_worker()
+                if worker is None:
+                    await self._respond(send, 503, b'{"detail":"No workers available"}')
+                    return
+                response = await self._forward(worker, scope, body)
+        except httpx.HTTPError as e:
+            self.upstream_errors += 1
+            print(f"Error proxying {scope['method']} {scope['path']}: {e}")
+            await self._respond(send, 502, b'{"detail":"Worker unavailable"}')
+            return
+
+        headers = [(k, v) for k, v in response.headers.items() if k.lower() not in _SKIP_RESPONSE_HEADERS]
+        await self._respond(send, response.status_code, response.content, headers)
+
+    async def worker_metrics(self) -> dict:
+        """Collects `GET /metrics` from every worker in the ring, keyed by worker URL."""
+
+        async def fetch(worker):
+            try:
+                response = await self.client.get(f"{worker}/metrics", timeout=2.0)
+                response.raise_for_status()
+                return response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                return {"error": str(e) or type(e).__name__}
+
+        workers = list(self.directory.ring.nodes)
+        results = await asyncio.gather(*(fetch(worker) for worker in workers))
+        return dict(zip(workers, results))
+
+    async def _start_session(self, scope, body: bytes) -> httpx.Response:
+        """Creates the session on the worker that will own it, retrying with a new code if one is taken."""
+        for _ in range(self.start_session_attempts):
+            session_code = new_session_code()
+            worker = self.directory.worker_for(session_code)
+            if worker is None:
+                raise httpx.ConnectError("No workers available")
+            response = await self._forward(worker, scope, body, {"x-session-code": session_code})
+            if response.status_code != 409:
+                if response.status_code < 300:
+                    self.directory.pin(session_code, worker)
+                return response
+        return httpx.Response(500, json={"detail": "Could not generate unique session code"})
+
+    # WebSocket
+
+    async def _proxy_websocket(self, scope, receive, send):
+        await receive()  # websocket.connect
+        session_id = session_key(scope["path"])
+        worker = self.directory.worker_for(session_id) if session_id else self._any_worker()
+        if worker is None:
+            await send({"type": "websocket.close", "code": 1013})
+            return
+
+        split = urlsplit(worker)
+        url = f"{'wss' if split.scheme == 'https' else 'ws'}://{split.netloc}{scope['path']}"
+        if scope.get("query_string"):
+            url += "?" + scope["query_string"].decode("latin-1")
+        try:
+            upstream = await _connect_websocket(url, self._forward_headers(scope, _SKIP_WEBSOCKET_HEADERS))
+        except Exception as e:
+            self.upstream_errors += 1
+            print(f"Error connecting WebSocket to {worker}: {e}")
+            await send({"type": "websocket.close", "code": 1013})
+            return
+
+        await send({"type": "websocket.accept"})
+        self.websockets_proxied += 1
+        if session_id:
+            self.directory.connection_opened(session_id, worker)
+
+        async def client_to_worker():
+            while True:
+                message = await receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                await upstream.send(message["text"] if message.get("text") is not None else message["bytes"])
+
+        async def worker_to_client():
+            async for data in upstream:
+                if isinstance(data, str):
+                    await send({"type": "websocket.send", "text": data})
+                else:
+                    await send({"type": "websocket.send", "bytes": data})
+
+        pumps = [asyncio.create_task(client_to_worker()), asyncio.create_task(worker_to_client())]
+        try:
+            done, pending = await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            if pumps[1] in done:
+                # The worker closed first (or went away); pass the close on to the client
+                code = getattr(upstream, "close_code", None) or 1012
+                try:
+                    await send({"type": "websocket.close", "code": code})
+                except Exception:
+                    pass
+        finally:
+            await upstream.close()
+            if session_id:
+                self.directory.connection_closed(session_id)
+
+    def metrics(self) -> dict:
+        return {
+            **self.directory.metrics(),
+            "http_requests": self.http_requests,
+            "websockets_proxied": self.websockets_proxied,
+            "upstream_errors": self.upstream_errors,
+        }
+
+
+def main():
+    """Starts one backend worker per core (or --workers) behind the router."""
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run sharded Qwiz backend workers behind a session router")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8080)))
+    parser.add_argument("--worker-base-port", type=int, default=None)
+    args = parser.parse_args()
+
+    base_port = args.worker_base_port or args.port + 1
+    # Workers only accept client-chosen session codes when started behind the router
+    worker_env = {**os.environ, "ACCEPT_ROUTER_SESSION_CODES": "true"}
+    workers, processes = [], []
+    for i in range(args.workers):
+        port = base_port + i
+        workers.append(f"http://127.0.0.1:{port}")
+        processes.append(
+            subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)],
+                env=worker_env,
+            )
+        )
+
+    print(f"Routing sessions across {len(workers)} workers on ports {base_port}-{base_port + len(workers) - 1}")
+    # Workers join the ring once they pass their first health check
+    router = ShardRouter(workers, directory=ShardDirectory())
+    try:
+        uvicorn.run(router, host=args.host, port=args.port)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,21 @@
 import json
 import asyncio
-import requests
-from typing import List, Dict
+import httpx
+from typing import AsyncIterator, List, Dict, Optional, Set, Union
 from datetime import datetime, timezone
 
-from fastapi import WebSocket, WebSocketDisconnect
+from fastapi import WebSocket
 
 from app.config import settings
+from app.connections import ConnectionWriter, EncodedMessage
+from app.llm import GeminiClient, LatencyTracker, StreamingArrayParser
+from app.llm_cache import LLMResponseCache, cache_key
+from app.repository import FirestoreRepository
+from app.question_cache import QuestionCache
+from app.session_cache import SessionCache
+from app.listeners import LISTENER_MODES, SharedQuestionListener
+from app.loop_bridge import LoopBridge
+from app.backplane import TARGET_ALL, TARGET_LECTURERS, TARGET_LISTENER, TARGET_STUDENT, Backplane
 from app.schemas import QuestionFromLLM, FirestoreQuestion
 
 
@@ -16,20 +25,59 @@ class SessionManager:
     This class is now defined here but the instance is created in dependencies.py.
     """
 
-    def __init__(self, db_client):
+    def __init__(
+        self,
+        db_client,
+        send_queue_size: int = None,
+        repository: FirestoreRepository = None,
+        question_cache: QuestionCache = None,
+        session_cache: SessionCache = None,
+        listener_mode: str = None,
+        backplane: Backplane = None,
+    ):
         self.active_sessions: Dict[str, List[WebSocket]] = {}
         self.lecturer_connections: Dict[str, List[WebSocket]] = {}  # Track lecturer connections separately
+        self.student_connections: Dict[str, Dict[str, WebSocket]] = {}  # session_id -> student_id -> socket
+        self.writers: Dict[WebSocket, ConnectionWriter] = {}  # One outbound queue + writer task per socket
+        self.send_queue_size = send_queue_size or settings.WS_SEND_QUEUE_SIZE
         self.snapshot_listeners = {}
         # The db client is now passed in via dependency injection
         self.db = db_client
+        self.repository = repository or FirestoreRepository(db_client)
+        # Questions seen by the listener are cached so answer grading needs no Firestore reads
+        self.question_cache = question_cache or QuestionCache(self.repository)
+        self.session_cache = session_cache or SessionCache(self.repository)
+        self.listener_mode = listener_mode or settings.FIRESTORE_LISTENER_MODE
+        if self.listener_mode not in LISTENER_MODES:
+            raise ValueError(f"listener_mode must be one of {LISTENER_MODES}")
+        self.shared_listener = SharedQuestionListener(self.repository, self._on_question_changes)
+        self._listener_check: Optional[asyncio.Task] = None
+        self.listener_fallbacks = 0
+        self.listener_bridge = LoopBridge(
+            self._broadcast_listener_batch,
+            max_batch=settings.LISTENER_BRIDGE_MAX_BATCH,
+            max_pending=settings.LISTENER_BRIDGE_MAX_PENDING,
+        )
+        # Relays broadcasts to sockets held by other workers; None when this process holds every socket
+        self.backplane = backplane
+        if self.backplane is not None:
+            self.backplane.start(self._on_relayed_frame)
 
     async def connect(self, session_id: str, websocket: WebSocket, client_type: str = "student"):
         """Adds a new WebSocket to an active session."""
         await websocket.accept()
         if session_id not in self.active_sessions:
             self.active_sessions[session_id] = []
+            if self.backplane is not None:
+                # First local socket for the session - receive its broadcasts from other workers
+                await self.backplane.subscribe(session_id)
         self.active_sessions[session_id].append(websocket)
 
+        # Give the socket its own outbound queue so broadcasts never wait on it
+        writer = ConnectionWriter(websocket, self.send_queue_size)
+        writer.start()
+        self.writers[websocket] = writer
+
         # Track lecturer connections separately
         if client_type == "lecturer":
             if session_id not in self.lecturer_connections:
@@ -39,13 +87,30 @@ class SessionManager:
         print(f"WebSocket connected to session {session_id} as {client_type}")
 
     def disconnect(self, session_id: str, websocket: WebSocket):
-        """Removes a WebSocket from an active session."""
-        if session_id in self.active_sessions:
+        """Removes a WebSocket from an active session. Safe to call more than once."""
+        writer = self.writers.pop(websocket, None)
+        if writer:
+            writer.stop()
+
+        if session_id in self.active_sessions and websocket in self.active_sessions[session_id]:
             self.active_sessions[session_id].remove(websocket)
             if not self.active_sessions[session_id]:
                 # If no connections left, clean up the session from memory
                 del self.active_sessions[session_id]
-                self.remove_listener(session_id)
+                if self.backplane is None:
+                    self.remove_listener(session_id)
+                elif not self.has_listener(session_id):
+                    self.backplane.unsubscribe(session_id)
+                # With a backplane the listener may be serving sockets on other workers, so it
+                # stays until the session ends (see end_listener)
+
+        # Drop the student index entry if it still points at this socket
+        students = self.student_connections.get(session_id)
+        if students:
+            for student_id in [sid for sid, ws in students.items() if ws is websocket]:
+                del students[student_id]
+            if not students:
+                del self.student_connections[session_id]
 
         # Also remove from lecturer connections if present
         if session_id in self.lecturer_connections and websocket in self.lecturer_connections[session_id]:
@@ -55,135 +120,297 @@ class SessionManager:
 
         print(f"WebSocket disconnected from session {session_id}")
 
-    async def broadcast(self, session_id: str, message: dict):
-        """Broadcasts a message to all connections in a specific session."""
-        if session_id in self.active_sessions:
-            disconnected_websockets = []
-            for connection in self.active_sessions[session_id]:
-                try:
-                    await connection.send_json(message)
-                except WebSocketDisconnect:
-                    disconnected_websockets.append(connection)
-                except Exception as e:
-                    print(f"An unexpected error occurred during broadcast: {e}")
-            for ws in disconnected_websockets:
-                # Remove disconnected websockets
-                if ws in self.active_sessions[session_id]:
-                    self.active_sessions[session_id].remove(ws)
-
-    async def broadcast_to_lecturers(self, session_id: str, message: dict):
-        """Broadcasts a message only to lecturer connections in a specific session."""
-        if session_id in self.lecturer_connections:
-            disconnected_websockets = []
-            for connection in self.lecturer_connections[session_id]:
-                try:
-                    await connection.send_json(message)
-                except WebSocketDisconnect:
-                    disconnected_websockets.append(connection)
-                except Exception as e:
-                    print(f"An unexpected error occurred during lecturer broadcast: {e}")
-            for ws in disconnected_websockets:
-                # Remove disconnected websockets
-                if ws in self.lecturer_connections[session_id]:
-                    self.lecturer_connections[session_id].remove(ws)
+    def register_student(self, session_id: str, student_id: str, websocket: WebSocket):
+        """Indexes a student's socket so messages can be sent to them directly."""
+        self.student_connections.setdefault(session_id, {})[student_id] = websocket
+
+    async def send_to_student(self, session_id: str, student_id: str, message: dict) -> Optional[bool]:
+        """
+        Sends a message to one student's socket. Returns True if it was queued on a socket held here,
+        None if it was relayed through the backplane (unconfirmed: no worker may hold the student),
+        and False if the student is not connected here and there is no backplane.
+        """
+        websocket = self.student_connections.get(session_id, {}).get(student_id)
+        if websocket is None:
+            if self.backplane is None:
+                return False
+            frame = EncodedMessage.ensure(message)
+            await self.backplane.publish(session_id, frame.text, TARGET_STUDENT, student_id)
+            return None
+        await self.send_personal_message(websocket, message)
+        return True
+
+    async def send_personal_message(self, websocket: WebSocket, message: dict):
+        """Queues a message for a single connection, preserving order with broadcasts."""
+        frame = EncodedMessage.ensure(message)
+        writer = self.writers.get(websocket)
+        if writer is None:
+            await websocket.send_text(frame.text)
+        elif not writer.enqueue(frame):
+            print("Dropping personal message for stalled WebSocket")
+
+    async def broadcast(self, session_id: str, message: Union[dict, EncodedMessage]):
+        """Broadcasts a message to all connections in a specific session, on every worker."""
+        frame = EncodedMessage.ensure(message)
+        self._fan_out(session_id, self.active_sessions.get(session_id, []), frame)
+        if self.backplane is not None:
+            await self.backplane.publish(session_id, frame.text, TARGET_ALL)
+
+    async def broadcast_to_lecturers(self, session_id: str, message: Union[dict, EncodedMessage]):
+        """Broadcasts a message only to lecturer connections in a specific session, on every worker."""
+        frame = EncodedMessage.ensure(message)
+        self._fan_out(session_id, self.lecturer_connections.get(session_id, []), frame)
+        if self.backplane is not None:
+            await self.backplane.publish(session_id, frame.text, TARGET_LECTURERS)
+
+    async def _on_relayed_frame(self, session_id: str, target: str, student_id: Optional[str], frame_text: str):
+        """Fans out a frame published by another worker to this worker's sockets in the session."""
+        if target == TARGET_LISTENER:
+            self.remove_listener(session_id)
+            return
+        frame = EncodedMessage.from_text(frame_text)
+        if target == TARGET_ALL:
+            self._fan_out(session_id, self.active_sessions.get(session_id, []), frame)
+        elif target == TARGET_LECTURERS:
+            self._fan_out(session_id, self.lecturer_connections.get(session_id, []), frame)
+        elif target == TARGET_STUDENT:
+            websocket = self.student_connections.get(session_id, {}).get(student_id)
+            if websocket is not None:
+                await self.send_personal_message(websocket, frame)
+
+    def _fan_out(self, session_id: str, connections: List[WebSocket], message: Union[dict, EncodedMessage]):
+        """
+        Serializes the message once and enqueues the same frame on each connection's writer,
+        dropping sockets that are closed or stalled.
+        """
+        if not connections:
+            return
+        frame = EncodedMessage.ensure(message)
+        stalled_websockets = []
+        for connection in connections:
+            writer = self.writers.get(connection)
+            if writer is None or not writer.enqueue(frame):
+                stalled_websockets.append(connection)
+        for ws in stalled_websockets:
+            print(f"Dropping stalled WebSocket from session {session_id}")
+            self.disconnect(session_id, ws)
+            asyncio.create_task(self._close_quietly(ws))
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket):
+        """Closes a dropped socket so its receive loop exits; ignores errors from dead sockets."""
+        try:
+            await websocket.close(code=1013, reason="Client too slow")
+        except Exception:
+            pass
+
+    def has_listener(self, session_id: str) -> bool:
+        if self.listener_mode == "shared":
+            return self.shared_listener.is_registered(session_id)
+        return session_id in self.snapshot_listeners
 
     def start_listener(self, session_id: str):
-        """Sets up a real-time Firestore listener for a session's questions."""
+        """Starts routing real-time Firestore question changes for a session to its sockets."""
+        # Listener callbacks run on Firestore threads; their broadcasts are handed to this loop
+        self.listener_bridge.bind()
         # Check if a listener is already running for this session
-        if session_id in self.snapshot_listeners:
+        if self.has_listener(session_id):
+            return
+        if self.backplane is not None:
+            # Stay subscribed while holding the listener, to hear when the session ends elsewhere
+            self.backplane.subscribe_soon(session_id)
+        if self.listener_mode == "shared":
+            # One collection-group watch serves every session; just route this one's changes
+            try:
+                self.shared_listener.register(session_id)
+            except Exception as e:
+                print(f"Error starting shared question listener: {e}")
+                self.fall_back_to_session_listeners()
+                return
+            if self._listener_check is None:
+                self._listener_check = asyncio.get_running_loop().create_task(self._check_shared_listener())
             return
 
-        # Reference to the questions sub-collection for the given session
-        questions_ref = self.db.collection("sessions").document(session_id).collection("questions")
-
-        # Helper function to convert Firestore datetime objects to ISO strings
-        def serialize_firestore_data(data):
-            """Convert Firestore datetime objects to ISO format strings"""
-            if isinstance(data, dict):
-                return {k: serialize_firestore_data(v) for k, v in data.items()}
-            elif isinstance(data, list):
-                return [serialize_firestore_data(item) for item in data]
-            elif hasattr(data, "isoformat"):  # datetime objects
-                return data.isoformat()
-            else:
-                return data
+        # A watch's first snapshot lists every existing question as ADDED. Those were broadcast when
+        # they were written, so only changes after it are sent (a re-attached watch would replay them all)
+        initial_snapshot = [True]
 
         # The on_snapshot function will be called on every change
         def on_snapshot(col_snapshot, changes, read_time):
-            print(f"Snapshot received for session {session_id}")
-            for change in changes:
-                if change.type.name == "ADDED":
-                    new_question_data = change.document.to_dict()
-
-                    # Convert datetime objects to ISO strings
-                    serialized_question = serialize_firestore_data(new_question_data)
-
-                    # Get session configuration for answer time limit
-                    session_ref = self.db.collection("sessions").document(session_id)
-                    session_doc = session_ref.get()
-                    answer_time = 30  # default
-                    if session_doc.exists:
-                        session_data = session_doc.to_dict()
-                        answer_time = session_data.get("answerTimeSeconds", 30)
-
-                    # Broadcast the new question with timing info
-                    print(f"📤 Broadcasting question {serialized_question.get('id')} to students")
-                    # Get the running event loop and schedule the broadcast task
-                    try:
-                        loop = asyncio.get_running_loop()
-                        loop.create_task(
-                            self.broadcast(
-                                session_id,
-                                {
-                                    "type": "new_question",
-                                    "question": serialized_question,
-                                    "answerTimeSeconds": answer_time,
-                                    "questionStartTime": datetime.now(timezone.utc).isoformat(),
-                                },
-                            )
-                        )
-                        print(f"✅ Question broadcast scheduled")
-                    except RuntimeError:
-                        # No event loop running, use asyncio.run as fallback
-                        asyncio.run(
-                            self.broadcast(
-                                session_id,
-                                {
-                                    "type": "new_question",
-                                    "question": serialized_question,
-                                    "answerTimeSeconds": answer_time,
-                                    "questionStartTime": datetime.now(timezone.utc).isoformat(),
-                                },
-                            )
-                        )
-                        print(f"✅ Question broadcast complete")
+            if initial_snapshot[0]:
+                initial_snapshot[0] = False
+                return
+            self._on_question_changes(session_id, changes)
 
         # Start the listener and store the callback in a dictionary to manage it later
         print(f"Starting Firestore listener for session {session_id}")
-        self.snapshot_listeners[session_id] = questions_ref.on_snapshot(on_snapshot)
+        self.snapshot_listeners[session_id] = self.repository.watch_questions(session_id, on_snapshot)
+
+    async def _check_shared_listener(self):
+        while self.listener_mode == "shared":
+            await asyncio.sleep(settings.LISTENER_HEALTH_CHECK_SECONDS)
+            self.check_listeners()
+
+    def check_listeners(self):
+        """Moves every session to its own watch if the shared watch has stopped."""
+        if self.listener_mode == "shared" and not self.shared_listener.healthy():
+            print("Shared question listener stopped")
+            self.fall_back_to_session_listeners()
+
+    def fall_back_to_session_listeners(self):
+        """Switches to one watch per session, re-attaching the sessions routed through the shared watch."""
+        sessions = self.shared_listener.sessions()
+        self.shared_listener.close()
+        self.listener_mode = "per_session"
+        self.listener_fallbacks += 1
+        print(f"Falling back to per-session question listeners for {len(sessions)} sessions")
+        for session_id in sessions:
+            self.shared_listener.unregister(session_id)
+            self.start_listener(session_id)
+
+    def _on_question_changes(self, session_id: str, changes):
+        """Broadcasts questions added to a session. Called on a Firestore listener thread."""
+        print(f"Snapshot received for session {session_id}")
+        for change in changes:
+            if change.type.name == "ADDED":
+                new_question_data = change.document.to_dict()
+                self.question_cache.put(session_id, change.document.id, new_question_data)
+
+                # Convert datetime objects to ISO strings
+                serialized_question = serialize_firestore_data(new_question_data)
+
+                # Get session configuration for answer time limit; read Firestore (already on a
+                # listener thread) only if the session is not cached
+                session_data = self.session_cache.get_cached(session_id)
+                if session_data is None:
+                    session_data = self.repository.get_session_sync(session_id)
+                    if session_data is not None:
+                        self.session_cache.put(session_id, session_data)
+                answer_time = 30  # default
+                if session_data is not None:
+                    answer_time = session_data.get("answerTimeSeconds", 30)
+
+                # Hand the broadcast to the event loop that owns the sockets
+                print(f"📤 Broadcasting question {serialized_question.get('id')} to students")
+                self.listener_bridge.submit(
+                    (
+                        session_id,
+                        {
+                            "type": "new_question",
+                            "question": serialized_question,
+                            "answerTimeSeconds": answer_time,
+                            "questionStartTime": datetime.now(timezone.utc).isoformat(),
+                        },
+                    )
+                )
+
+    async def _broadcast_listener_batch(self, batch: List[tuple]):
+        """Runs on the event loop: sends (session_id, message) pairs queued by listener threads, in order."""
+        for session_id, message in batch:
+            await self.broadcast(session_id, message)
 
     def remove_listener(self, session_id: str):
-        """Detaches the Firestore listener for a session."""
+        """Stops routing question changes for a session, detaching its own listener in per-session mode."""
+        self.shared_listener.unregister(session_id)
         if session_id in self.snapshot_listeners:
             self.snapshot_listeners[session_id].unsubscribe()
             del self.snapshot_listeners[session_id]
             print(f"Firestore listener for session {session_id} detached.")
-
-
-async def generate_three_questions_with_llm(transcript: str) -> List[FirestoreQuestion]:
+        if self.backplane is not None and session_id not in self.active_sessions:
+            self.backplane.unsubscribe(session_id)
+
+    async def end_listener(self, session_id: str):
+        """Detaches the session's question listener when it ends, on whichever worker holds it."""
+        self.remove_listener(session_id)
+        if self.backplane is not None:
+            await self.backplane.publish(session_id, "", TARGET_LISTENER)
+
+    def metrics(self) -> dict:
+        return {
+            "sessions": len(self.active_sessions),
+            "websockets": len(self.writers),
+            "listener_mode": self.listener_mode,
+            "listener_fallbacks": self.listener_fallbacks,
+            "session_listeners": len(self.snapshot_listeners),
+            "shared_listener": self.shared_listener.metrics(),
+            "listener_bridge": self.listener_bridge.metrics(),
+            "backplane": self.backplane.metrics() if self.backplane is not None else None,
+        }
+
+    async def close_listeners(self):
+        """Detaches every Firestore listener and delivers broadcasts they already queued (on shutdown)."""
+        if self._listener_check is not None:
+            self._listener_check.cancel()
+            await asyncio.gather(self._listener_check, return_exceptions=True)
+            self._listener_check = None
+        self.shared_listener.close()
+        for session_id in list(self.snapshot_listeners):
+            self.remove_listener(session_id)
+        await self.listener_bridge.close()
+        if self.backplane is not None:
+            await self.backplane.close()
+
+
+def serialize_firestore_data(data):
+    """Convert Firestore datetime objects to ISO format strings"""
+    if isinstance(data, dict):
+        return {k: serialize_firestore_data(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [serialize_firestore_data(item) for item in data]
+    elif hasattr(data, "isoformat"):  # datetime objects
+        return data.isoformat()
+    else:
+        return data
+
+
+# Bump whenever the prompt or response schema changes so cached questions are not reused
+PROMPT_VERSION = "questions-v1"
+
+# Latencies of single-question requests, used to decide when to hedge in parallel mode
+single_question_latency = LatencyTracker()
+
+
+async def generate_three_questions_with_llm(
+    transcript: str, client: GeminiClient, cache: Optional[LLMResponseCache] = None, context: str = ""
+) -> List[FirestoreQuestion]:
     """
     Uses the Gemini API to generate 3 multiple-choice questions from a transcript.
     Returns a list of 3 FirestoreQuestion objects for lecturer selection.
+    `context` is earlier lecture transcript given as background only; questions target `transcript`,
+    so the cache is keyed on the transcript alone and identical chunks never call Gemini.
     """
-    api_key = settings.GEMINI_API_KEY
-    if not api_key:
-        print("GEMINI_API_KEY not found in settings.")
-        return []
+    key = None
+    if cache is not None:
+        key = cache_key(transcript, client.model, PROMPT_VERSION)
+        cached_questions = await cache.get(key)
+        if cached_questions:
+            print("Serving question options from LLM cache")
+            return cached_questions
 
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={api_key}"
+    questions = await _request_three_questions(transcript, client, context)
+    if cache is not None and questions:
+        await cache.put(key, questions)
+    return questions
 
-    prompt = f"""Based on the following lecture transcript, generate exactly 3 different multiple-choice questions.
-    Each question should be distinct and cover different aspects of the transcript content.
+
+def build_question_payload(transcript: str, count: int = 3, variant: Optional[int] = None, context: str = "") -> dict:
+    """
+    Builds the generateContent request body asking for `count` questions about the transcript.
+    `variant` steers single-question requests sent in parallel towards different key points.
+    `context` (earlier lecture transcript, already fitted to the token budget) is added as background.
+    """
+    if count == 1:
+        task = "generate exactly 1 multiple-choice question."
+        if variant is not None:
+            task += (
+                f"\n    Base it on key point number {variant + 1} of the transcript,"
+                " so it differs from questions about other key points."
+            )
+    else:
+        task = f"""generate exactly {count} different multiple-choice questions.
+    Each question should be distinct and cover different aspects of the transcript content."""
+
+    prompt = f"""Based on the following lecture transcript, {task}
     For each question, provide four distinct answer options, clearly indicate the correct answer, and include a simple, clear explanation of why it is correct. Make the explanation easy to understand and, when possible, add context or insight that goes beyond the transcript.
     Ensure all questions are directly relevant to the transcript content.
 
@@ -191,7 +418,13 @@ async def generate_three_questions_with_llm(transcript: str) -> List[FirestoreQu
     {transcript}
     """
 
-    # Define the desired JSON schema for 3 questions
+    if context:
+        prompt += f"""
+    Earlier in the lecture (background only - do not ask about it unless the transcript above builds on it):
+    {context}
+    """
+
+    # Define the desired JSON schema for the questions
     response_schema = {
         "type": "OBJECT",
         "properties": {
@@ -214,37 +447,50 @@ async def generate_three_questions_with_llm(transcript: str) -> List[FirestoreQu
         "contents": [{"parts": [{"text": prompt}]}],
         "generationConfig": {"responseMimeType": "application/json", "responseSchema": response_schema},
     }
+    return payload
+
 
+def _parse_llm_question(q_data: dict) -> Optional[FirestoreQuestion]:
+    """Validates one question from the LLM response; returns None if it is malformed."""
     try:
-        response = requests.post(api_url, json=payload, headers={"Content-Type": "application/json"})
-        response.raise_for_status()
+        llm_question = QuestionFromLLM(**q_data)
+        return FirestoreQuestion(
+            questionText=llm_question.question_text,
+            options=llm_question.options,
+            correctAnswer=llm_question.correct_answer,
+            explanation=llm_question.explanation,
+            generatedBy="AI",
+        )
+    except Exception as e:
+        print(f"Error parsing individual question: {e}")
+        return None
 
-        result = response.json()
+
+async def _request_three_questions(transcript: str, client: GeminiClient, context: str = "") -> List[FirestoreQuestion]:
+    """Calls Gemini once for 3 questions. The shared client awaits the HTTP call, so other sessions keep running."""
+    if not client.api_key:
+        print("GEMINI_API_KEY not found in settings.")
+        return []
+
+    payload = build_question_payload(transcript, context=context)
+
+    try:
+        result = await client.generate_content(payload)
         if result.get("candidates"):
             json_text = result["candidates"][0]["content"]["parts"][0]["text"]
             parsed_json = json.loads(json_text)
 
             questions = []
             for q_data in parsed_json.get("questions", [])[:3]:  # Ensure max 3 questions
-                try:
-                    llm_question = QuestionFromLLM(**q_data)
-                    firestore_question = FirestoreQuestion(
-                        questionText=llm_question.question_text,
-                        options=llm_question.options,
-                        correctAnswer=llm_question.correct_answer,
-                        explanation=llm_question.explanation,
-                        generatedBy="AI",
-                    )
+                firestore_question = _parse_llm_question(q_data)
+                if firestore_question is not None:
                     questions.append(firestore_question)
-                except Exception as e:
-                    print(f"Error parsing individual question: {e}")
-                    continue
 
             return questions
         else:
             print("LLM response did not contain candidates.")
             return []
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Error calling Gemini API: {e}")
         return []
     except json.JSONDecodeError as e:
@@ -253,3 +499,222 @@ async def generate_three_questions_with_llm(transcript: str) -> List[FirestoreQu
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         return []
+
+
+async def stream_questions_with_llm(
+    transcript: str, client: GeminiClient, cache: Optional[LLMResponseCache] = None, context: str = ""
+) -> AsyncIterator[FirestoreQuestion]:
+    """
+    Streaming variant of generate_three_questions_with_llm.
+    Yields each question as soon as it has been fully streamed and validated, so the first
+    one can be shown (or auto-released) before Gemini has finished the other two.
+    Close the iterator early (e.g. with contextlib.aclosing) once enough questions have arrived;
+    with a cache, the rest of the stream is then read in the background so the full set is cached.
+    """
+    key = None
+    if cache is not None:
+        key = cache_key(transcript, client.model, PROMPT_VERSION)
+        cached_questions = await cache.get(key)
+        if cached_questions:
+            print("Serving question options from LLM cache")
+            for question in cached_questions:
+                yield question
+            return
+
+    if not client.api_key:
+        print("GEMINI_API_KEY not found in settings.")
+        return
+
+    parser = StreamingArrayParser()
+    questions = []  # Parsed so far; the first `yielded` have been handed to the caller
+    yielded = 0
+    fragments = client.stream_generate_content(build_question_payload(transcript, context=context))
+    handed_off = False
+    try:
+        async for fragment in fragments:
+            questions.extend(_parse_streamed_questions(parser, fragment))
+            while yielded < min(len(questions), 3):
+                yielded += 1
+                yield questions[yielded - 1]
+            if len(questions) >= 3:
+                break
+    except GeneratorExit:
+        # The caller stopped early (e.g. passive mode needs one question); finish the stream in the
+        # background so the complete set still reaches the cache
+        if cache is not None:
+            if len(questions) >= 3:
+                await cache.put(key, questions[:3])
+            else:
+                _spawn_background(_finish_stream_into_cache(fragments, parser, questions, cache, key))
+                handed_off = True
+        raise
+    except httpx.HTTPError as e:
+        print(f"Error streaming from Gemini API: {e}")
+    except json.JSONDecodeError as e:
+        print(f"Error decoding streamed LLM response: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred while streaming: {e}")
+    finally:
+        if not handed_off:
+            await fragments.aclose()
+
+    if cache is not None and len(questions) >= 3:
+        await cache.put(key, questions[:3])
+
+
+# Strong references to fire-and-forget tasks, so they are not garbage collected mid-run
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def _spawn_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def _parse_streamed_questions(parser: StreamingArrayParser, fragment: str) -> List[FirestoreQuestion]:
+    parsed = (_parse_llm_question(q_data) for q_data in parser.feed(fragment))
+    return [question for question in parsed if question is not None]
+
+
+async def _finish_stream_into_cache(
+    fragments: AsyncIterator[str],
+    parser: StreamingArrayParser,
+    questions: List[FirestoreQuestion],
+    cache: LLMResponseCache,
+    key: str,
+):
+    """Reads the rest of a stream its caller abandoned and caches the questions if a full set arrives."""
+    try:
+        async for fragment in fragments:
+            questions.extend(_parse_streamed_questions(parser, fragment))
+            if len(questions) >= 3:
+                break
+    except Exception as e:
+        print(f"Error finishing question stream for the cache: {e}")
+    finally:
+        await fragments.aclose()
+
+    if len(questions) >= 3:
+        await cache.put(key, questions[:3])
+
+
+async def _request_single_question(
+    transcript: str, client: GeminiClient, variant: int, context: str = ""
+) -> Optional[FirestoreQuestion]:
+    """Asks Gemini for one question; returns None if the call fails or the item is malformed."""
+    try:
+        result = await client.generate_content(
+            build_question_payload(transcript, count=1, variant=variant, context=context)
+        )
+        json_text = result["candidates"][0]["content"]["parts"][0]["text"]
+        items = json.loads(json_text).get("questions", [])
+        return _parse_llm_question(items[0]) if items else None
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"Single-question request {variant} failed: {e}")
+        return None
+
+
+async def parallel_questions_with_llm(
+    transcript: str,
+    client: GeminiClient,
+    count: int = 3,
+    cache: Optional[LLMResponseCache] = None,
+    latency: Optional[LatencyTracker] = None,
+    hedge_percentile: float = 0.9,
+    min_hedge_delay_ms: float = 1500,
+    max_attempts: int = 2,
+    context: str = "",
+) -> AsyncIterator[FirestoreQuestion]:
+    """
+    Generates questions with `count` independent single-question requests sent concurrently,
+    yielding each valid question as soon as it arrives. A request still running after the
+    `hedge_percentile` latency gets a duplicate (hedged) request; whichever answers first wins.
+    A failed or malformed item only costs its own request and is retried up to `max_attempts`.
+    Remaining requests are cancelled once `count` questions have been produced.
+    """
+    key = None
+    if cache is not None:
+        key = cache_key(transcript, client.model, PROMPT_VERSION, count)
+        cached_questions = await cache.get(key)
+        if cached_questions:
+            print("Serving question options from LLM cache")
+            for question in cached_questions:
+                yield question
+            return
+
+    if not client.api_key:
+        print("GEMINI_API_KEY not found in settings.")
+        return
+
+    latency = latency if latency is not None else single_question_latency
+    loop = asyncio.get_running_loop()
+    tasks: Dict[asyncio.Task, tuple] = {}  # task -> (variant, started_at)
+    attempts = {variant: 0 for variant in range(count)}
+    hedged = set()
+    fulfilled = set()
+    questions = []
+
+    def launch(variant: int):
+        attempts[variant] += 1
+        task = asyncio.create_task(_request_single_question(transcript, client, variant, context))
+        tasks[task] = (variant, loop.time())
+
+    def hedge_delay() -> float:
+        observed = latency.percentile(hedge_percentile)
+        return max(min_hedge_delay_ms, observed or 0) / 1000
+
+    try:
+        for variant in range(count):
+            launch(variant)
+
+        while tasks and len(questions) < count:
+            # Wake up when a request finishes or when the oldest unhedged request becomes due for a hedge
+            now = loop.time()
+            due = [
+                started + hedge_delay() - now
+                for variant, started in tasks.values()
+                if variant not in hedged and variant not in fulfilled and attempts[variant] < max_attempts
+            ]
+            timeout = max(0.0, min(due)) if due else None
+            done, _ = await asyncio.wait(tasks.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                variant, started = tasks.pop(task)
+                question = task.result()
+                if question is not None:
+                    latency.record((loop.time() - started) * 1000)
+                if variant in fulfilled:
+                    continue
+                if question is not None:
+                    fulfilled.add(variant)
+                    questions.append(question)
+                    yield question
+                    # Cancel the hedge twin for this variant, if any
+                    for other, (other_variant, _) in list(tasks.items()):
+                        if other_variant == variant:
+                            other.cancel()
+                            tasks.pop(other)
+                elif attempts[variant] < max_attempts and not any(v == variant for v, _ in tasks.values()):
+                    launch(variant)
+
+            # Hedge requests that have run longer than the latency percentile
+            now = loop.time()
+            for variant, started in list(tasks.values()):
+                if (
+                    variant not in hedged
+                    and variant not in fulfilled
+                    and now - started >= hedge_delay()
+                    and attempts[variant] < max_attempts
+                ):
+                    hedged.add(variant)
+                    launch(variant)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if cache is not None and len(questions) == count:
+        await cache.put(key, questions)
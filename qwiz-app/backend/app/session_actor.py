@@ -0,0 +1,291 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Union
+
+from app.ttl_store import SessionTTLStore
+
+# Events a live session's actor consumes, in arrival order
+
+
+@dataclass(slots=True)
+class StudentJoined:
+    student_id: str
+    student_name: Optional[str] = None
+
+
+@dataclass(slots=True)
+class StudentLeft:
+    student_id: str
+
+
+@dataclass(slots=True)
+class AnswerSubmitted:
+    student_id: str
+    question_id: str
+    selected_option: str
+    correct_answer: str
+    response_time_ms: Optional[int] = None
+    question_text: Optional[str] = None
+
+
+@dataclass(slots=True)
+class TranscriptChunk:
+    chunk: str
+
+
+@dataclass(slots=True)
+class EndSession:
+    result: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+SessionEvent = Union[StudentJoined, StudentLeft, AnswerSubmitted, TranscriptChunk, EndSession]
+
+# Queued by SessionActors.close: the actor applies everything queued before it, then exits
+_STOP = object()
+
+
+class SessionActor:
+    """
+    Single task that owns all analytics mutation for one live session.
+    Handlers only enqueue events; the actor drains whatever has queued up (up to `max_batch`)
+    and applies it in order, so nothing interleaves with `end_session`. Per drain cycle it
+    applies stats once, sends join/leave notices, schedules one analytics/leaderboard update
+    and hands all transcript chunks to generation together.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        analytics_service,
+        session_manager,
+        on_transcript: Optional[Callable[[str, List[str]], None]] = None,
+        on_exit: Optional[Callable[["SessionActor"], None]] = None,
+        max_pending: int = 1000,
+        max_batch: int = 256,
+        idle_seconds: float = 3600,
+    ):
+        self.session_id = session_id
+        self.analytics = analytics_service
+        self.session_manager = session_manager
+        self.on_transcript = on_transcript
+        self.on_exit = on_exit
+        self.max_batch = max_batch
+        self.idle_seconds = idle_seconds
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.closed = False
+        self.task = asyncio.get_running_loop().create_task(self._run())
+        # Metrics
+        self.events = 0
+        self.batches = 0
+        self.errors = 0
+        self.dropped = 0
+
+    async def send(self, event: SessionEvent):
+        await self.queue.put(event)
+
+    async def stop(self):
+        """Lets the actor apply what is already queued, then waits for it to exit."""
+        if not self.task.done():
+            await self.queue.put(_STOP)
+        await asyncio.gather(self.task, return_exceptions=True)
+
+    def _drain(self, first: SessionEvent) -> List[SessionEvent]:
+        batch = [first]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _run(self):
+        try:
+            while True:
+                try:
+                    first = await asyncio.wait_for(self.queue.get(), self.idle_seconds)
+                except asyncio.TimeoutError:
+                    if self.queue.empty():
+                        return  # Idle session (e.g. never ended); a new actor starts on its next event
+                    continue
+                if await self._process(self._drain(first)):
+                    return
+        finally:
+            self.closed = True
+            self._drop_remaining()
+            if self.on_exit is not None:
+                self.on_exit(self)
+
+    def _drop_remaining(self):
+        while True:
+            try:
+                event = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            self.dropped += 1
+            if isinstance(event, EndSession) and not event.result.done():
+                event.result.set_result({"session_id": self.session_id, "total_students": 0})
+
+    async def _process(self, batch: List[SessionEvent]) -> bool:
+        """Applies one drain cycle; returns True once the session has ended or the actor is stopped."""
+        session_id = self.session_id
+        self.batches += 1
+        stats: Dict[str, int] = {}
+        notices: List[dict] = []
+        chunks: List[str] = []
+        answered = False
+        end: Optional[EndSession] = None
+        stop = False
+
+        for index, event in enumerate(batch):
+            if event is _STOP:
+                stop = True
+                self.dropped += len(batch) - index - 1
+                break
+            self.events += 1
+            try:
+                if isinstance(event, StudentJoined):
+                    await self.analytics.record_student_join(session_id, event.student_id, event.student_name)
+                    notices.append(
+                        {"type": "student_joined", "student_id": event.student_id, "student_name": event.student_name}
+                    )
+                elif isinstance(event, StudentLeft):
+                    await self.analytics.record_student_leave(session_id, event.student_id)
+                    notices.append({"type": "student_left", "student_id": event.student_id})
+                elif isinstance(event, AnswerSubmitted):
+                    deltas = await self.analytics.record_answer(
+                        session_id,
+                        event.student_id,
+                        event.question_id,
+                        event.selected_option,
+                        event.correct_answer,
+                        event.response_time_ms,
+                        event.question_text,
+                    )
+                    for name, value in deltas.items():
+                        stats[name] = stats.get(name, 0) + value
+                    answered = True
+                elif isinstance(event, TranscriptChunk):
+                    chunks.append(event.chunk)
+                elif isinstance(event, EndSession):
+                    end = event
+                    # Anything queued behind the end belongs to a session that no longer exists
+                    self.dropped += len(batch) - index - 1
+                    break
+            except Exception as e:
+                self.errors += 1
+                print(f"Error applying {type(event).__name__} for session {session_id}: {e}")
+
+        try:
+            if stats:
+                await self.analytics.state.increment_stats(session_id, **stats)
+            for notice in notices:
+                await self.session_manager.broadcast(session_id, notice)
+            if notices or answered:
+                await self.analytics.schedule_updates(session_id, leaderboard=answered)
+            if chunks and self.on_transcript is not None:
+                self.on_transcript(session_id, chunks)
+        except Exception as e:
+            self.errors += 1
+            print(f"Error finishing event batch for session {session_id}: {e}")
+
+        if end is None:
+            return stop
+        try:
+            end.result.set_result(await self.analytics.end_session(session_id))
+        except Exception as e:
+            end.result.set_exception(e)
+            # Mark retrieved so an unawaited future does not log "exception was never retrieved"
+            end.result.exception()
+        return True
+
+
+class SessionActors:
+    """
+    Registry of per-session actors: starts one on a session's first event and forgets it when it exits.
+    Ended sessions are remembered for `ended_ttl_seconds`; events that arrive for them afterwards
+    (e.g. a student leaving once the lecture has closed) are dropped instead of starting a new actor.
+    """
+
+    def __init__(
+        self,
+        analytics_service,
+        session_manager,
+        on_transcript: Optional[Callable[[str, List[str]], None]] = None,
+        max_pending: int = 1000,
+        max_batch: int = 256,
+        idle_seconds: float = 3600,
+        ended_ttl_seconds: float = 6 * 3600,
+        max_ended: int = 10_000,
+    ):
+        self.analytics = analytics_service
+        self.session_manager = session_manager
+        self.on_transcript = on_transcript
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.idle_seconds = idle_seconds
+        self._actors: Dict[str, SessionActor] = {}
+        # session_id -> the EndSession result, so a repeated end returns the first one's result
+        self._ended = SessionTTLStore(ttl_seconds=ended_ttl_seconds, max_entries=max_ended)
+        # Metrics of actors that have exited
+        self._finished = {"events": 0, "batches": 0, "errors": 0, "dropped": 0}
+        self.dropped_after_end = 0
+
+    def actor(self, session_id: str) -> SessionActor:
+        actor = self._actors.get(session_id)
+        if actor is None or actor.closed:
+            actor = SessionActor(
+                session_id,
+                self.analytics,
+                self.session_manager,
+                on_transcript=self.on_transcript,
+                on_exit=self._forget,
+                max_pending=self.max_pending,
+                max_batch=self.max_batch,
+                idle_seconds=self.idle_seconds,
+            )
+            self._actors[session_id] = actor
+        return actor
+
+    def _forget(self, actor: SessionActor):
+        if self._actors.get(actor.session_id) is actor:
+            del self._actors[actor.session_id]
+        for name in self._finished:
+            self._finished[name] += getattr(actor, name)
+
+    def ended(self, session_id: str) -> bool:
+        return session_id in self._ended
+
+    async def send(self, session_id: str, event: SessionEvent):
+        """Queues an event for the session's actor (waiting for room if its queue is full)."""
+        if self.ended(session_id):
+            self.dropped_after_end += 1
+            return
+        await self.actor(session_id).send(event)
+
+    async def end(self, session_id: str) -> dict:
+        """Ends the session after everything queued before it, and returns end_session's result."""
+        result = self._ended.get(session_id)
+        if result is None:
+            event = EndSession()
+            result = event.result
+            # Marked before queueing, so nothing sent from here on starts another actor for the session
+            self._ended.put(session_id, session_id, result)
+            await self.actor(session_id).send(event)
+        return await asyncio.shield(result)
+
+    async def close(self):
+        """Lets every actor apply what it has queued, then stops it (on shutdown)."""
+        await asyncio.gather(*(actor.stop() for actor in list(self._actors.values())))
+
+    def metrics(self) -> dict:
+        totals = dict(self._finished)
+        for actor in self._actors.values():
+            for name in totals:
+                totals[name] += getattr(actor, name)
+        return {
+            "actors": len(self._actors),
+            "queued": sum(actor.queue.qsize() for actor in self._actors.values()),
+            "ended_sessions": len(self._ended),
+            "dropped_after_end": self.dropped_after_end,
+            **totals,
+        }
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+from typing import Dict, Optional
+
+from app.ttl_store import SessionTTLStore
+
+
+class SessionCache:
+    """
+    Cache of session documents (configuration and status), so per-event handlers do not re-read Firestore.
+    Entries are filled when a session is created and updated on this backend's own writes to the
+    document; `ttl_seconds` bounds staleness for writes made elsewhere. No per-session watch stream is
+    held open. Unknown session codes are negatively cached for `negative_ttl_seconds`, so repeated bogus
+    connections cost one read. Question listener callbacks read the cache on Firestore threads, so the
+    stores are locked.
+    """
+
+    def __init__(
+        self, repository, ttl_seconds: float = 300, negative_ttl_seconds: float = 30, max_entries: int = 10000
+    ):
+        self.repository = repository
+        self._sessions = SessionTTLStore(ttl_seconds=ttl_seconds, max_entries=max_entries)
+        self._missing = SessionTTLStore(ttl_seconds=negative_ttl_seconds, max_entries=max_entries)
+        self._lock = threading.Lock()
+        self._loading: Dict[str, asyncio.Future] = {}
+        # Metrics
+        self.reads = 0
+
+    def put(self, session_id: str, session_data: dict):
+        with self._lock:
+            self._missing.pop(session_id)
+            self._sessions.put(session_id, session_id, dict(session_data))
+
+    def update(self, session_id: str, changes: dict):
+        """Applies fields just written to Firestore; a session that is not cached is left to the next read."""
+        with self._lock:
+            session_data = self._sessions.get(session_id)
+            if session_data is not None:
+                self._sessions.put(session_id, session_id, {**session_data, **changes})
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id)
+            self._missing.pop(session_id)
+
+    def get_cached(self, session_id: str) -> Optional[dict]:
+        """Cache-only lookup, safe to call from listener threads."""
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        """Returns the session document data, or None if the session does not exist."""
+        with self._lock:
+            session_data = self._sessions.get(session_id)
+            if session_data is not None:
+                return session_data
+            if self._missing.get(session_id) is not None:
+                return None
+
+        loading = self._loading.get(session_id)
+        if loading is not None:
+            return await asyncio.shield(loading)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[session_id] = future
+        try:
+            self.reads += 1
+            session_data = await self.repository.get_session(session_id)
+            if session_data is not None:
+                self.put(session_id, session_data)
+            else:
+                with self._lock:
+                    self._missing.put(session_id, session_id, True)
+            future.set_result(session_data)
+            return session_data
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited future does not log "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self._loading[session_id]
+
+    async def exists(self, session_id: str) -> bool:
+        return await self.get(session_id) is not None
+
+    def metrics(self) -> dict:
+        with self._lock:
+            sessions = self._sessions.metrics()
+            missing = self._missing.metrics()
+        return {
+            "entries": sessions["entries"],
+            "negative_entries": missing["entries"],
+            "hits": sessions["hits"],
+            "negative_hits": missing["hits"],
+            "firestore_reads": self.reads,
+        }
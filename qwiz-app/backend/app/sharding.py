@@ -0,0 +1,142 @@
+import bisect
+import hashlib
+import random
+import re
+import string
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+SESSION_CODE_RE = re.compile(r"^[A-Z0-9]{6}$")
+
+
+def new_session_code() -> str:
+    """A short 6-character session code (alphanumeric, uppercase), as issued by /start-session."""
+    return "".join(random.choices(string.ascii_uppercase + string.digits, k=6))
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent-hash ring mapping session codes to worker names.
+    Each worker owns `vnodes` points on the ring, so load spreads evenly and adding or
+    removing a worker only moves the keys between it and its ring neighbours (~1/N of them).
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 160):
+        self.vnodes = vnodes
+        self._points: List[Tuple[int, str]] = []  # (hash, node), sorted
+        self._nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, node: str) -> bool:
+        return node in self._nodes
+
+    @property
+    def nodes(self) -> List[str]:
+        return sorted(self._nodes)
+
+    def add(self, node: str):
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for i in range(self.vnodes):
+            bisect.insort(self._points, (_hash(f"{node}#{i}"), node))
+
+    def remove(self, node: str):
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        self._points = [point for point in self._points if point[1] != node]
+
+    def node_for(self, key: str) -> Optional[str]:
+        """The first node clockwise from the key's hash, or None if the ring is empty."""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, (_hash(key), ""))
+        return self._points[index % len(self._points)][1]
+
+
+class ShardDirectory:
+    """
+    Decides which worker serves a session. New sessions follow the hash ring; a session with
+    live connections is pinned to the worker that holds its in-memory state, so a worker joining
+    the ring never moves a running lecture. Pins are dropped when their worker leaves (the session
+    moves to its ring successor) or after the session has had no connections for `pin_grace_seconds`.
+    """
+
+    def __init__(self, workers: Iterable[str] = (), vnodes: int = 160, pin_grace_seconds: float = 300):
+        self.ring = HashRing(workers, vnodes)
+        self.pin_grace_seconds = pin_grace_seconds
+        self._pins: Dict[str, str] = {}  # session_id -> worker
+        self._connections: Dict[str, int] = {}  # session_id -> open proxied sockets
+        self._idle_since: Dict[str, float] = {}  # session_id -> when its last socket closed
+        # Metrics
+        self.sessions_moved = 0
+        self.pins_expired = 0
+
+    def worker_for(self, session_id: str) -> Optional[str]:
+        worker = self._pins.get(session_id)
+        if worker is not None and worker in self.ring:
+            return worker
+        return self.ring.node_for(session_id)
+
+    def pin(self, session_id: str, worker: str):
+        self._pins[session_id] = worker
+        if not self._connections.get(session_id):
+            self._idle_since[session_id] = time.monotonic()
+
+    def connection_opened(self, session_id: str, worker: str):
+        self._pins[session_id] = worker
+        self._connections[session_id] = self._connections.get(session_id, 0) + 1
+        self._idle_since.pop(session_id, None)
+
+    def connection_closed(self, session_id: str):
+        remaining = self._connections.get(session_id, 0) - 1
+        if remaining > 0:
+            self._connections[session_id] = remaining
+            return
+        self._connections.pop(session_id, None)
+        self._idle_since[session_id] = time.monotonic()
+
+    def add_worker(self, worker: str):
+        """New sessions (and idle unpinned ones) start hashing to the worker; pinned sessions stay put."""
+        self.ring.add(worker)
+
+    def remove_worker(self, worker: str) -> List[str]:
+        """Takes a worker off the ring; returns the pinned sessions that now move to their ring successor."""
+        self.ring.remove(worker)
+        moved = [session_id for session_id, pinned in self._pins.items() if pinned == worker]
+        for session_id in moved:
+            del self._pins[session_id]
+            self._idle_since.pop(session_id, None)
+        self.sessions_moved += len(moved)
+        return moved
+
+    def expire_pins(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        expired = [sid for sid, since in self._idle_since.items() if now - since >= self.pin_grace_seconds]
+        for session_id in expired:
+            del self._idle_since[session_id]
+            self._pins.pop(session_id, None)
+        self.pins_expired += len(expired)
+
+    def metrics(self) -> dict:
+        per_worker = {worker: 0 for worker in self.ring.nodes}
+        for worker in self._pins.values():
+            if worker in per_worker:
+                per_worker[worker] += 1
+        return {
+            "workers": self.ring.nodes,
+            "pinned_sessions": len(self._pins),
+            "connected_sessions": len(self._connections),
+            "sessions_per_worker": per_worker,
+            "sessions_moved": self.sessions_moved,
+            "pins_expired": self.pins_expired,
+        }
@@ -0,0 +1,116 @@
+import asyncio
+import random
+import re
+import time
+import zlib
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Set, Tuple
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+# Mersenne prime used by the universal hash family below
+_PRIME = (1 << 61) - 1
+
+
+def shingles(text: str, size: int = 3) -> Set[int]:
+    """Hashed word n-grams of a transcript chunk, ignoring case and punctuation."""
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))} if words else set()
+    return {zlib.crc32(" ".join(words[i : i + size]).encode("utf-8")) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    """MinHash signatures: the fraction of matching positions estimates the Jaccard similarity of two shingle sets."""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = random.Random(seed)
+        self._params: List[Tuple[int, int]] = [
+            (rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)
+        ]
+
+    def signature(self, shingle_set: Set[int]) -> Tuple[int, ...]:
+        if not shingle_set:
+            return ()
+        return tuple(min((a * s + b) % _PRIME for s in shingle_set) for a, b in self._params)
+
+    @staticmethod
+    def similarity(sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+        if not sig_a or not sig_b:
+            return 0.0
+        return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+class ChunkSimilarityIndex:
+    """
+    Per-session index of recent transcript chunks.
+    A new chunk whose estimated similarity to any of the last `window` chunks reaches
+    `threshold` is reported as a near-duplicate, so question generation can be skipped.
+    Sessions that check no chunk for `idle_seconds` are dropped from the index.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        window: int = 10,
+        num_perm: int = 64,
+        shingle_size: int = 3,
+        idle_seconds: float = 2 * 3600,
+    ):
+        self.threshold = threshold
+        self.window = window
+        self.shingle_size = shingle_size
+        self.idle_seconds = idle_seconds
+        self._hasher = MinHasher(num_perm=num_perm)
+        # session_id -> recent signatures, least recently checked first
+        self._recent: "OrderedDict[str, Deque[Tuple[int, ...]]]" = OrderedDict()
+        self._touched: Dict[str, float] = {}
+        # Metrics
+        self.checked = 0
+        self.duplicates = 0
+        self.evicted_idle = 0
+
+    def _evict_idle(self, now: float):
+        while self._recent:
+            session_id = next(iter(self._recent))
+            if now - self._touched[session_id] < self.idle_seconds:
+                return
+            self.discard(session_id)
+            self.evicted_idle += 1
+
+    def signature(self, transcript_chunk: str) -> Tuple[int, ...]:
+        return self._hasher.signature(shingles(transcript_chunk, self.shingle_size))
+
+    async def check_and_add(self, session_id: str, transcript_chunk: str) -> Tuple[bool, float]:
+        """
+        Compares a chunk against the session's recent chunks.
+        Returns (is_near_duplicate, best_similarity); only novel chunks are added to the index.
+        The signature (tens of ms for a long chunk) is computed on a worker thread, off the event loop.
+        """
+        self.checked += 1
+        signature = await asyncio.to_thread(self.signature, transcript_chunk)
+        now = time.monotonic()
+        self._evict_idle(now)
+        recent = self._recent.setdefault(session_id, deque(maxlen=self.window))
+        self._recent.move_to_end(session_id)
+        self._touched[session_id] = now
+        best = max((MinHasher.similarity(signature, previous) for previous in recent), default=0.0)
+
+        if best >= self.threshold:
+            self.duplicates += 1
+            return True, best
+
+        recent.append(signature)
+        return False, best
+
+    def discard(self, session_id: str):
+        self._recent.pop(session_id, None)
+        self._touched.pop(session_id, None)
+
+    def metrics(self) -> dict:
+        return {
+            "sessions": len(self._recent),
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "evicted_idle": self.evicted_idle,
+        }
@@ -0,0 +1,532 @@
+import json
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.leaderboard import RankedLeaderboard
+from app.schemas import FirestoreQuestion
+from app.ttl_store import SessionTTLStore
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Only needed for the shared (multi-worker) backend
+    redis_asyncio = None
+
+STATE_BACKENDS = ("memory", "redis")
+
+
+def new_score() -> dict:
+    return {"score": 0, "correct_answers": 0, "total_answers": 0, "total_response_time": 0}
+
+
+class SessionStateStore(ABC):
+    """
+    Live session state shared by everything that serves a session: pending question options,
+    active students, names, scores and rank order, per-student answers, session stats and start times.
+    The in-process store suits a single worker; a shared store lets several workers serve one session.
+    """
+
+    # Question options awaiting lecturer selection ({"session_id", "questions", "transcript_chunk"})
+
+    @abstractmethod
+    async def put_question_options(
+        self, chunk_id: str, session_id: str, options: dict, only_if_present: bool = False
+    ) -> bool:
+        """
+        Stores an option set; returns whether it was stored. With `only_if_present` the set is
+        replaced only if it still exists, atomically, so a set the lecturer has already selected
+        from (and popped, perhaps on another worker) is never re-created.
+        """
+
+    @abstractmethod
+    async def get_question_options(self, chunk_id: str, session_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def pop_question_options(self, chunk_id: str, session_id: str) -> Optional[dict]: ...
+
+    async def has_question_options(self, chunk_id: str, session_id: str) -> bool:
+        return await self.get_question_options(chunk_id, session_id) is not None
+
+    # Students
+
+    @abstractmethod
+    async def add_student(self, session_id: str, student_id: str, name: Optional[str] = None):
+        """Marks a student active, keeping the score and answers of a returning student."""
+
+    @abstractmethod
+    async def set_student_name(self, session_id: str, student_id: str, name: str): ...
+
+    @abstractmethod
+    async def remove_active_student(self, session_id: str, student_id: str): ...
+
+    @abstractmethod
+    async def active_student_count(self, session_id: str) -> int: ...
+
+    @abstractmethod
+    async def student_names(self, session_id: str) -> Dict[str, str]: ...
+
+    # Scores, rank order and answers
+
+    @abstractmethod
+    async def record_answer(self, session_id: str, student_id: str, answer: dict, response_time_ms: Optional[int]):
+        """
+        Appends an answer record ({"is_correct", "points_earned", ...}) for a joined student and
+        updates their score; answers from students who never joined are ignored.
+        """
+
+    @abstractmethod
+    async def get_student_score(self, session_id: str, student_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def get_student_answers(self, session_id: str, student_id: str) -> List[dict]: ...
+
+    @abstractmethod
+    async def all_student_answers(self, session_id: str) -> Dict[str, List[dict]]: ...
+
+    @abstractmethod
+    async def ranked_students(self, session_id: str, limit: Optional[int] = None) -> List[Tuple[str, dict]]:
+        """(student_id, score data) in rank order: score descending, ties to whoever joined first."""
+
+    @abstractmethod
+    async def student_rank(self, session_id: str, student_id: str) -> int:
+        """1-based rank, or 0 for an unknown student."""
+
+    @abstractmethod
+    async def student_count(self, session_id: str) -> int:
+        """Students who have joined the session (including those who left)."""
+
+    # Session stats and timing
+
+    @abstractmethod
+    async def increment_stats(self, session_id: str, **deltas: int): ...
+
+    @abstractmethod
+    async def get_stats(self, session_id: str) -> dict: ...
+
+    @abstractmethod
+    async def set_session_start(self, session_id: str, started_at: datetime): ...
+
+    @abstractmethod
+    async def get_session_start(self, session_id: str) -> Optional[datetime]: ...
+
+    @abstractmethod
+    async def clear_session(self, session_id: str):
+        """Drops all student, score and stats state of an ended session."""
+
+    async def close(self):
+        pass
+
+    def metrics(self) -> dict:
+        return {}
+
+
+class InMemoryStateStore(SessionStateStore):
+    """Single-process store: plain dicts, a RankedLeaderboard per session and a bounded TTL store for options."""
+
+    def __init__(
+        self,
+        question_options_ttl_seconds: float = 1800,
+        question_options_max_entries: int = 5000,
+        question_options_max_per_session: Optional[int] = 20,
+    ):
+        self.question_options = SessionTTLStore(
+            ttl_seconds=question_options_ttl_seconds,
+            max_entries=question_options_max_entries,
+            max_per_session=question_options_max_per_session,
+        )
+        self.active_students: Dict[str, set] = {}  # session_id -> set of student_ids
+        self.session_stats: Dict[str, Dict] = {}  # session_id -> stats
+        self.student_scores: Dict[str, Dict[str, Dict]] = {}  # session_id -> student_id -> score_data
+        self.names: Dict[str, Dict[str, str]] = {}  # session_id -> student_id -> name
+        self.student_answers: Dict[str, Dict[str, list]] = {}  # session_id -> student_id -> list of answers
+        self.leaderboards: Dict[str, RankedLeaderboard] = {}  # session_id -> students in rank order
+        self.session_start_times: Dict[str, datetime] = {}
+
+    async def put_question_options(
+        self, chunk_id: str, session_id: str, options: dict, only_if_present: bool = False
+    ) -> bool:
+        if only_if_present and (session_id, chunk_id) not in self.question_options:
+            return False
+        self.question_options.put((session_id, chunk_id), session_id, options)
+        return True
+
+    async def get_question_options(self, chunk_id: str, session_id: str) -> Optional[dict]:
+        return self.question_options.get((session_id, chunk_id))
+
+    async def pop_question_options(self, chunk_id: str, session_id: str) -> Optional[dict]:
+        return self.question_options.pop((session_id, chunk_id))
+
+    async def has_question_options(self, chunk_id: str, session_id: str) -> bool:
+        return (session_id, chunk_id) in self.question_options
+
+    async def add_student(self, session_id: str, student_id: str, name: Optional[str] = None):
+        if session_id not in self.active_students:
+            self.active_students[session_id] = set()
+            self.student_scores[session_id] = {}
+            self.names.setdefault(session_id, {})
+            self.student_answers[session_id] = {}
+            self.leaderboards[session_id] = RankedLeaderboard()
+        self.active_students[session_id].add(student_id)
+        if name:
+            self.names[session_id][student_id] = name
+        if student_id not in self.student_scores[session_id]:
+            self.student_scores[session_id][student_id] = new_score()
+            self.leaderboards[session_id].add(student_id)
+        self.student_answers[session_id].setdefault(student_id, [])
+
+    async def set_student_name(self, session_id: str, student_id: str, name: str):
+        self.names.setdefault(session_id, {})[student_id] = name
+
+    async def remove_active_student(self, session_id: str, student_id: str):
+        if session_id in self.active_students:
+            self.active_students[session_id].discard(student_id)
+
+    async def active_student_count(self, session_id: str) -> int:
+        return len(self.active_students.get(session_id, ()))
+
+    async def student_names(self, session_id: str) -> Dict[str, str]:
+        return dict(self.names.get(session_id, {}))
+
+    async def record_answer(self, session_id: str, student_id: str, answer: dict, response_time_ms: Optional[int]):
+        if session_id in self.student_answers and student_id in self.student_answers[session_id]:
+            self.student_answers[session_id][student_id].append(answer)
+
+        if session_id in self.student_scores and student_id in self.student_scores[session_id]:
+            student_data = self.student_scores[session_id][student_id]
+            student_data["total_answers"] += 1
+            if answer["is_correct"]:
+                student_data["correct_answers"] += 1
+                student_data["score"] += answer["points_earned"]
+                self.leaderboards[session_id].update(student_id, student_data["score"])
+            if response_time_ms:
+                student_data["total_response_time"] += response_time_ms
+
+    async def get_student_score(self, session_id: str, student_id: str) -> Optional[dict]:
+        return self.student_scores.get(session_id, {}).get(student_id)
+
+    async def get_student_answers(self, session_id: str, student_id: str) -> List[dict]:
+        return self.student_answers.get(session_id, {}).get(student_id, [])
+
+    async def all_student_answers(self, session_id: str) -> Dict[str, List[dict]]:
+        return self.student_answers.get(session_id, {})
+
+    async def ranked_students(self, session_id: str, limit: Optional[int] = None) -> List[Tuple[str, dict]]:
+        leaderboard = self.leaderboards.get(session_id)
+        if leaderboard is None:
+            return []
+        student_ids = leaderboard.top(limit) if limit is not None else list(leaderboard)
+        scores = self.student_scores[session_id]
+        return [(student_id, scores[student_id]) for student_id in student_ids]
+
+    async def student_rank(self, session_id: str, student_id: str) -> int:
+        leaderboard = self.leaderboards.get(session_id)
+        return leaderboard.rank(student_id) if leaderboard is not None else 0
+
+    async def student_count(self, session_id: str) -> int:
+        return len(self.leaderboards.get(session_id, ()))
+
+    async def increment_stats(self, session_id: str, **deltas: int):
+        stats = self.session_stats.setdefault(session_id, {})
+        for field, delta in deltas.items():
+            stats[field] = stats.get(field, 0) + delta
+
+    async def get_stats(self, session_id: str) -> dict:
+        return dict(self.session_stats.get(session_id, {}))
+
+    async def set_session_start(self, session_id: str, started_at: datetime):
+        self.session_start_times[session_id] = started_at
+
+    async def get_session_start(self, session_id: str) -> Optional[datetime]:
+        return self.session_start_times.get(session_id)
+
+    async def clear_session(self, session_id: str):
+        for state in (
+            self.active_students,
+            self.session_stats,
+            self.student_scores,
+            self.names,
+            self.student_answers,
+            self.leaderboards,
+            self.session_start_times,
+        ):
+            state.pop(session_id, None)
+        self.question_options.discard_session(session_id)
+
+    def metrics(self) -> dict:
+        return {
+            "sessions": len(self.active_students),
+            "question_options": self.question_options.metrics(),
+        }
+
+
+class RedisStateStore(SessionStateStore):
+    """
+    Shared store on a Redis-protocol server, so any worker can serve any session.
+    Rank order is a sorted set whose score packs (points, join order) into one number:
+    points * RANK_SCALE + (RANK_SCALE - 1 - join_seq), so ties go to whoever joined first.
+    Every key of a session, question options included, carries the session's hash tag, so
+    multi-key commands and transactions stay on one Redis Cluster slot.
+    """
+
+    RANK_SCALE = 1 << 20  # Up to ~1M joins per session; points stay exact up to 2^33
+    DELETE_BATCH = 500  # Keys per DEL when a session is cleared
+    # Session-wide keys; per-student keys are score:{student} and answers:{student}
+    SESSION_KEYS = ("active", "names", "rank", "join_seq", "stats", "start")
+
+    def __init__(
+        self,
+        client=None,
+        url: str = "redis://localhost:6379/0",
+        prefix: str = "qwiz",
+        question_options_ttl_seconds: float = 1800,
+        question_options_max_per_session: Optional[int] = 20,
+        session_ttl_seconds: int = 24 * 3600,
+    ):
+        if client is None:
+            if redis_asyncio is None:
+                raise RuntimeError("The redis package is required for the redis state backend")
+            client = redis_asyncio.from_url(url, decode_responses=True)
+        self.redis = client
+        self.prefix = prefix
+        self.question_options_ttl_seconds = question_options_ttl_seconds
+        self.question_options_max_per_session = question_options_max_per_session
+        # Session keys expire on their own if a session is never ended; every write refreshes them all
+        self.session_ttl_seconds = session_ttl_seconds
+
+    def _key(self, session_id: str, *parts: str) -> str:
+        # Hash tag keeps a session's keys on one cluster slot
+        return ":".join((self.prefix, "{" + session_id + "}", *parts))
+
+    def _options_key(self, session_id: str, chunk_id: str) -> str:
+        return self._key(session_id, "options", chunk_id)
+
+    def _touch(self, pipe, session_id: str, *student_keys: str):
+        """Refreshes the TTL of the session-wide keys and the given per-student keys in the same pipeline."""
+        for key in (*(self._key(session_id, part) for part in self.SESSION_KEYS), *student_keys):
+            pipe.expire(key, self.session_ttl_seconds)
+
+    # Question options
+
+    @staticmethod
+    def _encode_options(options: dict) -> str:
+        data = dict(options)
+        data["questions"] = [question.model_dump() for question in options["questions"]]
+        return json.dumps(data)
+
+    @staticmethod
+    def _decode_options(raw: Optional[str]) -> Optional[dict]:
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        data["questions"] = [FirestoreQuestion(**question) for question in data["questions"]]
+        return data
+
+    async def put_question_options(
+        self, chunk_id: str, session_id: str, options: dict, only_if_present: bool = False
+    ) -> bool:
+        index_key = self._key(session_id, "options")
+        ttl_ms = int(self.question_options_ttl_seconds * 1000)
+        if only_if_present:
+            # SET XX is the check and the write in one command; the set is already indexed
+            stored = await self.redis.set(
+                self._options_key(session_id, chunk_id), self._encode_options(options), px=ttl_ms, xx=True
+            )
+            return bool(stored)
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._options_key(session_id, chunk_id), self._encode_options(options), px=ttl_ms)
+            pipe.zadd(index_key, {chunk_id: time.time()})
+            pipe.pexpire(index_key, ttl_ms)
+            await pipe.execute()
+
+        if self.question_options_max_per_session is not None:
+            # Evict the oldest option sets beyond the per-session cap
+            excess = await self.redis.zrange(index_key, 0, -self.question_options_max_per_session - 1)
+            if excess:
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.delete(*(self._options_key(session_id, chunk) for chunk in excess))
+                    pipe.zrem(index_key, *excess)
+                    await pipe.execute()
+        return True
+
+    async def get_question_options(self, chunk_id: str, session_id: str) -> Optional[dict]:
+        return self._decode_options(await self.redis.get(self._options_key(session_id, chunk_id)))
+
+    async def pop_question_options(self, chunk_id: str, session_id: str) -> Optional[dict]:
+        # GETDEL makes the pop atomic, so two workers cannot release the same selection
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.getdel(self._options_key(session_id, chunk_id))
+            pipe.zrem(self._key(session_id, "options"), chunk_id)
+            raw, _ = await pipe.execute()
+        return self._decode_options(raw)
+
+    # Students
+
+    async def add_student(self, session_id: str, student_id: str, name: Optional[str] = None):
+        active_key = self._key(session_id, "active")
+        names_key = self._key(session_id, "names")
+        rank_key = self._key(session_id, "rank")
+        score_key = self._key(session_id, "score", student_id)
+
+        seq_key = self._key(session_id, "join_seq")
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zscore(rank_key, student_id)
+            pipe.sadd(active_key, student_id)
+            if name:
+                pipe.hset(names_key, student_id, name)
+            for field, value in new_score().items():
+                pipe.hsetnx(score_key, field, value)
+            self._touch(pipe, session_id, score_key)
+            already_ranked = (await pipe.execute())[0] is not None
+
+        if not already_ranked:
+            seq = await self.redis.incr(seq_key)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                # NX: if the same student joined concurrently on another worker, the first position wins
+                pipe.zadd(rank_key, {student_id: self.RANK_SCALE - 1 - seq}, nx=True)
+                self._touch(pipe, session_id, score_key)
+                await pipe.execute()
+
+    async def set_student_name(self, session_id: str, student_id: str, name: str):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(session_id, "names"), student_id, name)
+            self._touch(pipe, session_id)
+            await pipe.execute()
+
+    async def remove_active_student(self, session_id: str, student_id: str):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.srem(self._key(session_id, "active"), student_id)
+            self._touch(pipe, session_id)
+            await pipe.execute()
+
+    async def active_student_count(self, session_id: str) -> int:
+        return await self.redis.scard(self._key(session_id, "active"))
+
+    async def student_names(self, session_id: str) -> Dict[str, str]:
+        return await self.redis.hgetall(self._key(session_id, "names"))
+
+    # Scores, rank order and answers
+
+    async def record_answer(self, session_id: str, student_id: str, answer: dict, response_time_ms: Optional[int]):
+        rank_key = self._key(session_id, "rank")
+        if await self.redis.zscore(rank_key, student_id) is None:
+            return
+
+        score_key = self._key(session_id, "score", student_id)
+        answers_key = self._key(session_id, "answers", student_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(answers_key, json.dumps(answer))
+            pipe.hincrby(score_key, "total_answers", 1)
+            if answer["is_correct"]:
+                pipe.hincrby(score_key, "correct_answers", 1)
+                pipe.hincrby(score_key, "score", answer["points_earned"])
+                pipe.zincrby(rank_key, answer["points_earned"] * self.RANK_SCALE, student_id)
+            if response_time_ms:
+                pipe.hincrby(score_key, "total_response_time", response_time_ms)
+            self._touch(pipe, session_id, score_key, answers_key)
+            await pipe.execute()
+
+    @staticmethod
+    def _decode_score(raw: dict) -> Optional[dict]:
+        if not raw:
+            return None
+        return {field: int(raw.get(field, 0)) for field in new_score()}
+
+    async def get_student_score(self, session_id: str, student_id: str) -> Optional[dict]:
+        return self._decode_score(await self.redis.hgetall(self._key(session_id, "score", student_id)))
+
+    async def get_student_answers(self, session_id: str, student_id: str) -> List[dict]:
+        raw = await self.redis.lrange(self._key(session_id, "answers", student_id), 0, -1)
+        return [json.loads(answer) for answer in raw]
+
+    async def all_student_answers(self, session_id: str) -> Dict[str, List[dict]]:
+        student_ids = await self.redis.zrevrange(self._key(session_id, "rank"), 0, -1)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for student_id in student_ids:
+                pipe.lrange(self._key(session_id, "answers", student_id), 0, -1)
+            results = await pipe.execute()
+        return {student_id: [json.loads(answer) for answer in raw] for student_id, raw in zip(student_ids, results)}
+
+    async def ranked_students(self, session_id: str, limit: Optional[int] = None) -> List[Tuple[str, dict]]:
+        stop = -1 if limit is None else limit - 1
+        if limit is not None and limit <= 0:
+            return []
+        student_ids = await self.redis.zrevrange(self._key(session_id, "rank"), 0, stop)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for student_id in student_ids:
+                pipe.hgetall(self._key(session_id, "score", student_id))
+            results = await pipe.execute()
+        return [(student_id, self._decode_score(raw) or new_score()) for student_id, raw in zip(student_ids, results)]
+
+    async def student_rank(self, session_id: str, student_id: str) -> int:
+        rank = await self.redis.zrevrank(self._key(session_id, "rank"), student_id)
+        return rank + 1 if rank is not None else 0
+
+    async def student_count(self, session_id: str) -> int:
+        return await self.redis.zcard(self._key(session_id, "rank"))
+
+    # Session stats and timing
+
+    async def increment_stats(self, session_id: str, **deltas: int):
+        stats_key = self._key(session_id, "stats")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for field, delta in deltas.items():
+                pipe.hincrby(stats_key, field, delta)
+            self._touch(pipe, session_id)
+            await pipe.execute()
+
+    async def get_stats(self, session_id: str) -> dict:
+        raw = await self.redis.hgetall(self._key(session_id, "stats"))
+        return {field: int(value) for field, value in raw.items()}
+
+    async def set_session_start(self, session_id: str, started_at: datetime):
+        await self.redis.set(self._key(session_id, "start"), started_at.isoformat(), ex=self.session_ttl_seconds)
+
+    async def get_session_start(self, session_id: str) -> Optional[datetime]:
+        raw = await self.redis.get(self._key(session_id, "start"))
+        return datetime.fromisoformat(raw) if raw else None
+
+    async def clear_session(self, session_id: str):
+        # Per-student keys are found through the rank set and option keys through their index,
+        # so the session's keys are deleted directly instead of scanning the keyspace
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zrange(self._key(session_id, "rank"), 0, -1)
+            pipe.zrange(self._key(session_id, "options"), 0, -1)
+            student_ids, option_chunks = await pipe.execute()
+
+        keys = [self._key(session_id, part) for part in (*self.SESSION_KEYS, "options")]
+        for student_id in student_ids:
+            keys.append(self._key(session_id, "score", student_id))
+            keys.append(self._key(session_id, "answers", student_id))
+        keys.extend(self._options_key(session_id, chunk) for chunk in option_chunks)
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for start in range(0, len(keys), self.DELETE_BATCH):
+                pipe.delete(*keys[start : start + self.DELETE_BATCH])
+            await pipe.execute()
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def create_state_store(backend: str, **kwargs) -> SessionStateStore:
+    """
+    Builds the configured store: "memory" (single worker) or "redis" (shared by all workers).
+    `question_options_max_entries` applies to the in-memory store only; in Redis, option sets are
+    bounded per session (`question_options_max_per_session`) and by their TTL.
+    """
+    if backend == "memory":
+        return InMemoryStateStore(
+            question_options_ttl_seconds=kwargs.get("question_options_ttl_seconds", 1800),
+            question_options_max_entries=kwargs.get("question_options_max_entries", 5000),
+            question_options_max_per_session=kwargs.get("question_options_max_per_session", 20),
+        )
+    if backend == "redis":
+        return RedisStateStore(
+            url=kwargs.get("url", "redis://localhost:6379/0"),
+            question_options_ttl_seconds=kwargs.get("question_options_ttl_seconds", 1800),
+            question_options_max_per_session=kwargs.get("question_options_max_per_session", 20),
+        )
+    raise ValueError(f"State backend must be one of {STATE_BACKENDS}")
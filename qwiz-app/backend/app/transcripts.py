@@ -0,0 +1,139 @@
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast local token estimate (~4 characters per token for English text); no tokenizer round-trip."""
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Keeps the end of the text (the most recent speech) within max_tokens."""
+    max_chars = max(0, max_tokens) * 4
+    if len(text) <= max_chars:
+        return text
+    return text[len(text) - max_chars :].lstrip()
+
+
+class TranscriptWindow:
+    """
+    Bounded rolling transcript for one session.
+    Segments are kept in a ring buffer; the oldest are evicted once either the segment or
+    character limit is exceeded, so memory stays flat however long the lecture runs.
+    """
+
+    def __init__(self, max_segments: int = 500, max_chars: int = 200_000):
+        self.max_segments = max_segments
+        self.max_chars = max_chars
+        self._segments: Deque[str] = deque()
+        self._chars = 0
+        self.last_updated: Optional[float] = None
+
+    def append(self, segment: str):
+        segment = segment.strip()
+        if not segment:
+            return
+        self._segments.append(segment)
+        self._chars += len(segment)
+        self.last_updated = time.monotonic()
+        while self._segments and (len(self._segments) > self.max_segments or self._chars > self.max_chars):
+            self._chars -= len(self._segments.popleft())
+
+    def __len__(self) -> int:
+        return len(self._segments)
+
+    @property
+    def chars(self) -> int:
+        return self._chars
+
+    def context_before(self, transcript_chunk: str, max_tokens: int) -> str:
+        """
+        Returns the most recent segments spoken before `transcript_chunk`, oldest first, within max_tokens.
+        Segments contained in the chunk (the chunk itself, or pieces merged into it) are not repeated.
+        """
+        segments = list(self._segments)
+        end = len(segments)
+        # Find the newest segment that is part of the chunk, then step back over the rest of it
+        for i in range(len(segments) - 1, -1, -1):
+            if segments[i] in transcript_chunk:
+                end = i
+                while end > 0 and segments[end - 1] in transcript_chunk:
+                    end -= 1
+                break
+
+        selected: List[str] = []
+        remaining = max_tokens
+        for segment in reversed(segments[:end]):
+            cost = estimate_tokens(segment) + 1  # separator
+            if cost > remaining:
+                if not selected:
+                    # Partially include the newest segment rather than returning no context at all
+                    selected.append(truncate_to_tokens(segment, remaining))
+                break
+            selected.append(segment)
+            remaining -= cost
+        return " ".join(reversed(selected))
+
+
+class TranscriptStore:
+    """
+    Per-session transcript windows plus token-budgeted prompt assembly.
+    Windows of sessions that receive no transcript for `idle_seconds` are freed, so abandoned
+    sessions (never explicitly ended) do not keep their transcript for the life of the process.
+    """
+
+    def __init__(self, max_segments: int = 500, max_chars: int = 200_000, idle_seconds: float = 2 * 3600):
+        self.max_segments = max_segments
+        self.max_chars = max_chars
+        self.idle_seconds = idle_seconds
+        self._windows: "OrderedDict[str, TranscriptWindow]" = OrderedDict()  # least recently used first
+        self._touched: Dict[str, float] = {}
+        # Metrics
+        self.evicted_idle = 0
+
+    def _evict_idle(self, now: float):
+        while self._windows:
+            session_id = next(iter(self._windows))
+            if now - self._touched[session_id] < self.idle_seconds:
+                return
+            self.discard(session_id)
+            self.evicted_idle += 1
+
+    def window(self, session_id: str) -> TranscriptWindow:
+        now = time.monotonic()
+        self._evict_idle(now)
+        if session_id not in self._windows:
+            self._windows[session_id] = TranscriptWindow(self.max_segments, self.max_chars)
+        self._windows.move_to_end(session_id)
+        self._touched[session_id] = now
+        return self._windows[session_id]
+
+    def append(self, session_id: str, segment: str):
+        self.window(session_id).append(segment)
+
+    def build_prompt_transcript(self, session_id: str, transcript_chunk: str, max_tokens: int) -> Tuple[str, str]:
+        """
+        Splits a token budget between the chunk to generate questions from and earlier lecture context.
+        The chunk always comes first (trimmed to its most recent speech if it alone exceeds the budget);
+        whatever remains is filled with the newest preceding segments.
+        Returns (chunk, context).
+        """
+        chunk = truncate_to_tokens(transcript_chunk.strip(), max_tokens)
+        remaining = max_tokens - estimate_tokens(chunk)
+        window = self._windows.get(session_id)
+        if window is None or remaining <= 0:
+            return chunk, ""
+        return chunk, window.context_before(transcript_chunk, remaining)
+
+    def discard(self, session_id: str):
+        self._windows.pop(session_id, None)
+        self._touched.pop(session_id, None)
+
+    def metrics(self) -> dict:
+        return {
+            "sessions": len(self._windows),
+            "segments": sum(len(window) for window in self._windows.values()),
+            "chars": sum(window.chars for window in self._windows.values()),
+            "evicted_idle": self.evicted_idle,
+        }
@@ -0,0 +1,105 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class SessionTTLStore:
+    """
+    Bounded in-memory store whose entries belong to a session.
+    Entries expire after `ttl_seconds`; the oldest entry is evicted once the store holds
+    `max_entries`, or once its session holds `max_per_session`. A per-session index lets
+    everything belonging to a session be dropped at once when it ends.
+    """
+
+    def __init__(self, ttl_seconds: float = 1800, max_entries: int = 5000, max_per_session: Optional[int] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_per_session = max_per_session
+        # key -> (session_id, expires_at, value); ordered oldest write first, which is also soonest to expire
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._by_session: Dict[str, "OrderedDict[Hashable, None]"] = {}
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def put(self, key: Hashable, session_id: str, value: Any):
+        """Stores a value, replacing (and refreshing the TTL of) any existing entry for the key."""
+        self._remove(key)
+        self._entries[key] = (session_id, time.monotonic() + self.ttl_seconds, value)
+        self._by_session.setdefault(session_id, OrderedDict())[key] = None
+
+        self._purge_expired()
+        session_keys = self._by_session[session_id]
+        while self.max_per_session is not None and len(session_keys) > self.max_per_session:
+            self._remove(next(iter(session_keys)))
+            self.evicted += 1
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evicted += 1
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if entry[1] <= time.monotonic():
+            self._remove(key)
+            self.expired += 1
+            self.misses += 1
+            return default
+        self.hits += 1
+        return entry[2]
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[1] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._remove(key)
+        return entry[2] if entry is not None else default
+
+    def session_keys(self, session_id: str) -> list:
+        return list(self._by_session.get(session_id, ()))
+
+    def discard_session(self, session_id: str) -> int:
+        """Drops every entry of a session; returns how many were removed."""
+        keys = self._by_session.pop(session_id, None)
+        if not keys:
+            return 0
+        for key in keys:
+            self._entries.pop(key, None)
+        return len(keys)
+
+    def _remove(self, key: Hashable) -> Optional[tuple]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            session_keys = self._by_session.get(entry[0])
+            if session_keys is not None:
+                session_keys.pop(key, None)
+                if not session_keys:
+                    del self._by_session[entry[0]]
+        return entry
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        while self._entries:
+            key, (_, expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            self._remove(key)
+            self.expired += 1
+
+    def metrics(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "sessions": len(self._by_session),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
@@ -2,7 +2,8 @@
 Unit tests for service layer (Firestore, Gemini AI, Analytics)
 """
 import pytest
-from unittest.mock import Mock, patch
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
 from datetime import datetime, timezone
 
 
@@ -268,3 +269,2079 @@ class TestSessionCodeGeneration:
 
         # Should generate mostly unique codes (allowing for rare collisions)
         assert len(codes) >= 95
+
+
+@pytest.mark.unit
+class TestBroadcastCoalescer:
+    """Test tick-based coalescing of analytics and leaderboard frames"""
+
+    async def test_burst_emits_one_frame_per_kind(self):
+        """Test that many updates within a tick produce a single frame of each kind"""
+        from app.analytics import BroadcastCoalescer
+
+        emit = AsyncMock()
+        coalescer = BroadcastCoalescer(emit, base_tick_ms=20)
+
+        for _ in range(100):
+            await coalescer.mark_dirty("session-1", "analytics")
+            await coalescer.mark_dirty("session-1", "leaderboard")
+        emit.assert_not_called()
+
+        await asyncio.sleep(0.05)
+        assert emit.await_count == 2
+        emit.assert_any_await("session-1", "analytics")
+        emit.assert_any_await("session-1", "leaderboard")
+
+    def test_tick_adapts_to_class_size(self):
+        """Test that the tick grows with class size and is capped"""
+        from app.analytics import BroadcastCoalescer
+
+        coalescer = BroadcastCoalescer(AsyncMock(), base_tick_ms=250, per_student_tick_ms=1.0, max_tick_ms=1000)
+
+        assert coalescer.tick_seconds(0) == pytest.approx(0.25)
+        assert coalescer.tick_seconds(500) == pytest.approx(0.75)
+        assert coalescer.tick_seconds(5000) == pytest.approx(1.0)
+
+    async def test_flush_emits_pending_immediately(self):
+        """Test that flush sends pending frames without waiting for the tick"""
+        from app.analytics import BroadcastCoalescer
+
+        emit = AsyncMock()
+        coalescer = BroadcastCoalescer(emit, base_tick_ms=10_000)
+
+        await coalescer.mark_dirty("session-1", "leaderboard")
+        await coalescer.flush("session-1")
+
+        emit.assert_awaited_once_with("session-1", "leaderboard")
+
+    async def test_cancelled_tick_keeps_newer_timer(self):
+        """Test that a timer cancelled by flush does not unregister the timer scheduled after it"""
+        from app.analytics import BroadcastCoalescer
+
+        emit = AsyncMock()
+        coalescer = BroadcastCoalescer(emit, base_tick_ms=20)
+
+        await coalescer.mark_dirty("session-1", "leaderboard")
+        await asyncio.sleep(0)  # The tick starts sleeping
+        await coalescer.flush("session-1")
+        await coalescer.mark_dirty("session-1", "analytics")
+        timer = coalescer._timers["session-1"]
+        await asyncio.sleep(0)  # The cancelled tick unwinds
+
+        assert coalescer._timers["session-1"] is timer
+        await coalescer.mark_dirty("session-1", "analytics")
+        await asyncio.sleep(0.05)
+        assert emit.await_count == 2
+        assert coalescer._timers == {}
+
+    async def test_answers_are_coalesced_in_analytics_service(self):
+        """Test that a burst of answers results in one analytics and one leaderboard broadcast"""
+        from app.analytics import AnalyticsService
+
+        manager = Mock()
+        manager.broadcast = AsyncMock()
+        service = AnalyticsService(db_client=MagicMock(), session_manager=manager)
+        service.coalescer.base_tick_ms = service.coalescer.max_tick_ms = 10_000
+
+        for i in range(30):
+            await service.track_student_join("session-1", f"student-{i}", f"Student {i}")
+        for i in range(30):
+            await service.track_answer_submitted("session-1", f"student-{i}", "q1", "A", "A", response_time_ms=1000)
+        manager.broadcast.assert_not_awaited()
+
+        await service.coalescer.flush("session-1")
+        frame_types = [call.args[1]["type"] for call in manager.broadcast.await_args_list]
+        assert sorted(frame_types) == ["analytics_update", "leaderboard_update"]
+
+
+@pytest.mark.unit
+class TestRankedLeaderboard:
+    """Test the incrementally maintained leaderboard"""
+
+    def test_rank_order_with_ties(self):
+        """Test that students are ranked by score with ties going to whoever joined first"""
+        from app.leaderboard import RankedLeaderboard
+
+        leaderboard = RankedLeaderboard()
+        for student_id in ["alice", "bob", "charlie", "diana"]:
+            leaderboard.add(student_id)
+
+        leaderboard.update("bob", 380)
+        leaderboard.update("alice", 450)
+        leaderboard.update("diana", 380)
+
+        assert list(leaderboard) == ["alice", "bob", "diana", "charlie"]
+        assert leaderboard.top(2) == ["alice", "bob"]
+        assert leaderboard.rank("diana") == 3
+        assert leaderboard.rank("unknown") == 0
+        assert len(leaderboard) == 4
+
+    def test_score_updates_move_students(self):
+        """Test that updating a score re-ranks the student"""
+        from app.leaderboard import RankedLeaderboard
+
+        leaderboard = RankedLeaderboard()
+        leaderboard.update("alice", 100)
+        leaderboard.update("bob", 200)
+        assert leaderboard.rank("alice") == 2
+
+        leaderboard.update("alice", 300)
+        assert leaderboard.rank("alice") == 1
+        assert leaderboard.score("alice") == 300
+
+        leaderboard.remove("alice")
+        assert leaderboard.top(10) == ["bob"]
+
+    async def test_analytics_service_uses_ranked_order(self):
+        """Test that leaderboard and student results agree with a full sort"""
+        from app.analytics import AnalyticsService
+
+        manager = Mock()
+        manager.broadcast = AsyncMock()
+        service = AnalyticsService(db_client=MagicMock(), session_manager=manager)
+
+        for i in range(12):
+            await service.track_student_join("session-1", f"student-{i}", f"Student {i}")
+        for i in range(12):
+            selected = "A" if i % 3 else "B"
+            await service.track_answer_submitted("session-1", f"student-{i}", "q1", selected, "A", response_time_ms=i * 300)
+        service.coalescer.discard("session-1")
+
+        leaderboard = await service.get_leaderboard("session-1", limit=5)
+        expected = sorted(service.state.student_scores["session-1"].items(), key=lambda x: x[1]["score"], reverse=True)
+        assert [s["score"] for s in leaderboard["students"]] == [data["score"] for _, data in expected[:5]]
+
+        for rank, (student_id, _) in enumerate(expected, 1):
+            assert (await service.get_student_session_results("session-1", student_id))["final_rank"] == rank
+
+
+@pytest.mark.unit
+class TestEndSessionResults:
+    """Test end-of-session result delivery"""
+
+    async def test_each_student_receives_only_their_results(self):
+        """Test that session_ended is unicast with the student's own results and rank"""
+        from app.analytics import AnalyticsService
+
+        manager = Mock()
+        manager.broadcast = AsyncMock()
+        manager.broadcast_to_lecturers = AsyncMock()
+        manager.send_to_student = AsyncMock(return_value=True)
+        service = AnalyticsService(db_client=MagicMock(), session_manager=manager)
+
+        for name in ["Alice", "Bob", "Charlie"]:
+            await service.track_student_join("session-1", name, name)
+        await service.track_answer_submitted("session-1", "Bob", "q1", "A", "A", response_time_ms=1000)
+        await service.track_answer_submitted("session-1", "Alice", "q1", "B", "A", response_time_ms=1000)
+
+        result = await service.end_session("session-1")
+
+        assert result["total_students"] == 3
+        sent = {call.args[1]: call.args[2] for call in manager.send_to_student.await_args_list}
+        assert set(sent) == {"Alice", "Bob", "Charlie"}
+        assert all(message["type"] == "session_ended" for message in sent.values())
+        assert sent["Bob"]["results"]["final_rank"] == 1
+        assert sent["Alice"]["results"]["student_id"] == "Alice"
+        assert "all_results" not in sent["Alice"]
+        assert all(call.args[1]["type"] != "session_ended" for call in manager.broadcast.await_args_list)
+
+    async def test_send_to_student_uses_student_index(self):
+        """Test that SessionManager routes a message to the indexed student socket only"""
+        from app.services import SessionManager
+
+        manager = SessionManager(db_client=Mock())
+        alice_ws, bob_ws = Mock(), Mock()
+        for ws in (alice_ws, bob_ws):
+            ws.accept = AsyncMock()
+            ws.send_text = AsyncMock()
+            await manager.connect("session-1", ws, "student")
+        manager.register_student("session-1", "Alice", alice_ws)
+        manager.register_student("session-1", "Bob", bob_ws)
+
+        assert await manager.send_to_student("session-1", "Alice", {"type": "session_ended"})
+        await asyncio.sleep(0)
+        alice_ws.send_text.assert_awaited_once()
+        bob_ws.send_text.assert_not_awaited()
+
+        manager.disconnect("session-1", alice_ws)
+        assert not await manager.send_to_student("session-1", "Alice", {"type": "session_ended"})
+        manager.disconnect("session-1", bob_ws)
+
+
+@pytest.mark.unit
+class TestAnalyticsEventSink:
+    """Test write-behind batching of analytics events"""
+
+    async def test_events_are_written_in_batches(self):
+        """Test that buffered events are committed as Firestore batches, not one add() each"""
+        from app.event_sink import AnalyticsEventSink
+
+        repository = Mock()
+        repository.write_analytics_events = AsyncMock()
+        sink = AnalyticsEventSink(repository, batch_size=200, flush_interval_ms=60_000)
+
+        for i in range(450):
+            await sink.add("session-1", {"n": i})
+        await sink.close()
+
+        batch_sizes = [len(call.args[0]) for call in repository.write_analytics_events.await_args_list]
+        assert batch_sizes == [200, 200, 50]
+        assert sink.events_written == 450
+        assert sink.pending == 0
+
+    async def test_interval_flush_runs_in_background(self):
+        """Test that a partial batch is flushed once the interval elapses"""
+        from app.event_sink import AnalyticsEventSink
+
+        repository = Mock()
+        repository.write_analytics_events = AsyncMock()
+        sink = AnalyticsEventSink(repository, batch_size=100, flush_interval_ms=10)
+
+        await sink.add("session-1", {"event_type": "student_join"})
+        await asyncio.sleep(0.1)
+
+        assert sink.events_written == 1
+        await sink.close()
+
+    async def test_failed_commit_keeps_events_for_retry(self):
+        """Test that events from a failed batch are retried on the next flush"""
+        from app.event_sink import AnalyticsEventSink
+
+        repository = Mock()
+        repository.write_analytics_events = AsyncMock(side_effect=[Exception("unavailable"), None])
+        sink = AnalyticsEventSink(repository, batch_size=10, flush_interval_ms=60_000)
+
+        for i in range(5):
+            await sink.add("session-1", {"n": i})
+        await sink.flush()
+        assert sink.pending == 5
+        assert sink.failed_commits == 1
+
+        await sink.close()
+        assert sink.events_written == 5
+        assert sink.events_dropped == 0
+
+
+@pytest.mark.unit
+class TestFirestoreRepository:
+    """Test the executor-backed Firestore data-access layer"""
+
+    async def test_blocking_calls_run_off_the_event_loop(self):
+        """Test that Firestore calls execute on pool threads, not the event loop thread"""
+        import threading
+        from app.repository import FirestoreRepository
+
+        loop_thread = threading.get_ident()
+        call_threads = []
+
+        def fake_get():
+            call_threads.append(threading.get_ident())
+            return Mock(exists=True, to_dict=Mock(return_value={"answerTimeSeconds": 45}))
+
+        db = MagicMock()
+        db.collection.return_value.document.return_value.get.side_effect = fake_get
+        repository = FirestoreRepository(db, max_workers=2)
+
+        session_data = await repository.get_session("ABC123")
+
+        assert session_data == {"answerTimeSeconds": 45}
+        assert call_threads and loop_thread not in call_threads
+        assert repository.metrics()["calls"] == 1
+        repository.shutdown()
+
+    async def test_missing_documents_return_none(self):
+        """Test that reads of missing documents return None"""
+        from app.repository import FirestoreRepository
+
+        db = MagicMock()
+        db.collection.return_value.document.return_value.get.return_value = Mock(exists=False)
+        db.collection.return_value.document.return_value.collection.return_value.document.return_value.get.return_value = Mock(
+            exists=False
+        )
+        repository = FirestoreRepository(db, max_workers=1)
+
+        assert await repository.get_session("NOPE00") is None
+        assert await repository.get_question("NOPE00", "q1") is None
+        assert not await repository.session_exists("NOPE00")
+        repository.shutdown()
+
+
+@pytest.mark.unit
+class TestGeminiClient:
+    """Test the shared async Gemini HTTP client"""
+
+    @staticmethod
+    def _gemini_response(questions):
+        import json
+        import httpx
+
+        body = {"candidates": [{"content": {"parts": [{"text": json.dumps({"questions": questions})}]}}]}
+        return httpx.Response(200, json=body)
+
+    async def test_generate_questions_uses_pooled_client(self, sample_question_data):
+        """Test that questions are parsed from an async Gemini call with the API key as a parameter"""
+        import httpx
+        from app.llm import GeminiClient
+        from app.services import generate_three_questions_with_llm
+
+        llm_question = {
+            "question_text": sample_question_data["questionText"],
+            "options": sample_question_data["options"],
+            "correct_answer": sample_question_data["correctAnswer"],
+            "explanation": sample_question_data["explanation"],
+        }
+        requests_seen = []
+
+        def handler(request):
+            requests_seen.append(request)
+            return self._gemini_response([llm_question] * 3)
+
+        client = GeminiClient(api_key="test-key", model="test-model")
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        questions = await generate_three_questions_with_llm("Paris is the capital of France.", client)
+
+        assert len(questions) == 3
+        assert questions[0].questionText == "What is the capital of France?"
+        assert requests_seen[0].url.params["key"] == "test-key"
+        assert "test-model:generateContent" in requests_seen[0].url.path
+        await client.close()
+
+    async def test_concurrency_is_capped(self):
+        """Test that no more than max_concurrency requests are in flight at once"""
+        import httpx
+        from app.llm import GeminiClient
+
+        peak = 0
+
+        async def handler(request):
+            nonlocal peak
+            peak = max(peak, client.in_flight)
+            await asyncio.sleep(0.01)
+            return self._gemini_response([])
+
+        client = GeminiClient(api_key="test-key", model="test-model", max_concurrency=2)
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        await asyncio.gather(*(client.generate_content({}) for _ in range(6)))
+
+        assert peak == 2
+        assert client.requests_sent == 6
+        await client.close()
+
+    async def test_timeout_returns_no_questions(self):
+        """Test that a timed-out Gemini call fails fast with an empty result"""
+        import httpx
+        from app.llm import GeminiClient
+        from app.services import generate_three_questions_with_llm
+
+        def handler(request):
+            raise httpx.ReadTimeout("timed out", request=request)
+
+        client = GeminiClient(api_key="test-key", model="test-model")
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        assert await generate_three_questions_with_llm("Some transcript text", client) == []
+        assert client.request_errors == 1
+        await client.close()
+
+
+@pytest.mark.unit
+class TestQuestionGenerationQueue:
+    """Test background question generation jobs"""
+
+    async def test_submit_does_not_wait_for_generation(self):
+        """Test that submitting a chunk returns immediately and the job runs in the background"""
+        from app.generation_queue import QuestionGenerationQueue
+
+        release = asyncio.Event()
+        handled = []
+
+        async def handler(session_id, chunk):
+            await release.wait()
+            handled.append((session_id, chunk))
+
+        queue = QuestionGenerationQueue(handler, workers=2)
+        queue.submit("session-1", "chunk one")
+        await asyncio.sleep(0)
+        assert handled == []
+
+        release.set()
+        await asyncio.sleep(0.01)
+        assert handled == [("session-1", "chunk one")]
+        await queue.close()
+
+    async def test_stale_chunks_are_replaced_per_session(self):
+        """Test that only the newest waiting chunk runs after the in-flight job"""
+        from app.generation_queue import QuestionGenerationQueue
+
+        release = asyncio.Event()
+        handled = []
+
+        async def handler(session_id, chunk):
+            handled.append(chunk)
+            await release.wait()
+
+        queue = QuestionGenerationQueue(handler, workers=4, per_session_limit=1)
+        queue.submit("session-1", "first")
+        await asyncio.sleep(0)
+        queue.submit("session-1", "second")
+        queue.submit("session-1", "third")
+        await asyncio.sleep(0.01)
+
+        # Only one job runs for the session even though workers are free
+        assert handled == ["first"]
+        release.set()
+        await asyncio.sleep(0.01)
+
+        assert handled == ["first", "third"]
+        assert queue.dropped_stale == 1
+        await queue.close()
+
+    async def test_merge_policy_and_global_limit(self):
+        """Test merging of waiting chunks and the global worker cap across sessions"""
+        from app.generation_queue import QuestionGenerationQueue
+
+        release = asyncio.Event()
+        handled = []
+
+        async def handler(session_id, chunk):
+            handled.append((session_id, chunk))
+            await release.wait()
+
+        queue = QuestionGenerationQueue(handler, workers=2, stale_policy="merge")
+        for session_id in ["s1", "s2", "s3"]:
+            queue.submit(session_id, "a")
+        queue.submit("s3", "b")
+        await asyncio.sleep(0.01)
+
+        assert queue.metrics()["running"] == 2
+        assert queue.pending_for("s3") == "a b"
+
+        release.set()
+        await asyncio.sleep(0.01)
+        assert ("s3", "a b") in handled
+        await queue.close()
+
+
+    async def test_cancel_session_stops_running_job(self):
+        """Test that ending a session cancels its running job and the worker goes on serving others"""
+        from app.generation_queue import QuestionGenerationQueue
+
+        started, cancelled, handled = asyncio.Event(), [], []
+
+        async def handler(session_id, chunk):
+            if session_id == "ended":
+                started.set()
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    cancelled.append(chunk)
+                    raise
+            handled.append(session_id)
+
+        queue = QuestionGenerationQueue(handler, workers=1)
+        queue.submit("ended", "running chunk")
+        await started.wait()
+        queue.submit("ended", "waiting chunk")
+        queue.cancel_session("ended")
+        queue.submit("live", "chunk")
+        await asyncio.sleep(0.01)
+
+        assert cancelled == ["running chunk"]
+        assert handled == ["live"]
+        assert queue.metrics()["cancelled"] == 1
+        assert queue.metrics()["running"] == 0
+        await queue.close()
+
+@pytest.mark.unit
+class TestLLMResponseCache:
+    """Test the content-addressed cache of generated questions"""
+
+    @staticmethod
+    def _questions(n=3):
+        from app.schemas import FirestoreQuestion
+
+        return [
+            FirestoreQuestion(
+                questionText=f"Question {i}?",
+                options=["A", "B", "C", "D"],
+                correctAnswer="A",
+                explanation="Because A.",
+                generatedBy="AI",
+            )
+            for i in range(n)
+        ]
+
+    def test_key_ignores_case_and_whitespace_but_not_model(self):
+        """Test that equivalent chunks share a key while model and prompt changes do not"""
+        from app.llm_cache import cache_key
+
+        key = cache_key("Machine  learning\nis a subset of AI.", "model-a", "v1")
+        assert key == cache_key("machine learning is a subset of ai.", "model-a", "v1")
+        assert key != cache_key("machine learning is a subset of ai.", "model-b", "v1")
+        assert key != cache_key("machine learning is a subset of ai.", "model-a", "v2")
+
+    async def test_memory_lru_eviction(self):
+        """Test that the least recently used entry is evicted first"""
+        from app.llm_cache import LLMResponseCache
+
+        cache = LLMResponseCache(max_entries=2)
+        await cache.put("a", self._questions())
+        await cache.put("b", self._questions())
+        assert await cache.get("a") is not None
+        await cache.put("c", self._questions())
+
+        assert await cache.get("b") is None
+        assert await cache.get("a") is not None
+        assert cache.metrics()["memory_hits"] == 2
+
+    async def test_disk_tier_survives_new_instance(self, tmp_path):
+        """Test that entries written to disk are served by a fresh cache with fresh IDs"""
+        from app.llm_cache import LLMResponseCache
+
+        original = self._questions()
+        await LLMResponseCache(disk_dir=str(tmp_path)).put("key", original)
+
+        cache = LLMResponseCache(disk_dir=str(tmp_path))
+        cached = await cache.get("key")
+
+        assert [q.questionText for q in cached] == [q.questionText for q in original]
+        assert cached[0].id != original[0].id
+        assert cache.disk_hits == 1
+
+    async def test_repeat_chunk_skips_gemini(self, sample_question_data):
+        """Test that generating from the same chunk twice calls Gemini once"""
+        import json
+        import httpx
+        from app.llm import GeminiClient
+        from app.llm_cache import LLMResponseCache
+        from app.services import generate_three_questions_with_llm
+
+        llm_question = {
+            "question_text": sample_question_data["questionText"],
+            "options": sample_question_data["options"],
+            "correct_answer": sample_question_data["correctAnswer"],
+            "explanation": sample_question_data["explanation"],
+        }
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            body = {"candidates": [{"content": {"parts": [{"text": json.dumps({"questions": [llm_question] * 3})}]}}]}
+            return httpx.Response(200, json=body)
+
+        client = GeminiClient(api_key="test-key", model="test-model")
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        cache = LLMResponseCache()
+
+        first = await generate_three_questions_with_llm("Paris is the capital of France.", client, cache=cache)
+        second = await generate_three_questions_with_llm("paris is the capital of  France.", client, cache=cache)
+
+        assert len(calls) == 1
+        assert [q.questionText for q in second] == [q.questionText for q in first]
+        await client.close()
+
+
+@pytest.mark.unit
+class TestStreamingGeneration:
+    """Test streaming question generation and incremental parsing"""
+
+    @staticmethod
+    def _llm_questions():
+        return [
+            {
+                "question_text": f"Question {i} about {{braces}} and \"quotes\"?",
+                "options": ["A", "B", "C", "D"],
+                "correct_answer": "A",
+                "explanation": "Escaped \\\\ backslash } inside a string.",
+            }
+            for i in range(3)
+        ]
+
+    def test_parser_emits_items_as_they_complete(self):
+        """Test that each array element is returned as soon as its closing brace arrives"""
+        import json
+        from app.llm import StreamingArrayParser
+
+        document = json.dumps({"questions": self._llm_questions()})
+        first_item_end = document.index("}, {") + 1
+
+        parser = StreamingArrayParser()
+        emitted = parser.feed(document[: first_item_end - 1])
+        assert emitted == []
+        emitted = parser.feed(document[first_item_end - 1 : first_item_end])
+        assert [item["question_text"] for item in emitted] == ["Question 0 about {braces} and \"quotes\"?"]
+
+        # Feed the rest one character at a time
+        rest = []
+        for char in document[first_item_end:]:
+            rest.extend(parser.feed(char))
+        assert [item["question_text"][:10] for item in rest] == ["Question 1", "Question 2"]
+
+    async def test_stream_yields_validated_questions_and_caches(self):
+        """Test streaming via SSE yields FirestoreQuestions and caches a complete set"""
+        import json
+        import httpx
+        from app.llm import GeminiClient
+        from app.llm_cache import LLMResponseCache
+        from app.services import stream_questions_with_llm
+
+        document = json.dumps({"questions": self._llm_questions()})
+        pieces = [document[i : i + 40] for i in range(0, len(document), 40)]
+        sse_body = "".join(
+            f"data: {json.dumps({'candidates': [{'content': {'parts': [{'text': piece}]}}]})}\r\n\r\n"
+            for piece in pieces
+        )
+        requests_seen = []
+
+        def handler(request):
+            requests_seen.append(request)
+            return httpx.Response(200, text=sse_body, headers={"Content-Type": "text/event-stream"})
+
+        client = GeminiClient(api_key="test-key", model="test-model")
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        cache = LLMResponseCache()
+
+        questions = [q async for q in stream_questions_with_llm("A transcript chunk.", client, cache=cache)]
+
+        assert [q.questionText[:10] for q in questions] == ["Question 0", "Question 1", "Question 2"]
+        assert "streamGenerateContent" in requests_seen[0].url.path
+        assert requests_seen[0].url.params["alt"] == "sse"
+        assert client.in_flight == 0
+
+        cached = [q async for q in stream_questions_with_llm("A transcript chunk.", client, cache=cache)]
+        assert len(cached) == 3
+        assert len(requests_seen) == 1
+        await client.close()
+
+
+    async def test_stream_closed_early_still_fills_cache(self):
+        """Test that closing the stream after the first question finishes it in the background for the cache"""
+        import json
+        import httpx
+        from contextlib import aclosing
+        from app.llm import GeminiClient
+        from app.llm_cache import LLMResponseCache
+        from app.llm_cache import cache_key
+        from app.services import PROMPT_VERSION, _background_tasks, stream_questions_with_llm
+
+        document = json.dumps({"questions": self._llm_questions()})
+        pieces = [document[i : i + 40] for i in range(0, len(document), 40)]
+        sse_body = "".join(
+            f"data: {json.dumps({'candidates': [{'content': {'parts': [{'text': piece}]}}]})}\r\n\r\n"
+            for piece in pieces
+        )
+        client = GeminiClient(api_key="test-key", model="test-model")
+        client._client = httpx.AsyncClient(
+            transport=httpx.MockTransport(
+                lambda request: httpx.Response(200, text=sse_body, headers={"Content-Type": "text/event-stream"})
+            )
+        )
+        cache = LLMResponseCache()
+
+        async with aclosing(stream_questions_with_llm("A transcript chunk.", client, cache=cache)) as stream:
+            async for first in stream:
+                break
+        assert first.questionText.startswith("Question 0")
+        await asyncio.gather(*_background_tasks)
+
+        cached = await cache.get(cache_key("A transcript chunk.", client.model, PROMPT_VERSION))
+        assert [q.questionText[:10] for q in cached] == ["Question 0", "Question 1", "Question 2"]
+        assert client.in_flight == 0
+        await client.close()
+
+
+@pytest.mark.unit
+class TestParallelGeneration:
+    """Test parallel single-question generation with hedged requests"""
+
+    @staticmethod
+    def _single_question_response(text):
+        import json
+        import httpx
+
+        item = {"question_text": text, "options": ["A", "B", "C", "D"], "correct_answer": "A", "explanation": "A."}
+        body = {"candidates": [{"content": {"parts": [{"text": json.dumps({"questions": [item]})}]}}]}
+        return httpx.Response(200, json=body)
+
+    async def test_slow_request_is_hedged(self):
+        """Test that a straggler gets a duplicate request and the fastest answer wins"""
+        import httpx
+        from app.llm import GeminiClient, LatencyTracker
+        from app.services import parallel_questions_with_llm
+
+        seen = {}
+
+        async def handler(request):
+            variant = next(v for v in range(3) if f"key point number {v + 1}" in request.content.decode())
+            seen[variant] = seen.get(variant, 0) + 1
+            if variant == 2 and seen[variant] == 1:
+                await asyncio.sleep(5)  # straggler
+            return self._single_question_response(f"Question {variant}")
+
+        client = GeminiClient(api_key="test-key", model="test-model")
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        started = asyncio.get_running_loop().time()
+        questions = [
+            q
+            async for q in parallel_questions_with_llm(
+                "A transcript chunk.", client, latency=LatencyTracker(), min_hedge_delay_ms=20
+            )
+        ]
+        elapsed = asyncio.get_running_loop().time() - started
+
+        assert sorted(q.questionText for q in questions) == ["Question 0", "Question 1", "Question 2"]
+        assert seen == {0: 1, 1: 1, 2: 2}
+        assert elapsed < 1
+        await client.close()
+
+    async def test_malformed_item_only_retries_its_own_request(self):
+        """Test that one bad item is retried instead of failing the whole generation"""
+        import httpx
+        from app.llm import GeminiClient, LatencyTracker
+        from app.services import parallel_questions_with_llm
+
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            if len(calls) == 1:
+                return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": "not json"}]}}]})
+            return self._single_question_response("Valid question")
+
+        client = GeminiClient(api_key="test-key", model="test-model")
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        questions = [
+            q
+            async for q in parallel_questions_with_llm(
+                "A transcript chunk.", client, latency=LatencyTracker(), min_hedge_delay_ms=10_000
+            )
+        ]
+
+        assert len(questions) == 3
+        assert len(calls) == 4
+        await client.close()
+
+    async def test_exhausted_retry_does_not_spin(self):
+        """Test that a slow retry with no attempts left is awaited, not polled, once its hedge is due"""
+        import httpx
+        from unittest.mock import patch
+        from app.llm import GeminiClient, LatencyTracker
+        from app.services import parallel_questions_with_llm
+
+        seen = {}
+
+        async def handler(request):
+            variant = next(v for v in range(3) if f"key point number {v + 1}" in request.content.decode())
+            seen[variant] = seen.get(variant, 0) + 1
+            if variant == 0 and seen[variant] == 1:
+                return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": "not json"}]}}]})
+            if variant == 0:
+                await asyncio.sleep(0.5)  # slow retry, past its hedge delay
+            return self._single_question_response(f"Question {variant}")
+
+        client = GeminiClient(api_key="test-key", model="test-model")
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        wait_calls = 0
+        real_wait = asyncio.wait
+
+        async def counting_wait(*args, **kwargs):
+            nonlocal wait_calls
+            wait_calls += 1
+            return await real_wait(*args, **kwargs)
+
+        with patch("app.services.asyncio.wait", counting_wait):
+            questions = [
+                q
+                async for q in parallel_questions_with_llm(
+                    "A transcript chunk.", client, latency=LatencyTracker(), min_hedge_delay_ms=50, max_attempts=2
+                )
+            ]
+
+        assert len(questions) == 3
+        assert seen == {0: 2, 1: 1, 2: 1}
+        assert wait_calls < 20
+        await client.close()
+
+    async def test_cache_is_keyed_on_question_count(self):
+        """Test that a cached set of one count is never served for a request for another"""
+        import httpx
+        from app.llm import GeminiClient, LatencyTracker
+        from app.llm_cache import LLMResponseCache
+        from app.services import parallel_questions_with_llm
+
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return self._single_question_response(f"Question {len(calls)}")
+
+        client = GeminiClient(api_key="test-key", model="test-model")
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        cache = LLMResponseCache()
+
+        async def generate(count):
+            return [
+                q
+                async for q in parallel_questions_with_llm(
+                    "A transcript chunk.", client, count=count, cache=cache, latency=LatencyTracker()
+                )
+            ]
+
+        assert len(await generate(1)) == 1
+        assert len(await generate(3)) == 3
+        assert len(calls) == 4
+        assert len(await generate(3)) == 3
+        assert len(await generate(1)) == 1
+        assert len(calls) == 4
+        await client.close()
+
+    def test_latency_percentile(self):
+        """Test the rolling latency percentile used for hedging"""
+        from app.llm import LatencyTracker
+
+        tracker = LatencyTracker(window=100, min_samples=5)
+        assert tracker.percentile(0.9) is None
+        for latency_ms in range(1, 101):
+            tracker.record(latency_ms)
+        assert tracker.percentile(0.9) == 91
+
+
+@pytest.mark.unit
+class TestChunkSimilarityIndex:
+    """Test near-duplicate transcript chunk detection"""
+
+    LECTURE = (
+        "Gradient descent updates each weight in the direction that reduces the loss, "
+        "using the learning rate to scale the size of every step it takes."
+    )
+
+    async def test_near_duplicate_is_skipped(self):
+        """Test that a chunk differing only in a few words is reported as a duplicate"""
+        from app.similarity import ChunkSimilarityIndex
+
+        index = ChunkSimilarityIndex(threshold=0.7)
+        assert await index.check_and_add("s1", self.LECTURE) == (False, 0.0)
+
+        is_duplicate, similarity = await index.check_and_add("s1", self.LECTURE.upper() + " Okay.")
+        assert is_duplicate
+        assert similarity >= 0.7
+
+    async def test_new_topic_and_other_sessions_are_not_duplicates(self):
+        """Test that different content, or the same content in another session, is not skipped"""
+        from app.similarity import ChunkSimilarityIndex
+
+        index = ChunkSimilarityIndex(threshold=0.7)
+        await index.check_and_add("s1", self.LECTURE)
+
+        is_duplicate, _ = await index.check_and_add(
+            "s1", "Convolutional networks share filter weights across positions of an image to detect local features."
+        )
+        assert not is_duplicate
+        assert not (await index.check_and_add("s2", self.LECTURE))[0]
+
+        index.discard("s1")
+        assert not (await index.check_and_add("s1", self.LECTURE))[0]
+
+    async def test_window_forgets_old_chunks(self):
+        """Test that only the most recent chunks are compared against"""
+        from app.similarity import ChunkSimilarityIndex
+
+        index = ChunkSimilarityIndex(threshold=0.7, window=2)
+        await index.check_and_add("s1", self.LECTURE)
+        await index.check_and_add("s1", "Backpropagation applies the chain rule layer by layer from the output backwards.")
+        await index.check_and_add("s1", "Regularization such as dropout randomly disables units to reduce overfitting.")
+
+        assert not (await index.check_and_add("s1", self.LECTURE))[0]
+        assert index.metrics()["checked"] == 4
+
+    async def test_signature_is_computed_off_the_event_loop(self):
+        """Test that hashing a chunk runs on a worker thread, not the loop thread"""
+        import threading
+        from app.similarity import ChunkSimilarityIndex
+
+        index = ChunkSimilarityIndex(threshold=0.7)
+        threads = []
+        compute = index.signature
+
+        def recording_signature(chunk):
+            threads.append(threading.get_ident())
+            return compute(chunk)
+
+        index.signature = recording_signature
+        await index.check_and_add("s1", self.LECTURE)
+        assert threads and threads[0] != threading.get_ident()
+
+
+@pytest.mark.unit
+class TestTranscriptStore:
+    """Test the rolling transcript window and token-budgeted prompt assembly"""
+
+    def test_window_evicts_oldest_segments(self):
+        """Test that the window stays within its segment and character limits"""
+        from app.transcripts import TranscriptWindow
+
+        window = TranscriptWindow(max_segments=3, max_chars=1000)
+        for i in range(5):
+            window.append(f"segment {i}")
+        assert len(window) == 3
+
+        window = TranscriptWindow(max_segments=100, max_chars=25)
+        for i in range(5):
+            window.append(f"segment {i}")
+        assert window.chars <= 25
+        assert window.context_before("new chunk", 100) == "segment 3 segment 4"
+
+    def test_context_excludes_chunk_and_fits_budget(self):
+        """Test that context is the newest earlier speech, within budget, without repeating the chunk"""
+        from app.transcripts import TranscriptStore, estimate_tokens
+
+        store = TranscriptStore()
+        for i in range(50):
+            store.append("s1", f"Earlier point number {i} about neural networks.")
+        store.append("s1", "The current chunk about transformers.")
+
+        chunk, context = store.build_prompt_transcript("s1", "The current chunk about transformers.", 60)
+
+        assert chunk == "The current chunk about transformers."
+        assert "transformers" not in context
+        assert context.endswith("Earlier point number 49 about neural networks.")
+        assert "number 0 " not in context
+        assert estimate_tokens(chunk) + estimate_tokens(context) <= 60
+
+    def test_oversized_chunk_keeps_most_recent_speech(self):
+        """Test that a chunk larger than the budget is trimmed from the front and gets no context"""
+        from app.transcripts import TranscriptStore
+
+        store = TranscriptStore()
+        store.append("s1", "Some earlier context.")
+        chunk, context = store.build_prompt_transcript("s1", "x" * 1000 + " final words", 10)
+
+        assert chunk.endswith("final words")
+        assert len(chunk) <= 40
+        assert context == ""
+
+    async def test_idle_sessions_are_evicted(self):
+        """Test that transcript windows and chunk indexes of abandoned sessions are freed"""
+        from app.similarity import ChunkSimilarityIndex
+        from app.transcripts import TranscriptStore
+
+        store = TranscriptStore(idle_seconds=0.05)
+        index = ChunkSimilarityIndex(idle_seconds=0.05)
+        store.append("abandoned", "Some speech nobody ends.")
+        await index.check_and_add("abandoned", "Some speech nobody ends.")
+
+        await asyncio.sleep(0.1)
+        store.append("live", "A session that is still talking.")
+        await index.check_and_add("live", "A session that is still talking.")
+
+        assert store.metrics()["sessions"] == 1
+        assert store.metrics()["evicted_idle"] == 1
+        assert index.metrics()["sessions"] == 1
+        assert index.metrics()["evicted_idle"] == 1
+
+    def test_context_is_background_in_prompt(self):
+        """Test that context is only added to the prompt when present"""
+        from app.services import build_question_payload
+
+        without = build_question_payload("Chunk text.")["contents"][0]["parts"][0]["text"]
+        with_context = build_question_payload("Chunk text.", context="Earlier text.")["contents"][0]["parts"][0]["text"]
+
+        assert "Earlier text." not in without
+        assert "Earlier in the lecture" in with_context
+        assert with_context.index("Chunk text.") < with_context.index("Earlier text.")
+
+
+@pytest.mark.unit
+class TestFairRateLimiter:
+    """Test the process-wide Gemini rate limiter"""
+
+    async def test_burst_then_rate_limited(self):
+        """Test that requests within the burst go immediately and the rest are spaced out"""
+        from app.rate_limit import FairRateLimiter
+
+        limiter = FairRateLimiter(rate_per_second=100, burst=2)
+        await limiter.acquire("s1")
+        await limiter.acquire("s1")
+        assert limiter.queued == 0
+
+        await limiter.acquire("s1")
+        metrics = limiter.metrics()
+        assert metrics["queued"] == 1
+        assert metrics["granted"] == 3
+        assert metrics["max_wait_ms"] > 0
+
+    async def test_fair_across_sessions_and_priority_first(self):
+        """Test that a busy session does not starve others and interactive requests go first"""
+        from app.rate_limit import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, FairRateLimiter
+
+        limiter = FairRateLimiter(rate_per_second=200, burst=1)
+        await limiter.acquire("warmup")
+        order = []
+
+        async def request(session_id, priority):
+            await limiter.acquire(session_id, priority)
+            order.append(session_id)
+
+        tasks = [asyncio.create_task(request("busy", PRIORITY_BACKGROUND)) for _ in range(4)]
+        tasks.append(asyncio.create_task(request("quiet", PRIORITY_BACKGROUND)))
+        tasks.append(asyncio.create_task(request("lecturer", PRIORITY_INTERACTIVE)))
+        await asyncio.gather(*tasks)
+
+        assert order[0] == "lecturer"
+        assert order.index("quiet") <= 2
+        assert limiter.metrics()["queue_depth"] == 0
+
+    async def test_weights_share_slots_proportionally(self):
+        """Test that a session of weight 2 from the request scope gets twice the slots of a weight-1 session"""
+        from app.rate_limit import FairRateLimiter, llm_request_scope
+
+        limiter = FairRateLimiter(rate_per_second=500, burst=1)
+        await limiter.acquire("warmup")
+        order = []
+
+        async def request(session_id, weight):
+            with llm_request_scope(session_id, weight=weight):
+                await limiter.acquire()
+            order.append(session_id)
+
+        tasks = [asyncio.create_task(request("heavy", 2.0)) for _ in range(8)]
+        tasks += [asyncio.create_task(request("light", 1.0)) for _ in range(8)]
+        await asyncio.gather(*tasks)
+
+        assert order[:9].count("heavy") == 6
+        with pytest.raises(ValueError):
+            with llm_request_scope("s1", weight=0):
+                pass
+
+    async def test_scope_and_timeout(self):
+        """Test that requests pick up the current scope and give up after max_wait"""
+        from app.rate_limit import PRIORITY_INTERACTIVE, FairRateLimiter, RateLimitExceeded, llm_request_scope
+
+        limiter = FairRateLimiter(rate_per_second=0.001, burst=1, max_wait=0.05)
+        with llm_request_scope("s1", PRIORITY_INTERACTIVE):
+            await limiter.acquire()
+            with pytest.raises(RateLimitExceeded):
+                await limiter.acquire()
+        assert limiter.metrics()["timeouts"] == 1
+
+    async def test_429_pauses_limiter(self):
+        """Test that a 429 from Gemini pauses the limiter for Retry-After seconds"""
+        import httpx
+        from app.llm import GeminiClient
+        from app.rate_limit import FairRateLimiter
+
+        def handler(request):
+            return httpx.Response(429, headers={"Retry-After": "2"}, json={})
+
+        limiter = FairRateLimiter(rate_per_second=100, burst=5)
+        client = GeminiClient(api_key="test-key", model="test-model", limiter=limiter)
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.generate_content({})
+        assert limiter.metrics()["throttled"] == 1
+        assert limiter.queue_depth() == 0
+        await client.close()
+
+
+@pytest.mark.unit
+class TestCircuitBreaker:
+    """Test the Gemini circuit breaker and the local question fallback"""
+
+    def test_opens_on_failure_rate_and_recovers_via_probe(self):
+        """Test closed -> open -> half-open -> closed transitions"""
+        from app.circuit_breaker import CircuitBreaker
+
+        breaker = CircuitBreaker(failure_rate_threshold=0.5, window=4, min_calls=4, open_seconds=0.05)
+        breaker.record_success(100)
+        breaker.record_success(100)
+        breaker.record_failure()
+        assert breaker.state == "closed"
+        breaker.record_failure()
+        assert breaker.is_open
+        assert not breaker.allow_request()
+
+        import time
+
+        time.sleep(0.06)
+        assert breaker.state == "half_open"
+        assert breaker.allow_request()
+        assert not breaker.allow_request()  # only one probe at a time
+        breaker.record_success(100)
+        assert breaker.state == "closed"
+
+    def test_slow_calls_count_as_failures_and_failed_probe_reopens(self):
+        """Test that slow calls trip the breaker and a failed probe opens it again"""
+        from app.circuit_breaker import CircuitBreaker
+
+        breaker = CircuitBreaker(slow_call_ms=1000, window=2, min_calls=2, open_seconds=0)
+        breaker.record_success(5000)
+        breaker.record_success(5000)
+        assert breaker.times_opened == 1
+
+        assert breaker.allow_request()
+        breaker.record_failure()
+        assert breaker.times_opened == 2
+
+    async def test_client_fails_fast_while_open(self):
+        """Test that an open breaker rejects requests without calling Gemini"""
+        import httpx
+        from app.circuit_breaker import CircuitBreaker, CircuitOpenError
+        from app.llm import GeminiClient
+
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(503, json={})
+
+        breaker = CircuitBreaker(window=2, min_calls=2, open_seconds=60)
+        client = GeminiClient(api_key="test-key", model="test-model", breaker=breaker)
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        for _ in range(2):
+            with pytest.raises(httpx.HTTPStatusError):
+                await client.generate_content({})
+        with pytest.raises(CircuitOpenError):
+            await client.generate_content({})
+
+        assert len(calls) == 2
+        assert breaker.metrics()["rejected"] == 1
+        await client.close()
+
+    def test_local_cloze_questions(self):
+        """Test that the local generator builds valid fill-in-the-blank questions"""
+        from app.local_questions import BLANK, generate_cloze_questions
+
+        transcript = (
+            "Photosynthesis converts light energy into chemical energy inside chloroplasts. "
+            "Chlorophyll absorbs mostly blue and red wavelengths of visible light. "
+            "The Calvin cycle fixes carbon dioxide into sugar using ATP and NADPH. "
+            "Mitochondria then release that stored energy through cellular respiration."
+        )
+        questions = generate_cloze_questions(transcript)
+
+        assert len(questions) == 3
+        assert generate_cloze_questions(transcript)[0].questionText == questions[0].questionText
+        for question in questions:
+            assert BLANK in question.questionText
+            assert question.correctAnswer in question.options
+            assert len(set(question.options)) == 4
+            assert question.generatedBy == "local"
+
+        assert generate_cloze_questions("Too short.") == []
+
+
+@pytest.mark.unit
+class TestSessionTTLStore:
+    """Test the bounded, session-indexed TTL store used for pending question options"""
+
+    def test_ttl_expiry(self):
+        """Test that entries expire after their TTL"""
+        import time
+        from app.ttl_store import SessionTTLStore
+
+        store = SessionTTLStore(ttl_seconds=0.02)
+        store.put("chunk-1", "s1", {"questions": []})
+        assert "chunk-1" in store
+        time.sleep(0.03)
+        assert "chunk-1" not in store
+        assert store.get("chunk-1") is None
+        assert store.metrics()["expired"] == 1
+
+    def test_per_session_and_global_caps(self):
+        """Test that the oldest entry of a session, or overall, is evicted first"""
+        from app.ttl_store import SessionTTLStore
+
+        store = SessionTTLStore(max_entries=3, max_per_session=2)
+        store.put("a1", "a", 1)
+        store.put("a2", "a", 2)
+        store.put("a3", "a", 3)
+        assert store.session_keys("a") == ["a2", "a3"]
+
+        store.put("b1", "b", 1)
+        store.put("b2", "b", 2)
+        assert "a2" not in store
+        assert len(store) == 3
+        assert store.metrics()["evicted"] == 2
+
+    def test_discard_session(self):
+        """Test that ending a session drops all of its entries and nothing else"""
+        from app.ttl_store import SessionTTLStore
+
+        store = SessionTTLStore()
+        store.put("a1", "a", 1)
+        store.put("a2", "a", 2)
+        store.put("b1", "b", 1)
+
+        assert store.discard_session("a") == 2
+        assert store.get("a1") is None
+        assert store.get("b1") == 1
+        assert store.pop("b1") == 1
+        assert store.metrics()["sessions"] == 0
+
+
+@pytest.mark.unit
+class TestQuestionCache:
+    """Test the per-session question cache used for answer grading"""
+
+    async def test_written_questions_need_no_reads(self):
+        """Test that questions put by the writer or listener are served without Firestore"""
+        from app.question_cache import QuestionCache
+
+        repository = Mock()
+        repository.get_question = AsyncMock(return_value=None)
+        cache = QuestionCache(repository)
+        cache.put("s1", "q1", {"questionText": "What is AI?", "correctAnswer": "A"})
+
+        for _ in range(500):
+            assert (await cache.get("s1", "q1"))["correctAnswer"] == "A"
+        repository.get_question.assert_not_called()
+
+    async def test_concurrent_misses_share_one_read(self):
+        """Test that a burst of answers for an unseen question costs a single Firestore read"""
+        from app.question_cache import QuestionCache
+
+        async def slow_get(session_id, question_id):
+            await asyncio.sleep(0.01)
+            return {"questionText": "Late question", "correctAnswer": "B"}
+
+        repository = Mock()
+        repository.get_question = AsyncMock(side_effect=slow_get)
+        cache = QuestionCache(repository)
+
+        results = await asyncio.gather(*(cache.get("s1", "q9") for _ in range(50)))
+        assert all(result["correctAnswer"] == "B" for result in results)
+        assert repository.get_question.await_count == 1
+
+        await cache.get("s1", "q9")
+        cache.discard_session("s1")
+        await cache.get("s1", "q9")
+        assert cache.metrics()["firestore_reads"] == 2
+
+    async def test_track_answer_uses_given_question_text(self, mock_firestore_client):
+        """Test that answer tracking does not re-fetch the question when the caller has it"""
+        from app.analytics import AnalyticsService
+
+        repository = Mock()
+        repository.get_question = AsyncMock()
+        service = AnalyticsService(mock_firestore_client, Mock(), event_sink=Mock(add=AsyncMock()), repository=repository)
+        service.coalescer.mark_dirty = AsyncMock()
+        await service.track_student_join("s1", "alice", "Alice")
+
+        await service.track_answer_submitted("s1", "alice", "q1", "A", "A", 500, question_text="What is AI?")
+
+        repository.get_question.assert_not_called()
+        assert (await service.state.get_student_answers("s1", "alice"))[0]["question_text"] == "What is AI?"
+
+
+@pytest.mark.unit
+class TestSessionCache:
+    """Test the session document cache"""
+
+    @staticmethod
+    def _repository(sessions):
+        repository = Mock()
+        repository.get_session = AsyncMock(side_effect=lambda session_id: sessions.get(session_id))
+        return repository
+
+    async def test_created_sessions_need_no_reads(self):
+        """Test that a session put at creation is served from memory, with explicit updates applied"""
+        from app.session_cache import SessionCache
+
+        repository = self._repository({})
+        cache = SessionCache(repository)
+        cache.put("ABC123", {"answerTimeSeconds": 45, "status": "active"})
+
+        assert await cache.exists("ABC123")
+        cache.update("ABC123", {"status": "ended"})
+        assert (await cache.get("ABC123")) == {"answerTimeSeconds": 45, "status": "ended"}
+        assert cache.get_cached("ABC123")["answerTimeSeconds"] == 45
+        repository.get_session.assert_not_called()
+
+    async def test_unknown_codes_are_negatively_cached(self):
+        """Test that bogus session codes cost one read until the negative entry expires"""
+        from app.session_cache import SessionCache
+
+        repository = self._repository({})
+        cache = SessionCache(repository, negative_ttl_seconds=60)
+
+        for _ in range(20):
+            assert not await cache.exists("NOPE00")
+        assert repository.get_session.await_count == 1
+        assert cache.metrics()["negative_hits"] == 19
+
+        # Creating the session replaces the negative entry
+        cache.put("NOPE00", {"status": "active"})
+        assert await cache.exists("NOPE00")
+
+    async def test_writes_keep_entry_current_without_a_watch(self):
+        """Test that explicit writes update the entry, the TTL bounds staleness and no document watch is opened"""
+        from app.session_cache import SessionCache
+
+        repository = self._repository({"ABC123": {"answerTimeSeconds": 30, "status": "active"}})
+        cache = SessionCache(repository, ttl_seconds=0.05)
+        await cache.get("ABC123")
+
+        cache.update("ABC123", {"status": "ended"})
+        assert (await cache.get("ABC123"))["status"] == "ended"
+        assert repository.get_session.await_count == 1
+
+        await asyncio.sleep(0.1)
+        assert (await cache.get("ABC123"))["status"] == "active"
+        assert repository.get_session.await_count == 2
+        repository.watch_session.assert_not_called()
+
+
+@pytest.mark.unit
+class TestSharedQuestionListener:
+    """Test the single collection-group listener shared by all sessions"""
+
+    @staticmethod
+    def _change(session_id, question_id):
+        change = Mock()
+        change.type.name = "ADDED"
+        change.document.id = question_id
+        change.document.reference.parent.parent.id = session_id
+        change.document.to_dict.return_value = {"id": question_id, "questionText": "Q?"}
+        return change
+
+    def test_one_stream_routes_changes_by_session(self):
+        """Test that many sessions share one watch and each change reaches only its session"""
+        from app.listeners import SharedQuestionListener
+
+        repository = Mock()
+        routed = []
+        listener = SharedQuestionListener(repository, lambda session_id, changes: routed.append((session_id, changes)))
+        for session_id in ("s1", "s2", "s3"):
+            listener.register(session_id)
+        listener.unregister("s3")
+
+        assert repository.watch_questions_since.call_count == 1
+        on_snapshot = repository.watch_questions_since.call_args[0][1]
+        on_snapshot(None, [self._change("s1", "q1"), self._change("s2", "q2"), self._change("s1", "q3")], None)
+        on_snapshot(None, [self._change("s3", "q4"), self._change("other", "q5")], None)
+
+        assert [(session_id, [c.document.id for c in changes]) for session_id, changes in routed] == [
+            ("s1", ["q1", "q3"]),
+            ("s2", ["q2"]),
+        ]
+        assert listener.metrics() == {
+            "streams": 1,
+            "sessions": 2,
+            "snapshots": 2,
+            "changes_routed": 3,
+            "changes_ignored": 2,
+        }
+
+    async def test_session_manager_uses_shared_listener(self, mock_firestore_client):
+        """Test that starting listeners in shared mode never opens per-session watches"""
+        from app.services import SessionManager
+
+        repository = Mock()
+        manager = SessionManager(mock_firestore_client, repository=repository, listener_mode="shared")
+        manager.start_listener("s1")
+        manager.start_listener("s2")
+
+        repository.watch_questions.assert_not_called()
+        assert repository.watch_questions_since.call_count == 1
+        manager.remove_listener("s1")
+        assert not manager.shared_listener.is_registered("s1")
+        await manager.close_listeners()
+        repository.watch_questions_since.return_value.unsubscribe.assert_called_once()
+
+    async def test_stopped_shared_watch_falls_back_to_session_watches(self, mock_firestore_client):
+        """Test that sessions move to their own watches when the shared watch fails or stops"""
+        from app.services import SessionManager
+
+        repository = Mock()
+        manager = SessionManager(mock_firestore_client, repository=repository, listener_mode="shared")
+        manager.start_listener("s1")
+        manager.start_listener("s2")
+        manager.check_listeners()
+        repository.watch_questions.assert_not_called()
+
+        repository.watch_questions_since.return_value.is_active = False
+        manager.check_listeners()
+        assert manager.listener_mode == "per_session"
+        assert sorted(call.args[0] for call in repository.watch_questions.call_args_list) == ["s1", "s2"]
+        assert manager.has_listener("s1") and not manager.shared_listener.is_registered("s1")
+        repository.watch_questions_since.return_value.unsubscribe.assert_called_once()
+        assert manager.metrics()["listener_fallbacks"] == 1
+        await manager.close_listeners()
+
+    async def test_shared_watch_that_cannot_start_falls_back(self, mock_firestore_client):
+        """Test that an error starting the shared watch leaves the session on its own watch"""
+        from app.services import SessionManager
+
+        repository = Mock()
+        repository.watch_questions_since.side_effect = RuntimeError("FAILED_PRECONDITION: index exemption missing")
+        manager = SessionManager(mock_firestore_client, repository=repository, listener_mode="shared")
+        manager.start_listener("s1")
+
+        assert manager.listener_mode == "per_session"
+        repository.watch_questions.assert_called_once()
+        assert manager.has_listener("s1")
+        await manager.close_listeners()
+
+    async def test_per_session_watch_skips_initial_snapshot(self, mock_firestore_client):
+        """Test that a (re-)attached per-session watch does not replay existing questions"""
+        from app.services import SessionManager
+
+        repository = Mock()
+        manager = SessionManager(mock_firestore_client, repository=repository, listener_mode="per_session")
+        manager.listener_bridge.submit = Mock()
+        manager.session_cache.put("s1", {"answerTimeSeconds": 20})
+        manager.start_listener("s1")
+        manager.start_listener("s1")
+        assert repository.watch_questions.call_count == 1
+        on_snapshot = repository.watch_questions.call_args[0][1]
+
+        on_snapshot(None, [self._change("s1", "q1"), self._change("s1", "q2")], None)
+        manager.listener_bridge.submit.assert_not_called()
+        on_snapshot(None, [self._change("s1", "q3")], None)
+        manager.listener_bridge.submit.assert_called_once()
+        assert manager.listener_bridge.submit.call_args[0][0][1]["question"]["id"] == "q3"
+        await manager.close_listeners()
+
+
+@pytest.mark.unit
+class TestLoopBridge:
+    """Test the hand-off from Firestore listener threads to the event loop"""
+
+    async def test_items_from_threads_arrive_in_order_and_batched(self):
+        """Test that a burst from another thread is delivered in order with few loop wakeups"""
+        import threading
+        from app.loop_bridge import LoopBridge
+
+        received = []
+        batch_sizes = []
+
+        async def handler(batch):
+            batch_sizes.append(len(batch))
+            received.extend(batch)
+
+        bridge = LoopBridge(handler, max_batch=50)
+        bridge.bind()
+
+        producer = threading.Thread(target=lambda: [bridge.submit(i) for i in range(200)])
+        producer.start()
+        producer.join()
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+            if len(received) == 200:
+                break
+
+        assert received == list(range(200))
+        assert max(batch_sizes) <= 50
+        assert bridge.metrics()["batches"] < 200
+        await bridge.close()
+
+    async def test_full_buffer_applies_backpressure_then_drops(self):
+        """Test that producers wait for space and drop only after the timeout"""
+        from app.loop_bridge import LoopBridge
+
+        bridge = LoopBridge(AsyncMock(), max_pending=2, put_timeout=0.01)
+        assert bridge.submit("a") and bridge.submit("b")
+        assert not bridge.submit("c")
+
+        metrics = bridge.metrics()
+        assert metrics["depth"] == 2
+        assert metrics["producer_waits"] == 1
+        assert metrics["dropped"] == 1
+
+    async def test_listener_thread_broadcast_uses_main_loop(self, mock_firestore_client):
+        """Test that a snapshot change on a listener thread is broadcast on the event loop"""
+        import threading
+        from app.services import SessionManager
+
+        manager = SessionManager(mock_firestore_client, repository=Mock(), listener_mode="shared")
+        manager.session_cache.put("s1", {"answerTimeSeconds": 45})
+        manager.broadcast = AsyncMock()
+        manager.start_listener("s1")
+
+        change = Mock()
+        change.type.name = "ADDED"
+        change.document.id = "q1"
+        change.document.to_dict.return_value = {"id": "q1", "questionText": "Q?"}
+        listener_thread = threading.Thread(target=manager._on_question_changes, args=("s1", [change]))
+        listener_thread.start()
+        listener_thread.join()
+        await asyncio.sleep(0.01)
+
+        session_id, message = manager.broadcast.await_args[0]
+        assert session_id == "s1"
+        assert message["answerTimeSeconds"] == 45
+        assert message["question"]["id"] == "q1"
+        await manager.close_listeners()
+
+
+@pytest.mark.unit
+class TestSessionStateStore:
+    """Test that the in-process and Redis state stores behave the same"""
+
+    @pytest.fixture(params=["memory", "redis"])
+    def store(self, request):
+        from app.state_store import InMemoryStateStore, RedisStateStore
+
+        if request.param == "memory":
+            return InMemoryStateStore(question_options_max_per_session=2)
+        fakeredis = pytest.importorskip("fakeredis")
+        return RedisStateStore(
+            client=fakeredis.FakeAsyncRedis(decode_responses=True), question_options_max_per_session=2
+        )
+
+    async def test_scores_rank_ties_to_first_joiner(self, store):
+        """Test that rank order is score descending with ties going to whoever joined first"""
+        for student_id in ("alice", "bob", "carol"):
+            await store.add_student("s1", student_id, student_id.title())
+        correct = {"is_correct": True, "points_earned": 120}
+        await store.record_answer("s1", "carol", correct, 400)
+        await store.record_answer("s1", "bob", {"is_correct": False, "points_earned": 0}, 900)
+        await store.record_answer("s1", "ghost", correct, 100)
+
+        ranked = await store.ranked_students("s1")
+        assert [student_id for student_id, _ in ranked] == ["carol", "alice", "bob"]
+        assert ranked[0][1] == {"score": 120, "correct_answers": 1, "total_answers": 1, "total_response_time": 400}
+        assert [student_id for student_id, _ in await store.ranked_students("s1", limit=2)] == ["carol", "alice"]
+        assert await store.student_rank("s1", "bob") == 3
+        assert await store.student_rank("s1", "ghost") == 0
+        assert await store.student_count("s1") == 3
+        assert (await store.get_student_answers("s1", "carol"))[0]["points_earned"] == 120
+        assert await store.student_names("s1") == {"alice": "Alice", "bob": "Bob", "carol": "Carol"}
+
+    async def test_rejoin_keeps_score_and_tracks_active_set(self, store):
+        """Test that a returning student keeps their score while the active set follows joins and leaves"""
+        await store.add_student("s1", "alice")
+        await store.add_student("s1", "bob")
+        await store.record_answer("s1", "alice", {"is_correct": True, "points_earned": 100}, None)
+        await store.remove_active_student("s1", "alice")
+        assert await store.active_student_count("s1") == 1
+
+        await store.add_student("s1", "alice")
+        assert await store.active_student_count("s1") == 2
+        assert (await store.get_student_score("s1", "alice"))["score"] == 100
+        assert await store.student_count("s1") == 2
+
+    async def test_stats_and_clear_session(self, store):
+        """Test that stats accumulate and clearing a session drops all of its state"""
+        from datetime import datetime, timezone
+
+        started = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        await store.set_session_start("s1", started)
+        await store.add_student("s1", "alice")
+        await store.increment_stats("s1", answers=1, correct_answers=1)
+        await store.increment_stats("s1", answers=1, correct_answers=0)
+        assert await store.get_stats("s1") == {"answers": 2, "correct_answers": 1}
+        assert await store.get_session_start("s1") == started
+
+        await store.clear_session("s1")
+        assert await store.get_stats("s1") == {}
+        assert await store.get_session_start("s1") is None
+        assert await store.ranked_students("s1") == []
+        assert await store.active_student_count("s1") == 0
+
+    async def test_question_options_roundtrip_and_cap(self, store):
+        """Test that option sets round-trip, pop once, and are capped per session"""
+        from app.schemas import FirestoreQuestion
+
+        question = FirestoreQuestion(
+            questionText="Q?", options=["A", "B", "C", "D"], correctAnswer="A", explanation="", generatedBy="AI"
+        )
+        for chunk_id in ("c1", "c2", "c3"):
+            await store.put_question_options(
+                chunk_id, "s1", {"session_id": "s1", "questions": [question], "transcript_chunk": "text"}
+            )
+
+        assert not await store.has_question_options("c1", "s1")
+        options = await store.get_question_options("c3", "s1")
+        assert options["questions"][0].questionText == "Q?"
+        assert await store.get_question_options("c3", "s2") is None
+        assert (await store.pop_question_options("c3", "s1"))["transcript_chunk"] == "text"
+        assert await store.pop_question_options("c3", "s1") is None
+        assert await store.has_question_options("c2", "s1")
+
+    async def test_replacing_options_never_recreates_a_selected_set(self, store):
+        """Test that a conditional replace updates a waiting set but not one already popped"""
+        from app.schemas import FirestoreQuestion
+
+        question = FirestoreQuestion(
+            questionText="Q?", options=["A", "B", "C", "D"], correctAnswer="A", explanation="", generatedBy="AI"
+        )
+        options = {"session_id": "s1", "questions": [question], "transcript_chunk": "text"}
+        assert await store.put_question_options("c1", "s1", options)
+        grown = {**options, "questions": [question, question]}
+        assert await store.put_question_options("c1", "s1", grown, only_if_present=True)
+        assert len((await store.get_question_options("c1", "s1"))["questions"]) == 2
+
+        await store.pop_question_options("c1", "s1")
+        assert not await store.put_question_options("c1", "s1", grown, only_if_present=True)
+        assert not await store.has_question_options("c1", "s1")
+
+    async def test_writes_refresh_the_ttl_of_every_session_key(self):
+        """Test that an answer keeps the rank, score and other session keys alive, not just the answer list"""
+        fakeredis = pytest.importorskip("fakeredis")
+        from app.state_store import RedisStateStore
+
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        store = RedisStateStore(client=client, session_ttl_seconds=100)
+        await store.add_student("s1", "alice", "Alice")
+        for key in await client.keys("*"):
+            await client.expire(key, 5)
+
+        answer = {"question_id": "q1", "is_correct": True, "points_earned": 100}
+        await store.record_answer("s1", "alice", answer, 900)
+        ttls = {key: await client.ttl(key) for key in await client.keys("*")}
+        assert {"qwiz:{s1}:rank", "qwiz:{s1}:score:alice", "qwiz:{s1}:names", "qwiz:{s1}:active"} <= set(ttls)
+        assert all(ttl > 5 for ttl in ttls.values())
+
+    async def test_clear_session_removes_every_session_key(self):
+        """Test that clearing a Redis session deletes all of its keys, and only its keys, without a scan"""
+        fakeredis = pytest.importorskip("fakeredis")
+        from app.schemas import FirestoreQuestion
+        from app.state_store import RedisStateStore
+
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        store = RedisStateStore(client=client)
+        question = FirestoreQuestion(
+            questionText="Q?", options=["A", "B", "C", "D"], correctAnswer="A", explanation="", generatedBy="AI"
+        )
+        for session_id in ("s1", "s2"):
+            await store.add_student(session_id, "alice", "Alice")
+            answer = {"question_id": "q1", "is_correct": True, "points_earned": 100}
+            await store.record_answer(session_id, "alice", answer, 900)
+            await store.increment_stats(session_id, answers=1)
+            await store.set_session_start(session_id, datetime.now(timezone.utc))
+            await store.put_question_options(
+                "c1", session_id, {"session_id": session_id, "questions": [question], "transcript_chunk": "text"}
+            )
+        assert all("{s1}" in key or "{s2}" in key for key in await client.keys("*"))
+
+        client.scan_iter = Mock(side_effect=AssertionError("clear_session must not scan"))
+        await store.clear_session("s1")
+        remaining = await client.keys("*")
+        assert remaining
+        assert all("{s2}" in key for key in remaining)
+
+
+@pytest.mark.unit
+class TestBroadcastBackplane:
+    """Test cross-worker broadcast through the pub/sub backplane"""
+
+    @staticmethod
+    def _socket():
+        ws = Mock()
+        ws.accept = AsyncMock()
+        ws.send_text = AsyncMock()
+        return ws
+
+    async def test_broadcast_reaches_sockets_on_other_workers_once(self):
+        """Test that a broadcast is published once and each worker fans it out to its own sockets"""
+        from app.backplane import InMemoryBackplane, InMemoryBroker
+        from app.services import SessionManager
+
+        broker = InMemoryBroker()
+        worker_a = SessionManager(db_client=Mock(), backplane=InMemoryBackplane(broker))
+        worker_b = SessionManager(db_client=Mock(), backplane=InMemoryBackplane(broker))
+        lecturer, student_a, student_b = self._socket(), self._socket(), self._socket()
+        await worker_a.connect("s1", lecturer, "lecturer")
+        await worker_a.connect("s1", student_a, "student")
+        await worker_b.connect("s1", student_b, "student")
+
+        await worker_a.broadcast("s1", {"type": "new_question"})
+        await worker_b.broadcast_to_lecturers("s1", {"type": "student_answered"})
+        await asyncio.sleep(0.01)
+
+        assert [call.args[0] for call in lecturer.send_text.await_args_list] == [
+            '{"type":"new_question"}',
+            '{"type":"student_answered"}',
+        ]
+        student_a.send_text.assert_awaited_once_with('{"type":"new_question"}')
+        student_b.send_text.assert_awaited_once_with('{"type":"new_question"}')
+        assert worker_a.backplane.metrics()["published"] == 1
+        assert worker_a.backplane.metrics()["own_skipped"] == 1
+
+        for manager in (worker_a, worker_b):
+            await manager.close_listeners()
+
+    async def test_send_to_student_on_other_worker(self):
+        """Test that a personal message is relayed to the worker holding the student's socket"""
+        from app.backplane import InMemoryBackplane, InMemoryBroker
+        from app.services import SessionManager
+
+        broker = InMemoryBroker()
+        worker_a = SessionManager(db_client=Mock(), backplane=InMemoryBackplane(broker))
+        worker_b = SessionManager(db_client=Mock(), backplane=InMemoryBackplane(broker))
+        alice, bob = self._socket(), self._socket()
+        await worker_b.connect("s1", alice, "student")
+        await worker_b.connect("s1", bob, "student")
+        worker_b.register_student("s1", "Alice", alice)
+        worker_b.register_student("s1", "Bob", bob)
+
+        # Relayed, so the sender cannot confirm delivery
+        assert await worker_a.send_to_student("s1", "Alice", {"type": "session_ended"}) is None
+        await asyncio.sleep(0.01)
+        alice.send_text.assert_awaited_once_with('{"type":"session_ended"}')
+        bob.send_text.assert_not_awaited()
+
+        # The last local socket leaving releases the channel
+        worker_b.disconnect("s1", alice)
+        worker_b.disconnect("s1", bob)
+        await asyncio.sleep(0)
+        assert worker_b.backplane.metrics()["sessions"] == 0
+        assert not broker._subscribers
+
+    async def test_listener_outlives_its_workers_sockets_until_session_ends(self):
+        """Test that the worker holding the question listener keeps it for sockets on other workers"""
+        from app.backplane import InMemoryBackplane, InMemoryBroker
+        from app.services import SessionManager
+
+        broker = InMemoryBroker()
+        repository = Mock()
+        worker_a = SessionManager(
+            db_client=Mock(), repository=repository, listener_mode="per_session", backplane=InMemoryBackplane(broker)
+        )
+        worker_b = SessionManager(db_client=Mock(), listener_mode="per_session", backplane=InMemoryBackplane(broker))
+        worker_a.session_cache.put("s1", {"answerTimeSeconds": 20})
+        lecturer, student = self._socket(), self._socket()
+        worker_a.start_listener("s1")
+        await worker_a.connect("s1", lecturer, "lecturer")
+        await worker_b.connect("s1", student, "student")
+        on_snapshot = repository.watch_questions.call_args[0][1]
+        on_snapshot(None, [], None)  # Initial snapshot
+
+        # The lecturer's socket (the only one on the listener's worker) goes away
+        worker_a.disconnect("s1", lecturer)
+        await asyncio.sleep(0)
+        assert worker_a.has_listener("s1")
+
+        change = Mock()
+        change.type.name = "ADDED"
+        change.document.id = "q1"
+        change.document.to_dict.return_value = {"id": "q1", "questionText": "Q?"}
+        on_snapshot(None, [change], None)
+        await asyncio.sleep(0.05)
+        assert '"new_question"' in student.send_text.await_args_list[0].args[0]
+
+        # Ending the session on another worker detaches the listener and releases the channel
+        await worker_b.end_listener("s1")
+        await asyncio.sleep(0.01)
+        assert not worker_a.has_listener("s1")
+        repository.watch_questions.return_value.unsubscribe.assert_called_once()
+        assert worker_a.backplane.metrics()["sessions"] == 0
+
+        for manager in (worker_a, worker_b):
+            await manager.close_listeners()
+
+    async def test_redis_backplane_relays_between_workers(self):
+        """Test that two Redis backplanes on one server relay frames to each other"""
+        fakeredis = pytest.importorskip("fakeredis")
+        from app.backplane import RedisBackplane
+
+        server = fakeredis.FakeServer()
+        sender = RedisBackplane(client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+        receiver = RedisBackplane(client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+        received = asyncio.Queue()
+
+        async def handler(session_id, target, student_id, frame_text):
+            await received.put((session_id, target, student_id, frame_text))
+
+        receiver.start(handler)
+        await receiver.subscribe("s1")
+        await sender.subscribe("s1")
+        await sender.publish("s1", '{"type":"new_question"}')
+        await sender.publish("s2", '{"type":"other_session"}')
+
+        assert await asyncio.wait_for(received.get(), 2) == ("s1", "all", None, '{"type":"new_question"}')
+        await asyncio.sleep(0.05)
+        assert received.empty()
+        assert sender.metrics()["received"] == 0
+
+        await sender.close()
+        await receiver.close()
+
+
+@pytest.mark.unit
+class TestSessionSharding:
+    """Test consistent-hash session affinity and the front router"""
+
+    def test_ring_spreads_sessions_and_moves_few_on_join(self):
+        """Test that the ring balances codes and a joining worker only takes its own share"""
+        from app.sharding import HashRing
+
+        codes = [f"S{i:05d}" for i in range(4000)]
+        ring = HashRing(["w1", "w2", "w3", "w4"])
+        before = {code: ring.node_for(code) for code in codes}
+        counts = {worker: list(before.values()).count(worker) for worker in ring.nodes}
+        assert min(counts.values()) > 700
+
+        ring.add("w5")
+        moved = [code for code in codes if ring.node_for(code) != before[code]]
+        assert all(ring.node_for(code) == "w5" for code in moved)
+        assert 400 < len(moved) < 1300
+
+        ring.remove("w5")
+        assert all(ring.node_for(code) == before[code] for code in codes)
+
+    def test_directory_pins_live_sessions_across_rebalance(self):
+        """Test that live sessions stay on their worker when one joins and move when theirs leaves"""
+        from app.sharding import ShardDirectory
+
+        directory = ShardDirectory(["w1", "w2"], pin_grace_seconds=60)
+        codes = [f"S{i:05d}" for i in range(200)]
+        owners = {code: directory.worker_for(code) for code in codes}
+        for code in codes:
+            directory.connection_opened(code, owners[code])
+
+        directory.add_worker("w3")
+        assert all(directory.worker_for(code) == owners[code] for code in codes)
+
+        moved = directory.remove_worker("w1")
+        assert set(moved) == {code for code in codes if owners[code] == "w1"}
+        assert all(directory.worker_for(code) in ("w2", "w3") for code in moved)
+
+        # Idle pins expire, after which sessions follow the ring again
+        directory.connection_closed("S00000")
+        directory.expire_pins(now=float("inf"))
+        assert directory.worker_for("S00000") == directory.ring.node_for("S00000")
+
+    def test_session_key_from_paths_and_body(self):
+        """Test that the router finds the session code in paths and the selection body"""
+        from app.router import session_key
+
+        assert session_key("/ws/student/ABC123") == "ABC123"
+        assert session_key("/sessions/ABC123/leaderboard") == "ABC123"
+        assert session_key("/select-question", b'{"session_id": "ABC123", "chunk_id": "c"}') == "ABC123"
+        assert session_key("/select-question", b"not json") is None
+        assert session_key("/") is None
+
+    async def test_router_creates_session_on_owner_and_routes_to_it(self):
+        """Test that /start-session lands on the code's owner, retrying taken codes, and later requests follow"""
+        import httpx
+        from app.router import ShardRouter
+
+        seen = []
+
+        def handler(request):
+            worker = f"{request.url.scheme}://{request.url.host}:{request.url.port}"
+            seen.append((worker, request.url.path, request.headers.get("x-session-code")))
+            if request.url.path == "/start-session":
+                if len(seen) == 1:
+                    return httpx.Response(409, json={"detail": "Session code already in use"})
+                return httpx.Response(201, json={"sessionId": request.headers["x-session-code"]})
+            return httpx.Response(200, json={"worker": worker})
+
+        workers = ["http://w1:8081", "http://w2:8082", "http://w3:8083"]
+        router = ShardRouter(workers, client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=router), base_url="http://router")
+
+        response = await client.post("/start-session", json={"lecturer_name": "L", "course_name": "C"})
+        assert response.status_code == 201
+        session_id = response.json()["sessionId"]
+        owner = seen[-1][0]
+        assert owner == router.directory.worker_for(session_id)
+        assert seen[0][2] != session_id
+
+        response = await client.get(f"/sessions/{session_id}/leaderboard")
+        assert response.json()["worker"] == owner
+        assert router.metrics()["pinned_sessions"] == 1
+        await client.aclose()
+
+    async def test_session_code_header_only_honoured_behind_router(self):
+        """Test that workers ignore X-Session-Code unless started by the router"""
+        from app.api import sessions
+        from app.config import settings
+        from app.schemas import SessionCreate
+
+        data = SessionCreate(lecturer_name="L", course_name="C")
+        repository = Mock(session_exists=AsyncMock(return_value=False), create_session=AsyncMock())
+        with patch.object(sessions, "repository", repository), patch.object(
+            sessions, "session_cache", Mock()
+        ), patch.object(sessions, "session_manager", Mock()), patch.object(
+            sessions, "state_store", Mock(set_session_start=AsyncMock())
+        ):
+            response = await sessions.start_session(data, x_session_code="ABC123")
+            assert response["sessionId"] != "ABC123"
+
+            with patch.object(settings, "ACCEPT_ROUTER_SESSION_CODES", True):
+                response = await sessions.start_session(data, x_session_code="ABC123")
+            assert response["sessionId"] == "ABC123"
+
+    async def test_router_health_check_rebalances(self):
+        """Test that failing workers leave the ring and recovered ones rejoin"""
+        import httpx
+        from app.router import ShardRouter
+
+        down = {"http://w2:8082"}
+
+        def handler(request):
+            worker = f"{request.url.scheme}://{request.url.host}:{request.url.port}"
+            return httpx.Response(503 if worker in down else 200)
+
+        workers = ["http://w1:8081", "http://w2:8082"]
+        router = ShardRouter(
+            workers, client=httpx.AsyncClient(transport=httpx.MockTransport(handler)), failures_before_removal=2
+        )
+        await router.check_workers()
+        assert router.directory.ring.nodes == workers
+        await router.check_workers()
+        assert router.directory.ring.nodes == ["http://w1:8081"]
+
+        down.clear()
+        await router.check_workers()
+        assert router.directory.ring.nodes == workers
+
+    async def test_router_aggregates_worker_metrics(self):
+        """Test that /metrics through the router reports every worker, including unreachable ones"""
+        import httpx
+        from app.router import ShardRouter
+
+        def handler(request):
+            if request.url.host == "w2":
+                raise httpx.ConnectError("refused")
+            return httpx.Response(200, json={"connections": {"students": 3}})
+
+        workers = ["http://w1:8081", "http://w2:8082"]
+        router = ShardRouter(workers, client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=router), base_url="http://router")
+
+        response = await client.get("/metrics")
+        metrics = response.json()
+        assert metrics["http://w1:8081"] == {"connections": {"students": 3}}
+        assert "error" in metrics["http://w2:8082"]
+
+        response = await client.get("/router/metrics")
+        assert response.json()["http_requests"] == 2
+        await client.aclose()
+
+
+@pytest.mark.unit
+class TestSessionActor:
+    """Test the per-session event actor"""
+
+    @staticmethod
+    def _service():
+        from app.analytics import AnalyticsService
+
+        manager = Mock()
+        manager.broadcast = AsyncMock()
+        manager.broadcast_to_lecturers = AsyncMock()
+        manager.send_to_student = AsyncMock(return_value=True)
+        service = AnalyticsService(MagicMock(), manager, event_sink=Mock(add=AsyncMock()), repository=Mock())
+        service.coalescer.mark_dirty = AsyncMock()
+        return service, manager
+
+    async def test_end_waits_for_answers_queued_before_it(self):
+        """Test that end_session sees every answer queued before it, and later events are dropped"""
+        from app.session_actor import AnswerSubmitted, SessionActors, StudentJoined
+
+        service, manager = self._service()
+        actors = SessionActors(service, manager)
+        await actors.send("s1", StudentJoined("alice", "Alice"))
+        for i in range(5):
+            await actors.send("s1", AnswerSubmitted("alice", f"q{i}", "A", "A", 1000, "Q?"))
+        ending = asyncio.ensure_future(actors.end("s1"))
+        await asyncio.sleep(0)
+        await actors.send("s1", AnswerSubmitted("alice", "q9", "A", "A", 1000, "Q?"))
+
+        result = await ending
+        assert result == {"session_id": "s1", "total_students": 1}
+        sent = manager.send_to_student.await_args_list[0].args[2]["results"]
+        assert sent["total_answers"] == 5
+        assert sent["final_score"] == 5 * 140
+        await asyncio.sleep(0)
+        assert actors.metrics()["actors"] == 0
+        assert actors.metrics()["dropped_after_end"] == 1
+
+    async def test_batch_applies_stats_and_updates_once(self):
+        """Test that a drain cycle increments stats and schedules update frames once"""
+        from app.session_actor import AnswerSubmitted, SessionActors, StudentJoined, StudentLeft, TranscriptChunk
+
+        service, manager = self._service()
+        service.state.increment_stats = AsyncMock(wraps=service.state.increment_stats)
+        chunks = []
+        actors = SessionActors(service, manager, on_transcript=lambda sid, batch: chunks.append((sid, batch)))
+        actor = actors.actor("s1")
+        for name in ("alice", "bob"):
+            actor.queue.put_nowait(StudentJoined(name, name.title()))
+        actor.queue.put_nowait(AnswerSubmitted("alice", "q1", "A", "A", 200))
+        actor.queue.put_nowait(AnswerSubmitted("bob", "q1", "B", "A", 300))
+        actor.queue.put_nowait(TranscriptChunk("first"))
+        actor.queue.put_nowait(TranscriptChunk("second"))
+        actor.queue.put_nowait(StudentLeft("bob"))
+        await actor.stop()
+
+        assert actor.batches == 1
+        service.state.increment_stats.assert_awaited_once_with(
+            "s1", answers=2, correct_answers=1, total_response_time=500
+        )
+        assert [call.args[1]["type"] for call in manager.broadcast.await_args_list] == [
+            "student_joined",
+            "student_joined",
+            "student_left",
+        ]
+        assert sorted(call.args[1] for call in service.coalescer.mark_dirty.await_args_list) == [
+            "analytics",
+            "leaderboard",
+        ]
+        assert chunks == [("s1", ["first", "second"])]
+        assert await service.state.active_student_count("s1") == 1
+
+    async def test_events_after_end_do_not_restart_the_session(self):
+        """Test that leaves arriving after the session ended are dropped instead of starting a new actor"""
+        from app.session_actor import SessionActors, StudentJoined, StudentLeft
+
+        service, manager = self._service()
+        service.end_session = AsyncMock(return_value={"session_id": "s1", "total_students": 1})
+        actors = SessionActors(service, manager)
+        await actors.send("s1", StudentJoined("alice", "Alice"))
+        first = await actors.end("s1")
+        await asyncio.sleep(0)
+
+        await actors.send("s1", StudentLeft("alice"))
+        assert await actors.end("s1") == first
+        assert actors.metrics()["actors"] == 0
+        assert actors.metrics()["dropped_after_end"] == 1
+        service.end_session.assert_awaited_once_with("s1")
+
+    async def test_close_applies_queued_events_before_stopping(self):
+        """Test that shutdown drains every actor's queue and leaves no actor running"""
+        from app.session_actor import AnswerSubmitted, SessionActors, StudentJoined
+
+        service, manager = self._service()
+        actors = SessionActors(service, manager)
+        for session_id in ("s1", "s2"):
+            await actors.send(session_id, StudentJoined("alice", "Alice"))
+            await actors.send(session_id, AnswerSubmitted("alice", "q1", "A", "A", 200))
+        tasks = [actor.task for actor in actors._actors.values()]
+
+        await actors.close()
+        assert all(task.done() and not task.cancelled() for task in tasks)
+        assert actors.metrics()["events"] == 4
+        assert actors.metrics()["dropped"] == 0
+        assert (await service.state.get_stats("s1"))["answers"] == 1
+
+
+@pytest.mark.unit
+class TestWorkerMetrics:
+    """Test the worker metrics endpoint"""
+
+    async def test_metrics_endpoint_reports_every_component(self):
+        """Test that /metrics serves the limiter, state store and listener bridge counters as JSON"""
+        import json
+
+        from app.api import sessions
+
+        metrics = await sessions.worker_metrics()
+
+        assert {"granted", "queued"} <= set(metrics["gemini_limiter"])
+        assert "question_options" in metrics["state_store"]
+        assert {"depth", "delivered"} <= set(metrics["connections"]["listener_bridge"])
+        assert {"actors", "dropped_after_end"} <= set(metrics["session_actors"])
+        assert "evicted_idle" in metrics["transcripts"]
+        json.dumps(metrics)
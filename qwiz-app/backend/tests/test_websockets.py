@@ -2,8 +2,10 @@
 Unit tests for WebSocket connections and real-time communication
 """
 import pytest
-from unittest.mock import Mock
+from unittest.mock import Mock, AsyncMock, patch
 import json
+import asyncio
+from contextlib import contextmanager
 
 
 @pytest.mark.unit
@@ -297,3 +299,312 @@ class TestWebSocketErrorHandling:
         # Should handle gracefully or return 404
         doc = mock_firestore_client.collection("sessions").document("invalid-id").get()
         assert not doc.exists
+
+
+@pytest.mark.unit
+class TestSessionManagerFanOut:
+    """Test per-connection send queues in the real SessionManager"""
+
+    @staticmethod
+    def _make_websocket(send_text=None):
+        websocket = Mock()
+        websocket.accept = AsyncMock()
+        websocket.close = AsyncMock()
+        websocket.send_text = send_text or AsyncMock()
+        return websocket
+
+    @pytest.mark.asyncio
+    async def test_slow_client_does_not_delay_others(self):
+        """Test that a stalled socket does not hold up delivery to the rest of the session"""
+        from app.services import SessionManager
+
+        manager = SessionManager(db_client=Mock(), send_queue_size=8)
+        stalled = asyncio.Event()
+
+        async def never_returns(message):
+            await stalled.wait()
+
+        slow_ws = self._make_websocket(send_text=never_returns)
+        fast_sockets = [self._make_websocket() for _ in range(3)]
+        for ws in [slow_ws, *fast_sockets]:
+            await manager.connect("session-1", ws, "student")
+
+        await manager.broadcast("session-1", {"type": "new_question"})
+        await asyncio.sleep(0)
+
+        for ws in fast_sockets:
+            ws.send_text.assert_awaited_once_with('{"type":"new_question"}')
+
+        for ws in [slow_ws, *fast_sockets]:
+            manager.disconnect("session-1", ws)
+
+    @pytest.mark.asyncio
+    async def test_full_queue_drops_stalled_client(self):
+        """Test that a socket whose queue overflows is removed from the session"""
+        from app.services import SessionManager
+
+        manager = SessionManager(db_client=Mock(), send_queue_size=2)
+        stalled = asyncio.Event()
+
+        async def never_returns(message):
+            await stalled.wait()
+
+        slow_ws = self._make_websocket(send_text=never_returns)
+        fast_ws = self._make_websocket()
+        await manager.connect("session-1", slow_ws, "student")
+        await manager.connect("session-1", fast_ws, "student")
+
+        for i in range(4):
+            await manager.broadcast("session-1", {"type": "tick", "n": i})
+            await asyncio.sleep(0)
+
+        assert slow_ws not in manager.active_sessions["session-1"]
+        assert slow_ws not in manager.writers
+        assert fast_ws.send_text.await_count == 4
+
+        # Disconnecting an already-dropped socket is a no-op
+        manager.disconnect("session-1", slow_ws)
+        manager.disconnect("session-1", fast_ws)
+        assert "session-1" not in manager.active_sessions
+
+    @pytest.mark.asyncio
+    async def test_broadcast_serializes_once(self):
+        """Test that every recipient is sent the same pre-encoded frame"""
+        from app.services import SessionManager
+        from app.connections import encode_json
+
+        manager = SessionManager(db_client=Mock())
+        sockets = [self._make_websocket() for _ in range(5)]
+        for ws in sockets:
+            await manager.connect("session-1", ws, "student")
+
+        message = {"type": "leaderboard_update", "leaderboard": {"students": [{"student_id": "Zoë", "score": 150}]}}
+        with patch("app.connections.encode_json", wraps=encode_json) as mock_encode:
+            await manager.broadcast("session-1", message)
+        await asyncio.sleep(0)
+
+        mock_encode.assert_called_once_with(message)
+        frames = {ws.send_text.await_args.args[0] for ws in sockets}
+        assert len(frames) == 1
+        assert json.loads(frames.pop()) == message
+
+        for ws in sockets:
+            manager.disconnect("session-1", ws)
+
+
+@pytest.mark.unit
+class TestWebSocketEndpoint:
+    """Test the sessions WebSocket endpoint end to end, over FastAPI's TestClient"""
+
+    @staticmethod
+    @contextmanager
+    def _live_app(listener_mode="per_session", backplane=None):
+        """Sessions router on a fresh app: real manager, actors and in-memory state; Firestore is mocked"""
+        from fastapi import FastAPI
+        from fastapi.testclient import TestClient
+        from app.analytics import AnalyticsService
+        from app.api import sessions
+        from app.question_cache import QuestionCache
+        from app.services import SessionManager
+        from app.session_actor import SessionActors
+        from app.session_cache import SessionCache
+        from app.state_store import InMemoryStateStore
+
+        documents = {}
+        repository = Mock()
+        repository.session_exists = AsyncMock(side_effect=lambda session_id: session_id in documents)
+        repository.create_session = AsyncMock(side_effect=lambda session_id, data: documents.update({session_id: data}))
+        repository.get_session = AsyncMock(side_effect=lambda session_id: documents.get(session_id))
+        repository.get_session_sync = Mock(side_effect=lambda session_id: documents.get(session_id))
+        repository.update_session = AsyncMock()
+        repository.get_question = AsyncMock(
+            return_value={"questionText": "Q?", "correctAnswer": "A", "explanation": "Because."}
+        )
+
+        question_cache = QuestionCache(repository)
+        session_cache = SessionCache(repository)
+        state_store = InMemoryStateStore()
+        manager = SessionManager(
+            db_client=Mock(),
+            repository=repository,
+            question_cache=question_cache,
+            session_cache=session_cache,
+            listener_mode=listener_mode,
+            backplane=backplane,
+        )
+        analytics = AnalyticsService(
+            Mock(),
+            manager,
+            event_sink=Mock(add=AsyncMock()),
+            repository=repository,
+            question_cache=question_cache,
+            state=state_store,
+        )
+        actors = SessionActors(analytics, manager, on_transcript=lambda session_id, chunks: None)
+
+        app = FastAPI()
+        app.include_router(sessions.router)
+        with patch.multiple(
+            sessions,
+            repository=repository,
+            question_cache=question_cache,
+            session_cache=session_cache,
+            state_store=state_store,
+            session_manager=manager,
+            analytics_service=analytics,
+            session_actors=actors,
+        ), TestClient(app) as client:
+            yield client, manager, repository
+
+    @staticmethod
+    def _receive(websocket, message_type):
+        """Reads frames until one of the given type arrives (skipping analytics/leaderboard updates)"""
+        while True:
+            message = websocket.receive_json()
+            if message["type"] == message_type:
+                return message
+
+    @staticmethod
+    def _start(client):
+        response = client.post("/start-session", json={"lecturer_name": "Dr. Test", "course_name": "AI"})
+        assert response.status_code == 201
+        return response.json()["sessionId"]
+
+    @staticmethod
+    def _question_change(session_id, question_id):
+        """An ADDED change for a question document under sessions/{session_id}/questions"""
+        document = Mock(id=question_id)
+        document.to_dict.return_value = {
+            "id": question_id,
+            "questionText": "Q?",
+            "options": ["A", "B", "C", "D"],
+            "correctAnswer": "A",
+            "explanation": "Because.",
+        }
+        document.reference.parent.parent.id = session_id
+        change = Mock(document=document)
+        change.type.name = "ADDED"
+        return change
+
+    def _push_question(self, repository, listener_mode, session_id, question_id, initial=()):
+        """Delivers a question written to Firestore through the session's (latest) listener callback"""
+        change = self._question_change(session_id, question_id)
+        if listener_mode == "shared":
+            repository.watch_questions_since.call_args.args[1](None, [change], None)
+        else:
+            on_snapshot = repository.watch_questions.call_args.args[1]
+            on_snapshot(None, list(initial), None)  # First snapshot of the watch: existing questions
+            on_snapshot(None, [change], None)
+
+    def _join(self, student, lecturer, name):
+        """Sends the student's name and waits for the lecturer to be told they joined"""
+        student.send_json({"type": "student_name", "name": name})
+        joined = self._receive(lecturer, "student_joined")
+        assert joined["student_name"] == name
+
+    def _answer(self, student, question_id, option="A"):
+        """Submits an answer and returns the student's answer_result frame"""
+        student.send_json(
+            {
+                "type": "answer_submission",
+                "data": {"question_id": question_id, "selected_option": option, "response_time_ms": 1000},
+            }
+        )
+        return self._receive(student, "answer_result")
+
+    @pytest.mark.parametrize("listener_mode", ["per_session", "shared"])
+    def test_student_joins_answers_and_gets_results(self, listener_mode):
+        """Test join, question delivery, answer and end over the sockets of one session"""
+        with self._live_app(listener_mode) as (client, manager, repository):
+            session_id = self._start(client)
+            with client.websocket_connect(f"/ws/lecturer/{session_id}") as lecturer, client.websocket_connect(
+                f"/ws/student/{session_id}"
+            ) as student:
+                self._join(student, lecturer, "Ada")
+
+                self._push_question(repository, listener_mode, session_id, "q1")
+                question = self._receive(student, "new_question")
+                assert question["question"]["id"] == "q1"
+                assert question["answerTimeSeconds"] == 30
+
+                result = self._answer(student, "q1")
+                assert result["is_correct"] is True
+                assert result["explanation"] == "Because."
+
+                lecturer.send_json({"type": "end_session"})
+                ended = self._receive(student, "session_ended")
+                assert ended["results"]["student_name"] == "Ada"
+                assert ended["results"]["correct_answers"] == 1
+                assert ended["results"]["final_score"] > 0
+                self._receive(lecturer, "session_end_confirmed")
+
+    @pytest.mark.parametrize("listener_mode", ["per_session", "shared"])
+    def test_reconnecting_student_keeps_score(self, listener_mode):
+        """Test that a student who drops and rejoins under the same name keeps their answers and score"""
+        with self._live_app(listener_mode) as (client, manager, repository):
+            session_id = self._start(client)
+            with client.websocket_connect(f"/ws/lecturer/{session_id}") as lecturer:
+                with client.websocket_connect(f"/ws/student/{session_id}") as student:
+                    self._join(student, lecturer, "Ada")
+                    self._push_question(repository, listener_mode, session_id, "q1")
+                    self._receive(student, "new_question")
+                    self._answer(student, "q1")
+                assert self._receive(lecturer, "student_left")["student_id"] == "Ada"
+
+                with client.websocket_connect(f"/ws/student/{session_id}") as student:
+                    self._join(student, lecturer, "Ada")
+                    lecturer.send_json({"type": "end_session"})
+                    results = self._receive(student, "session_ended")["results"]
+                assert results["total_students"] == 1
+                assert results["correct_answers"] == 1
+                assert results["total_answers"] == 1
+
+    def test_reconnected_lecturer_gets_a_new_watch_that_skips_existing_questions(self):
+        """Test that a per-session watch detached when the session empties is re-attached without replays"""
+        with self._live_app("per_session") as (client, manager, repository):
+            session_id = self._start(client)
+            with client.websocket_connect(f"/ws/lecturer/{session_id}"):
+                pass
+            assert not manager.has_listener(session_id)
+            repository.watch_questions.return_value.unsubscribe.assert_called_once()
+
+            with client.websocket_connect(f"/ws/lecturer/{session_id}") as lecturer, client.websocket_connect(
+                f"/ws/student/{session_id}"
+            ) as student:
+                assert repository.watch_questions.call_count == 2
+                self._join(student, lecturer, "Ada")
+                # q1 was written before the reconnect, so the new watch lists it in its first snapshot
+                existing = self._question_change(session_id, "q1")
+                self._push_question(repository, "per_session", session_id, "q2", initial=[existing])
+                assert self._receive(student, "new_question")["question"]["id"] == "q2"
+
+    @pytest.mark.parametrize("listener_mode", ["per_session", "shared"])
+    def test_lecturer_end_over_websocket_detaches_listener(self, listener_mode):
+        """Test that ending from the lecturer socket marks the session ended and detaches its listener"""
+        with self._live_app(listener_mode) as (client, manager, repository):
+            session_id = self._start(client)
+            with client.websocket_connect(f"/ws/lecturer/{session_id}") as lecturer:
+                assert manager.has_listener(session_id)
+                lecturer.send_json({"type": "end_session"})
+                confirmed = self._receive(lecturer, "session_end_confirmed")
+                assert confirmed["session_id"] == session_id
+                assert not manager.has_listener(session_id)
+
+            assert repository.update_session.await_args.args[1]["status"] == "ended"
+            if listener_mode == "per_session":
+                repository.watch_questions.return_value.unsubscribe.assert_called_once()
+
+    def test_lecturer_end_over_websocket_releases_backplane_listener(self):
+        """Test that with a backplane the WS end detaches the listener and frees the session's channel"""
+        from app.backplane import InMemoryBackplane, InMemoryBroker
+
+        backplane = InMemoryBackplane(InMemoryBroker())
+        with self._live_app("per_session", backplane=backplane) as (client, manager, repository):
+            session_id = self._start(client)
+            with client.websocket_connect(f"/ws/lecturer/{session_id}") as lecturer:
+                lecturer.send_json({"type": "end_session"})
+                self._receive(lecturer, "session_end_confirmed")
+
+            assert not manager.has_listener(session_id)
+            repository.watch_questions.return_value.unsubscribe.assert_called_once()
+            assert backplane.metrics()["sessions"] == 0
@@ -146,30 +146,27 @@ export default function StudentPlayPage() {
           setTop(leaderboardData);
         }
       } else if (msg.type === "session_ended") {
-        // Handle session end - find this student's results
-        console.log("🏁 Session ended. All results:", msg.all_results);
-
-        // Find this student's results by name
-        if (msg.all_results) {
-          const myResults = msg.all_results[name];
-          if (myResults) {
-            console.log("📊 My results:", myResults);
-            setSessionResults(myResults);
-            // Clear current question and show results
-            setCurrent(null);
-            setPicked(null);
-            setResults(null);
-            setShowFullLB(false);
-            setExplanation("");
-            setCorrectAnswer("");
-            // Clear timer
-            if (timerIntervalRef.current) {
-              clearInterval(timerIntervalRef.current);
-              timerIntervalRef.current = null;
-            }
-          } else {
-            console.warn("⚠️ Could not find results for student:", name);
+        // Handle session end - the backend sends only this student's results
+        console.log("🏁 Session ended. Results:", msg.results);
+
+        const myResults = msg.results;
+        if (myResults) {
+          console.log("📊 My results:", myResults);
+          setSessionResults(myResults);
+          // Clear current question and show results
+          setCurrent(null);
+          setPicked(null);
+          setResults(null);
+          setShowFullLB(false);
+          setExplanation("");
+          setCorrectAnswer("");
+          // Clear timer
+          if (timerIntervalRef.current) {
+            clearInterval(timerIntervalRef.current);
+            timerIntervalRef.current = null;
           }
+        } else {
+          console.warn("⚠️ Could not find results for student:", name);
         }
       }
     },